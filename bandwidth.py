@@ -0,0 +1,151 @@
+# bandwidth.py
+
+import time
+import threading
+import itertools
+from contextlib import contextmanager
+
+
+class _JobState:
+    """一个任务在带宽管理器中的状态：自身限速的令牌桶、已获得的字节数和正在等待的连接数"""
+
+    def __init__(self, seq, served=0.0):
+        self.seq = seq
+        self.refs = 0  # 正在下载的流数，视频流和音频流各算一个
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.served = served  # 已分配的字节数，除以权重即为虚拟时间
+        self.waiting = 0
+        self.capped = False  # 正在等待自身限速，此时不占用全局带宽的轮次
+
+
+class BandwidthManager:
+    """全局带宽调度：用令牌桶限制总速率，并按权重在同时下载的任务之间分配
+任务以控制对象（例如 DownloadJob）区分，每次取令牌时读取它的 rate_limit（字节/秒，None 为不限）和 weight 属性，
+因此总速率、单任务限速和权重都可以在下载过程中随时调整；任务开始或结束时带宽自动重新分配
+全局带宽不足时，虚拟时间（已获得字节数 / 权重）最小的任务先取令牌，慢任务用不完的带宽会被其他任务用上"""
+
+    def __init__(self, rate=None, burst=0.25):
+        self.rate = rate  # 总速率上限（字节/秒），None 或 0 为不限
+        self.burst = burst  # 令牌桶最多积攒多少秒的令牌
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._states = {}  # 控制对象 -> _JobState
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def set_rate(self, rate):
+        """调整总速率上限，正在等待的连接立即按新速率计算"""
+        with self._cond:
+            self._refill(time.monotonic())
+            self.rate = rate or None
+            self._cond.notify_all()
+
+    def update(self):
+        """任务的 rate_limit 或 weight 被修改后调用，唤醒等待中的连接重新计算"""
+        with self._cond:
+            self._cond.notify_all()
+
+    @contextmanager
+    def track(self, job):
+        """在 with 块内把 job 计为活动任务，同一任务可以嵌套或并发进入多次"""
+        with self._cond:
+            state = self._states.get(job)
+            if state is None:
+                # 新任务从当前最小的虚拟时间开始，既不会被饿死，也不会独占带宽
+                state = _JobState(next(self._seq), self._min_vtime() * self._weight(job))
+                self._states[job] = state
+            state.refs += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                state.refs -= 1
+                if state.refs == 0:
+                    del self._states[job]
+                self._cond.notify_all()  # 任务结束，其余任务分得更多带宽
+
+    def consume(self, job, nbytes, should_stop=None):
+        """为 job 取得 nbytes 字节的令牌，带宽不足时阻塞；等待期间 should_stop() 为真时返回 False"""
+        with self._cond:
+            state = self._states.get(job)
+            if state is None or (not self.rate and not self._limit(job)):
+                if state is not None:
+                    state.served += nbytes
+                return True
+
+            # 空闲过的任务最多落后其他任务 1 秒的带宽，不能靠积攒的虚拟时间长时间独占带宽
+            if self.rate:
+                floor = self._min_vtime(exclude=state, waiting_only=True) - self.rate
+                state.served = max(state.served, floor * self._weight(job))
+            state.waiting += 1
+            try:
+                while True:
+                    if should_stop is not None and should_stop():
+                        return False
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._job_delay(job, state, now, nbytes)
+                    state.capped = delay > 0
+                    if not state.capped and self.rate:
+                        if self._next_in_turn() is not state:
+                            delay = None  # 等待轮到本任务
+                        elif self._tokens < min(nbytes, self._capacity()):
+                            delay = (min(nbytes, self._capacity()) - self._tokens) / self.rate
+                    if delay == 0:
+                        if self._limit(job):
+                            state.tokens -= nbytes
+                        if self.rate:
+                            self._tokens -= nbytes  # 允许透支，下一次取令牌时补上
+                        state.served += nbytes
+                        self._cond.notify_all()
+                        return True
+                    # 限速可能随时被调整，最多等待 0.2 秒就重新计算一次
+                    self._cond.wait(timeout=min(delay, 0.2) if delay else 0.2)
+            finally:
+                state.waiting -= 1
+                state.capped = False
+
+    @staticmethod
+    def _limit(job):
+        return getattr(job, 'rate_limit', None) or None
+
+    @staticmethod
+    def _weight(job):
+        return max(getattr(job, 'weight', 1) or 1, 0.01)
+
+    def _capacity(self):
+        return self.rate * self.burst
+
+    def _refill(self, now):
+        # 调用方需持有 self._cond
+        if self.rate:
+            self._tokens = min(self._capacity(), self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def _job_delay(self, job, state, now, nbytes):
+        # 调用方需持有 self._cond；返回按任务自身限速还需等待的秒数
+        limit = self._limit(job)
+        if not limit:
+            state.last = now
+            return 0
+        capacity = limit * self.burst
+        state.tokens = min(capacity, state.tokens + (now - state.last) * limit)
+        state.last = now
+        needed = min(nbytes, capacity)
+        return 0 if state.tokens >= needed else (needed - state.tokens) / limit
+
+    def _vtime(self, job, state):
+        return state.served / self._weight(job)
+
+    def _min_vtime(self, exclude=None, waiting_only=False):
+        # 调用方需持有 self._cond；其他活动任务（或只算正在等待带宽的任务）中最小的虚拟时间
+        vtimes = [self._vtime(job, state) for job, state in self._states.items()
+                  if state is not exclude and (state.waiting or not waiting_only)]
+        return min(vtimes) if vtimes else 0.0
+
+    def _next_in_turn(self):
+        # 调用方需持有 self._cond；在等待全局带宽的任务中选出虚拟时间最小的一个
+        candidates = [(self._vtime(job, state), state.seq, state) for job, state in self._states.items()
+                      if state.waiting and not state.capped]
+        return min(candidates)[2] if candidates else None
@@ -0,0 +1,125 @@
+# benchmarks/bench_page_extractor.py
+"""页面解析微基准：比较 page_extractor 的单次扫描提取与原来的 BeautifulSoup + 正则方式
+
+用法：
+    python benchmarks/bench_page_extractor.py 保存的页面1.html 保存的页面2.html ...
+不传入页面时使用一个按 B 站视频页结构生成的合成页面。
+保存页面的方法：在浏览器中打开视频页，右键“另存为”仅 HTML，或 curl 带上 Cookie 下载。"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page_extractor import extract_page_data  # noqa: E402
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:  # 原来的方式依赖 beautifulsoup4，未安装时只测新的提取器
+    BeautifulSoup = None
+
+
+def legacy_parse(page_source):
+    # 原来 process_video 中的解析方式：完整构建 DOM 树取标题，再用非贪婪正则匹配 __playinfo__
+    soup = BeautifulSoup(page_source, 'html.parser')
+    title = soup.find('meta', attrs={'name': 'title'})['content']
+    video_info = json.loads(
+        re.search(r'window\.__playinfo__=({.*?})\s*</script>', page_source).group(1))
+    return title, video_info
+
+
+def extractor_parse(page_source):
+    data = extract_page_data(page_source)
+    return data['title'], data['playinfo']
+
+
+def synthetic_page(parts=50, related=40, seed=0):
+    """生成与 B 站视频页结构相近的合成页面：大量内联脚本和样式、__playinfo__ 与 __INITIAL_STATE__"""
+    rng = random.Random(seed)
+
+    def url(kind, i):
+        return (f"https://upos-sz-mirrorcos.bilivideo.com/upgcxcode/{kind}/{i}.m4s"
+                f"?e=ig8euxZM2rNcNbdlhoNvNC8BqJIzNbfqXBvEuENvNC8aNEVEtEvE9IMvXBvE2ENvNCImNEVEIj0Y2J_aug859r1qXg8xNEVE5XREto8GuFGv2U7SuxI72X6fTr859r1qXg8gNEVE5XREto8z5JZC2X2gkX5L5F1eTX1jkXlsTXHeux_f2o859IB_&deadline={int(time.time()) + 7200}"
+                f"&gen=playurlv2&os=cosbv&oi=0&platform=pc&upsig={rng.getrandbits(128):032x}")
+
+    streams = [{"id": q, "base_url": url("video", i), "backup_url": [url("video", i + 100)],
+                "bandwidth": rng.randint(10 ** 5, 10 ** 7), "codecs": "avc1.640032",
+                "width": 1920, "height": h, "segment_base": {"initialization": "0-1000", "index_range": "1001-5000"}}
+               for i, (q, h) in enumerate([(120, 2160), (116, 1080), (80, 1080), (64, 720), (32, 480), (16, 360)] * 3)]
+    playinfo = {"code": 0, "message": "0", "data": {"quality": 80, "timelength": 600000, "dash": {
+        "duration": 600, "video": streams,
+        "audio": [{"id": 30280, "base_url": url("audio", 1), "backup_url": [url("audio", 2)], "codecs": "mp4a.40.2"}]}}}
+    initial_state = {"bvid": "BV1xx411c7mD", "videoData": {
+        "title": "合成测试视频", "desc": "描述" * 500,
+        "pages": [{"cid": 1000 + p, "page": p + 1, "part": f"第{p + 1}集 </script> 标题", "duration": 600}
+                  for p in range(parts)]},
+        "related": [{"bvid": f"BV{rng.getrandbits(40):x}", "title": "相关视频" * 5, "pic": url("pic", r)}
+                    for r in range(related)]}
+
+    head = "".join(f'<link rel="stylesheet" href="//s1.hdslb.com/bfs/static/{i}.css">' for i in range(40))
+    scripts = "".join(f"<script>!function(){{var a{i}={json.dumps(['x' * 80] * 200)};}}();</script>"
+                      for i in range(30))
+    body = "".join(f'<div class="item"><a href="/video/BV{i}">{"内容" * 20}</a></div>' for i in range(3000))
+    return (f'<!DOCTYPE html><html><head><meta charset="UTF-8">{head}'
+            f'<meta data-vue-meta="true" name="title" content="合成测试视频_哔哩哔哩_bilibili">'
+            f'<meta name="keywords" content="测试">{scripts}</head><body>'
+            f'<script>window.__playinfo__={json.dumps(playinfo, ensure_ascii=False)}</script>'
+            f'<script>window.__INITIAL_STATE__={json.dumps(initial_state, ensure_ascii=False)};'
+            f'(function(){{var s;(s=document.currentScript||document.scripts[document.scripts.length-1]).parentNode.removeChild(s);}}());</script>'
+            f'{body}</body></html>')
+
+
+def measure(func, page_source, repeat):
+    """返回 (每次耗时毫秒列表, 峰值内存 KB)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(page_source)
+        times.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    func(page_source)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return times, peak / 1024
+
+
+def main():
+    paths = sys.argv[1:]
+    if paths:
+        pages = []
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                pages.append((os.path.basename(path), f.read()))
+    else:
+        print("未指定保存的页面，使用合成页面")
+        pages = [("synthetic", synthetic_page())]
+
+    candidates = [("page_extractor", extractor_parse)]
+    if BeautifulSoup is not None:
+        candidates.insert(0, ("bs4 + 正则（原方式）", legacy_parse))
+    else:
+        print("未安装 beautifulsoup4，跳过原方式的对比")
+
+    for name, page_source in pages:
+        print(f"\n页面 {name}：{len(page_source) / 1024:.0f} KB")
+        expected = None
+        for label, func in candidates:
+            repeat = 5 if func is legacy_parse else 50
+            times, peak_kb = measure(func, page_source, repeat)
+            times.sort()
+            title, playinfo = func(page_source)
+            if expected is None:
+                expected = (title, playinfo)
+            elif (title, playinfo) != expected:
+                print(f"  警告：{label} 的解析结果与原方式不一致")
+            print(f"  {label:<20} 中位数 {times[len(times) // 2]:8.2f} ms  "
+                  f"最小 {times[0]:8.2f} ms  峰值内存 {peak_kb:10.0f} KB")
+
+
+if __name__ == '__main__':
+    main()
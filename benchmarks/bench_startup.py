@@ -0,0 +1,69 @@
+# benchmarks/bench_startup.py
+"""启动时间基准：比较无图形界面入口（cli.py）与图形界面入口的导入耗时
+
+用法：
+    python benchmarks/bench_startup.py [重复次数，默认 10]
+每次在新的 Python 进程中导入，取中位数；同时列出原来在启动时一次性导入
+selenium、webdriver_manager、tkinter、bs4 的耗时作为对照，未安装的模块会被跳过。"""
+
+import os
+import sys
+import time
+import subprocess
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("cli.py --help", None),
+    ("无界面下载路径", "import cli, link_parser, video_processor, download_scheduler, daemon"),
+    ("图形界面路径", "import gui_app, browser_manager"),
+    ("原来的启动导入", "import tkinter, selenium.webdriver, webdriver_manager.chrome, bs4, gui_app"),
+]
+
+
+def run_once(code):
+    if code is None:
+        command = [sys.executable, os.path.join(ROOT, 'cli.py'), '--help']
+    else:
+        command = [sys.executable, '-c', code]
+    start = time.perf_counter()
+    subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def loaded_heavy_modules(code):
+    # 检查导入后是否加载了 tkinter 或 selenium
+    if code is None:
+        code = "import cli; cli.build_parser()"
+    check = (code + "\nimport sys\nprint(','.join(m for m in ('tkinter', 'selenium', 'webdriver_manager', 'bs4')"
+             " if m in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', check], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.strip() or '无'
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    missing = [m for m in ('tkinter', 'selenium', 'webdriver_manager', 'bs4') if importlib.util.find_spec(m) is None]
+    if missing:
+        print(f"未安装 {', '.join(missing)}，跳过依赖它们的项目")
+
+    run_once("pass")  # 预热文件系统缓存和 .pyc
+    baseline = sorted(run_once("pass") for _ in range(repeat))[repeat // 2]
+    print(f"空解释器启动：{baseline:.0f} ms（以下耗时均包含这部分）\n")
+    for label, code in CASES:
+        if code is not None and any(m in code for m in missing):
+            print(f"  {label:<16} 跳过")
+            continue
+        try:
+            run_once(code)
+            times = sorted(run_once(code) for _ in range(repeat))
+        except subprocess.CalledProcessError:
+            print(f"  {label:<16} 导入失败")
+            continue
+        print(f"  {label:<16} 中位数 {times[repeat // 2]:7.0f} ms  最小 {times[0]:7.0f} ms  "
+              f"加载的重型模块：{loaded_heavy_modules(code)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+# benchmarks/bench_suite.py
+"""下载、页面解析和合并的基准测试套件，使用 fake_cdn 中的本地替身，不需要网络
+
+用法：
+    python benchmarks/bench_suite.py                               运行全部项目
+    python benchmarks/bench_suite.py download merge --repeat 3     只运行指定的项目
+    python benchmarks/bench_suite.py --latency 0.05 --bandwidth 20 模拟首字节延迟 50ms、每连接 20 MB/s
+    python benchmarks/bench_suite.py --json result.json            保存结果
+    python benchmarks/bench_suite.py --baseline result.json        与保存的结果比较，变慢超过 --tolerance 时返回 1
+项目：
+    parse            通过 HTTP 获取视频页并解析标题和播放信息（BilibiliSession + parse_video_page）
+    download         单连接下载视频流（download_file，connections=1）
+    download-seg     多连接分段下载视频流（connections=4）
+    download-faults  分段下载，CDN 随机返回 503 或中途断开（--fail-rate、--disconnect-rate）
+    merge            内置的 fMP4 合并（merge_audio_video，engine='python'）
+    merge-ffmpeg     FFmpeg 合并，未安装 FFmpeg 时跳过
+每个项目在单独的子进程中运行，峰值 RSS 只包含该项目本身；本地替身运行在主进程中。"""
+
+import io
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_cdn import FakeBilibili, make_fmp4  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不统计峰值 RSS
+    resource = None
+
+BENCHMARKS = ('parse', 'download', 'download-seg', 'download-faults', 'merge', 'merge-ffmpeg')
+
+
+class _Control:
+    """代替 DownloadJob 作为下载的控制对象"""
+    stop_download = False
+    rate_limit = None
+    weight = 1
+
+
+def percentile(values, p):
+    """最近秩法的百分位数"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 的单位是 KB，macOS 是字节
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def bench_parse(options):
+    from bilibili_session import BilibiliSession
+    from video_processor import VideoProcessor
+
+    session = BilibiliSession(base_url=options['base_url'], api_url=options['base_url'])
+    processor = VideoProcessor(None, connections=1)
+    session.fetch_video_page(options['bvid'])  # 预热，建立连接不计入耗时
+    times, nbytes = [], 0
+    for i in range(options['repeat'] * 10):  # 单次解析很快，多测几次
+        started = time.perf_counter()
+        page = session.fetch_video_page(options['bvid'])
+        processor.parse_video_page(page)
+        times.append(time.perf_counter() - started)
+        nbytes += len(page.encode('utf-8'))
+    session.close()
+    return times, nbytes, {}
+
+
+def bench_download(options, connections, name):
+    from video_processor import VideoProcessor
+    from metrics import MetricsRegistry
+
+    metrics = MetricsRegistry()
+    processor = VideoProcessor(None, connections=connections, metrics=metrics)
+    url = f"{options['base_url']}/cdn/{options['bvid']}/video.m4s"
+    backup = f"{options['base_url']}/cdn-backup/{options['bvid']}/video.m4s"
+    times, nbytes, retries = [], 0, 0
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(options['repeat']):
+            dest = os.path.join(folder, f"{i}.mp4")
+            stats = metrics.stream(name, f'video-{i}')
+            started = time.perf_counter()
+            ok = processor.download_file(url, dest, {}, _Control(), max_retries=20, retry_delay=0.05,
+                                         backup_urls=[backup], stats=stats)
+            times.append(time.perf_counter() - started)
+            if not ok:
+                raise RuntimeError("下载被中断")
+            nbytes += os.path.getsize(dest)
+            retries += stats.retries
+            os.remove(dest)
+    return times, nbytes, {'retries': retries}
+
+
+def bench_merge(options, engine):
+    from video_processor import VideoProcessor
+
+    processor = VideoProcessor(None, connections=1, keep_intermediate=True)  # 各次运行共用同一组输入文件
+    times, nbytes = [], 0
+    with tempfile.TemporaryDirectory() as folder:
+        video_file = os.path.join(folder, 'video.m4s')
+        audio_file = os.path.join(folder, 'audio.m4s')
+        with open(video_file, 'wb') as f:
+            f.write(make_fmp4(b'vide', options['video_size'], seed=1))
+        with open(audio_file, 'wb') as f:
+            f.write(make_fmp4(b'soun', options['audio_size'], timescale=44100, fragment_size=64 * 1024, seed=2))
+        for i in range(options['repeat']):
+            progress = queue.Queue()
+            started = time.perf_counter()
+            processor.merge_audio_video(video_file, audio_file, folder, f"{i}.mp4", progress, engine=engine)
+            while True:
+                item = progress.get()
+                if item == 'done':
+                    break
+                if isinstance(item, str) and item.startswith('error'):
+                    raise RuntimeError(item)
+            times.append(time.perf_counter() - started)
+            output = os.path.join(folder, f"{i}.mp4")
+            nbytes += os.path.getsize(output)
+            os.remove(output)
+    return times, nbytes, {}
+
+
+def run_worker(name, options):
+    """在子进程中运行一个项目，返回结果字典"""
+    runners = {
+        'parse': lambda: bench_parse(options),
+        'download': lambda: bench_download(options, 1, name),
+        'download-seg': lambda: bench_download(options, 4, name),
+        'download-faults': lambda: bench_download(options, 4, name),
+        'merge': lambda: bench_merge(options, 'python'),
+        'merge-ffmpeg': lambda: bench_merge(options, 'ffmpeg'),
+    }
+    cpu_started = time.process_time()
+    with redirect_stdout(io.StringIO()):  # 下载和合并过程中的日志不输出
+        times, nbytes, extra = runners[name]()
+    total = sum(times)
+    return dict({
+        'runs': len(times),
+        'throughput_mb_s': round(nbytes / total / 1024 / 1024, 2),
+        'p50_ms': round(percentile(times, 50) * 1000, 2),
+        'p95_ms': round(percentile(times, 95) * 1000, 2),
+        'p99_ms': round(percentile(times, 99) * 1000, 2),
+        'cpu_s': round(time.process_time() - cpu_started, 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }, **extra)
+
+
+def run_in_subprocess(name, options):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', name, '--options', json.dumps(options)]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "子进程出错")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """返回变慢超过 tolerance 的项目说明列表"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['throughput_mb_s'] < base['throughput_mb_s'] * (1 - tolerance):
+            regressions.append(f"{name} 吞吐量 {result['throughput_mb_s']} < 基准 {base['throughput_mb_s']} MB/s")
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name} p95 {result['p95_ms']} > 基准 {base['p95_ms']} ms")
+        if result['peak_rss_mb'] and base.get('peak_rss_mb') and \
+                result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name} 峰值 RSS {result['peak_rss_mb']} > 基准 {base['peak_rss_mb']} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载、页面解析和合并的离线基准测试")
+    parser.add_argument('benchmarks', nargs='*', help=f"要运行的项目，默认全部：{', '.join(BENCHMARKS)}")
+    parser.add_argument('--repeat', type=int, default=5, help="每个项目的运行次数（解析为 10 倍）")
+    parser.add_argument('--video-mb', type=float, default=32, help="合成视频流的大小（MB）")
+    parser.add_argument('--audio-mb', type=float, default=4, help="合成音频流的大小（MB）")
+    parser.add_argument('--latency', type=float, default=0.0, help="每个请求的首字节延迟（秒）")
+    parser.add_argument('--bandwidth', type=float, default=0, help="每个连接的限速（MB/s），0 为不限")
+    parser.add_argument('--fail-rate', type=float, default=0.1, help="download-faults 中 CDN 返回 503 的概率")
+    parser.add_argument('--disconnect-rate', type=float, default=0.1, help="download-faults 中响应中途断开的概率")
+    parser.add_argument('--fixtures', help="保存的视频页目录，文件名为 <BV号>.html，parse 使用其中第一个页面")
+    parser.add_argument('--json', help="把结果保存为 JSON 文件")
+    parser.add_argument('--baseline', help="与之前保存的 JSON 结果比较")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="允许的变慢比例（默认 0.2）")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--options', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, json.loads(args.options))))
+        return 0
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"未知的项目: {', '.join(sorted(unknown))}")
+    names = [name for name in BENCHMARKS if not args.benchmarks or name in args.benchmarks]
+    if 'merge-ffmpeg' in names and shutil.which('ffmpeg') is None:
+        print("未找到 FFmpeg，跳过 merge-ffmpeg")
+        names.remove('merge-ffmpeg')
+
+    page_bvid = 'BV1xx411c7mD'
+    if args.fixtures:
+        saved = sorted(f for f in os.listdir(args.fixtures) if f.endswith('.html'))
+        if saved:
+            page_bvid = saved[0][:-len('.html')]
+    options = {'repeat': args.repeat, 'bvid': page_bvid,
+               'video_size': int(args.video_mb * 1024 * 1024), 'audio_size': int(args.audio_mb * 1024 * 1024)}
+    bandwidth = args.bandwidth * 1024 * 1024 or None
+
+    results = {}
+    print(f"{'项目':<16}{'吞吐量 MB/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'CPU s':>8}{'峰值 RSS MB':>12}  其他")
+    for name in names:
+        faults = name == 'download-faults'
+        fake = FakeBilibili(latency=args.latency, bandwidth=bandwidth,
+                            fail_rate=args.fail_rate if faults else 0.0,
+                            disconnect_rate=args.disconnect_rate if faults else 0.0,
+                            video_size=options['video_size'], audio_size=options['audio_size'],
+                            fixtures_dir=args.fixtures).start()
+        try:
+            result = run_in_subprocess(name, dict(options, base_url=fake.base_url,
+                                                  bvid=page_bvid if name == 'parse' else 'BV1bench'))
+        except RuntimeError as ex:
+            print(f"{name:<16}失败：{ex}")
+            continue
+        finally:
+            fake.shutdown()
+        if faults:
+            result.update(injected_failures=fake.stats['failures'], injected_disconnects=fake.stats['disconnects'])
+        results[name] = result
+        extra = ', '.join(f"{k}={v}" for k, v in result.items()
+                          if k in ('retries', 'injected_failures', 'injected_disconnects'))
+        print(f"{name:<16}{result['throughput_mb_s']:>12}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+              f"{result['p99_ms']:>10}{result['cpu_s']:>8}{str(result['peak_rss_mb']):>12}  {extra}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"变慢：{line}")
+        if regressions:
+            return 1
+        print("与基准相比没有明显变慢")
+    return 0 if len(results) == len(names) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
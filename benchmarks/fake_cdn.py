@@ -0,0 +1,364 @@
+# benchmarks/fake_cdn.py
+"""本地的 B 站替身：提供视频页、nav/view 接口和 CDN 上的 DASH 视频流、音频流，基准测试和调试时不必访问真实网站
+
+用法：
+    python benchmarks/fake_cdn.py [--port 8000] [--latency 0.05] [--bandwidth 5] [--fail-rate 0.05] ...
+启动后把 BilibiliSession 的 base_url 和 api_url 指向打印出的地址即可。
+视频页默认按合成模板生成，其中的 __playinfo__ 指向本服务的 /cdn/ 地址；--fixtures 目录中的 <BV号>.html
+（浏览器“另存为”仅 HTML 的视频页）会原样返回，用于比较真实页面的解析速度。
+视频流和音频流是合成的分片 MP4（fMP4），结构与 B 站的 DASH 流相同，可以用内置合并或 FFmpeg 合并。"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import zlib
+import struct
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def _box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def _full_box(box_type, version, flags, payload):
+    return _box(box_type, bytes([version]) + flags.to_bytes(3, 'big') + payload)
+
+
+def make_fmp4(handler, size, track_id=1, timescale=16000, fragment_seconds=1, fragment_size=512 * 1024,
+              seed=0):
+    """生成大约 size 字节的单轨道分片 MP4：ftyp + moov + sidx + 若干 moof/mdat
+handler 为 b'vide' 或 b'soun'；每个片段 fragment_seconds 秒、约 fragment_size 字节，样本内容为确定的伪随机数据"""
+    rng = random.Random(seed)
+    movie_timescale = 1000
+    fragments = max(1, size // fragment_size)
+    samples = 25 if handler == b'vide' else 43  # 每个片段的样本数：25fps 的视频帧，或约 23ms 一帧的 AAC
+    sample_size = max(1, fragment_size // samples)
+    duration = fragments * fragment_seconds * movie_timescale
+
+    tkhd = _full_box(b'tkhd', 0, 3, struct.pack('>IIIII', 0, 0, track_id, 0, duration) + b'\0' * 60)
+    elst = _full_box(b'elst', 0, 0, struct.pack('>IIIhh', 1, duration, 0, 1, 0))
+    mdhd = _full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, timescale, 0, 0x55c4, 0))
+    hdlr = _full_box(b'hdlr', 0, 0, struct.pack('>I4s', 0, handler) + b'\0' * 12 + b'bench\0')
+    stbl = _box(b'stbl', _full_box(b'stsd', 0, 0, struct.pack('>I', 0))
+                + _full_box(b'stts', 0, 0, b'\0' * 4) + _full_box(b'stsc', 0, 0, b'\0' * 4)
+                + _full_box(b'stsz', 0, 0, b'\0' * 8) + _full_box(b'stco', 0, 0, b'\0' * 4))
+    trak = _box(b'trak', tkhd + _box(b'edts', elst) + _box(b'mdia', mdhd + hdlr + _box(b'minf', stbl)))
+    mvhd = _full_box(b'mvhd', 0, 0, struct.pack('>IIII', 0, 0, movie_timescale, duration)
+                     + struct.pack('>IH', 0x10000, 0x100) + b'\0' * 70 + struct.pack('>I', track_id + 1))
+    trex = _full_box(b'trex', 0, 0, struct.pack('>IIIII', track_id, 1, 0, 0, 0))
+    brand = b'avc1' if handler == b'vide' else b'mp4a'
+    parts = [_box(b'ftyp', b'iso5' + struct.pack('>I', 1) + brand + b'iso5dash'),
+             _box(b'moov', mvhd + trak + _box(b'mvex', trex)),
+             _box(b'sidx', b'\0' * 24)]
+
+    fragment_duration = timescale * fragment_seconds
+    sample_duration = fragment_duration // samples
+    for i in range(fragments):
+        tfhd = _full_box(b'tfhd', 0, 0x020000, struct.pack('>I', track_id))  # default-base-is-moof
+        tfdt = _full_box(b'tfdt', 1, 0, struct.pack('>Q', i * fragment_duration))
+        entries = struct.pack('>II', sample_duration, sample_size) * samples
+
+        def moof(data_offset):
+            trun = _full_box(b'trun', 0, 0x000301, struct.pack('>Ii', samples, data_offset) + entries)
+            return _box(b'moof', _full_box(b'mfhd', 0, 0, struct.pack('>I', i + 1)) + _box(b'traf', tfhd + tfdt + trun))
+
+        header = moof(0)
+        parts.append(moof(len(header) + 8))  # 样本数据紧跟在 mdat 头之后
+        parts.append(_box(b'mdat', rng.randbytes(samples * sample_size)))
+    return b''.join(parts)
+
+
+def synthetic_page(bvid, title, cdn_url):
+    """按 B 站视频页的结构生成页面，__playinfo__ 中的视频流和音频流指向 cdn_url（带一个备用镜像地址）"""
+    def stream(kind, stream_id, **extra):
+        base = f"{cdn_url}/cdn/{bvid}/{kind}.m4s?deadline={int(time.time()) + 7200}"
+        backup = f"{cdn_url}/cdn-backup/{bvid}/{kind}.m4s?deadline={int(time.time()) + 7200}"
+        return dict(id=stream_id, base_url=base, backup_url=[backup], **extra)
+
+    playinfo = {"code": 0, "message": "0", "data": {"quality": 80, "timelength": 600000, "dash": {
+        "duration": 600,
+        "video": [stream('video', 80, codecs="avc1.640032", width=1920, height=1080, bandwidth=3000000)],
+        "audio": [stream('audio', 30280, codecs="mp4a.40.2", bandwidth=320000)]}}}
+    initial_state = {"bvid": bvid, "videoData": {
+        "title": title, "pages": [{"cid": 1000, "page": 1, "part": title, "duration": 600}]}}
+    scripts = "".join(f"<script>!function(){{var a{i}={json.dumps(['x' * 80] * 200)};}}();</script>"
+                      for i in range(30))
+    body = "".join(f'<div class="item"><a href="/video/BV{i}">{"内容" * 20}</a></div>' for i in range(3000))
+    return (f'<!DOCTYPE html><html><head><meta charset="UTF-8">'
+            f'<meta data-vue-meta="true" name="title" content="{title}_哔哩哔哩_bilibili">{scripts}</head><body>'
+            f'<script>window.__playinfo__={json.dumps(playinfo, ensure_ascii=False)}</script>'
+            f'<script>window.__INITIAL_STATE__={json.dumps(initial_state, ensure_ascii=False)};</script>'
+            f'{body}</body></html>')
+
+
+class FakeBilibili:
+    """本地 HTTP 服务，模拟 B 站视频页、接口和 CDN：
+latency 为每个请求的首字节延迟（秒）；bandwidth 为每个连接的限速（字节/秒），None 为不限；
+fail_rate 为 CDN 请求直接返回 503 的概率，disconnect_rate 为 CDN 响应发送到一半时断开连接的概率；
+CDN 支持单区间 Range 和 If-Range，ETag 固定，可以测试分段下载、镜像切换和断点续传；
+validators=False 时不返回 ETag，也不处理 If-Range，如同没有校验信息的服务器
+CDN 地址的第一级路径为镜像名（/cdn/、/cdn-backup/，也可以是其他以 cdn 开头的名称），
+mirrors 按镜像名单独设置，例如 {'cdn-backup': {'bandwidth': 100 * 1024, 'latency': 0.5}}，可用的键：
+    latency、bandwidth    覆盖全局的设置
+    status、status_after  前 status_after 个请求正常，之后都返回 status，例如 403 模拟签名链接失效
+    stall_after           每个响应发送这么多字节后不再发送也不断开，模拟卡住的连接"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, bandwidth=None, fail_rate=0.0,
+                 disconnect_rate=0.0, video_size=32 * 1024 * 1024, audio_size=4 * 1024 * 1024,
+                 fixtures_dir=None, seed=0, mirrors=None, validators=True):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fail_rate = fail_rate
+        self.disconnect_rate = disconnect_rate
+        self.video_size = video_size
+        self.audio_size = audio_size
+        self.fixtures_dir = fixtures_dir
+        self.seed = seed
+        self.mirrors = mirrors or {}
+        self.validators = validators
+        self.stats = {'requests': 0, 'failures': 0, 'disconnects': 0, 'bytes': 0}
+        self.mirror_stats = {}  # 镜像名 -> {'requests': CDN 请求数, 'bytes': 发送的字节数}
+        self._media = {}  # (BV号, 'video' 或 'audio') -> bytes
+        self._pages = {}  # BV号 -> 页面 bytes
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()  # 关闭时结束卡住的响应
+        handler = type('Handler', (_Handler,), {'fake': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self._closed.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def media(self, bvid, kind):
+        """返回 BV 号对应的合成视频流或音频流，第一次请求时生成"""
+        with self._lock:
+            data = self._media.get((bvid, kind))
+            if data is None:
+                seed = zlib.crc32(f"{self.seed}/{bvid}/{kind}".encode())
+                if kind == 'video':
+                    data = make_fmp4(b'vide', self.video_size, seed=seed)
+                else:
+                    data = make_fmp4(b'soun', self.audio_size, timescale=44100, fragment_size=64 * 1024,
+                                     seed=seed)
+                self._media[(bvid, kind)] = data
+            return data
+
+    def set_media(self, bvid, kind, data):
+        """替换 BV 号对应的视频流或音频流，模拟服务器上的文件发生变化"""
+        with self._lock:
+            self._media[(bvid, kind)] = data
+
+    def page(self, bvid):
+        with self._lock:
+            data = self._pages.get(bvid)
+            if data is None:
+                fixture = os.path.join(self.fixtures_dir, f"{bvid}.html") if self.fixtures_dir else None
+                if fixture and os.path.exists(fixture):
+                    with open(fixture, 'rb') as f:
+                        data = f.read()
+                else:
+                    data = synthetic_page(bvid, f"基准测试视频 {bvid}", self.base_url).encode('utf-8')
+                self._pages[bvid] = data
+            return data
+
+    def roll(self, probability):
+        # 按概率决定是否注入故障，随机数由 seed 决定，同样的参数每次运行注入的故障相近
+        if not probability:
+            return False
+        with self._lock:
+            return self._rng.random() < probability
+
+    def count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def option(self, mirror, key, default=None):
+        """镜像 mirror 的设置项，没有单独设置时返回 default"""
+        return self.mirrors.get(mirror, {}).get(key, default)
+
+    def count_mirror(self, mirror, key, value=1):
+        """按镜像统计 'requests' 或 'bytes'，返回加上 value 之前的值"""
+        with self._lock:
+            counts = self.mirror_stats.setdefault(mirror, {'requests': 0, 'bytes': 0})
+            counts[key] += value
+            return counts[key] - value
+
+    def hold(self, seconds):
+        """保持连接不发送数据，最多 seconds 秒，服务关闭时提前结束"""
+        self._closed.wait(seconds)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None  # 由 FakeBilibili 设置
+    protocol_version = 'HTTP/1.1'  # 保持连接，与真实 CDN 一样可以复用
+    _MEDIA = re.compile(r'^/(cdn[\w-]*)/(BV[0-9A-Za-z]+)/(video|audio)\.m4s$')
+    _PAGE = re.compile(r'^/video/(BV[0-9A-Za-z]+)/?$')
+    _RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._dispatch(head=True)
+
+    def do_GET(self):
+        self._dispatch(head=False)
+
+    def _dispatch(self, head):
+        fake = self.fake
+        fake.count('requests')
+        url = urlsplit(self.path)
+        media = self._MEDIA.match(url.path)
+        page = self._PAGE.match(url.path)
+        mirror = media.group(1) if media else None
+        latency = fake.option(mirror, 'latency', fake.latency)
+        if latency:
+            time.sleep(latency)
+        try:
+            if media:
+                self._send_media(mirror, fake.media(*media.groups()[1:]), head)
+            elif page:
+                self._send(200, fake.page(page.group(1)), 'text/html; charset=utf-8', head)
+            elif url.path == '/x/web-interface/nav':
+                self._send_json({'isLogin': True, 'mid': 1, 'wbi_img': {
+                    'img_url': 'https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png',
+                    'sub_url': 'https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png'}}, head)
+            elif url.path == '/x/web-interface/view':
+                bvid = parse_qs(url.query).get('bvid', [''])[0]
+                title = f"基准测试视频 {bvid}"
+                self._send_json({'bvid': bvid, 'title': title, 'cid': 1000,
+                                 'pages': [{'cid': 1000, 'page': 1, 'part': title}]}, head)
+            else:
+                self._send(404, b'not found', 'text/plain', head)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端取消了下载
+
+    def _send_json(self, data, head):
+        body = json.dumps({'code': 0, 'message': '0', 'data': data}, ensure_ascii=False).encode('utf-8')
+        self._send(200, body, 'application/json; charset=utf-8', head)
+
+    def _send(self, status, body, content_type, head, extra_headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in extra_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _send_media(self, mirror, data, head):
+        fake = self.fake
+        served = fake.count_mirror(mirror, 'requests')
+        status = fake.option(mirror, 'status')
+        if status and served >= fake.option(mirror, 'status_after', 0):
+            self._send(status, b'mirror failure', 'text/plain', head)
+            return
+        if fake.roll(fake.fail_rate):
+            fake.count('failures')
+            self._send(503, b'injected failure', 'text/plain', head)
+            return
+
+        etag = '"bench-%08x"' % zlib.crc32(data[-4096:])
+        total = len(data)
+        start, end, status = 0, total - 1, 200
+        match = self._RANGE.match(self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range') if fake.validators else None
+        if match and (if_range is None or if_range == etag):
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), total - 1) if last else total - 1
+            elif last:
+                start = max(0, total - int(last))  # bytes=-N 为最后 N 个字节
+            if start >= total or start > end:
+                self._send(416, b'', 'text/plain', head, [('Content-Range', f'bytes */{total}')])
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if fake.validators:
+            self.send_header('ETag', etag)
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{total}')
+        self.end_headers()
+        if head:
+            return
+
+        # 按每个连接的限速分块发送；注入断线时在随机位置停止并关闭连接，设置了 stall_after 时发送到该处后卡住
+        cut = end + 1
+        if fake.roll(fake.disconnect_rate):
+            cut = random.randint(start, end)
+            fake.count('disconnects')
+        stall_after = fake.option(mirror, 'stall_after')
+        stop = min(cut, start + stall_after) if stall_after is not None else cut
+        bandwidth = fake.option(mirror, 'bandwidth', fake.bandwidth)
+        view = memoryview(data)
+        chunk = 64 * 1024
+        started = time.monotonic()
+        pos = start
+        while pos < stop:
+            n = min(chunk, stop - pos)
+            self.wfile.write(view[pos:pos + n])
+            pos += n
+            if bandwidth:
+                ahead = (pos - start) / bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        fake.count('bytes', pos - start)
+        fake.count_mirror(mirror, 'bytes', pos - start)
+        if stop < cut:
+            self.wfile.flush()
+            fake.hold(60)
+        if pos <= end:
+            self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地的 B 站视频页和 CDN 替身")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help="每个请求的首字节延迟（秒）")
+    parser.add_argument('--bandwidth', type=float, default=0, help="每个连接的限速（MB/s），0 为不限")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="CDN 请求返回 503 的概率")
+    parser.add_argument('--disconnect-rate', type=float, default=0.0, help="CDN 响应中途断开的概率")
+    parser.add_argument('--video-mb', type=float, default=32, help="合成视频流的大小（MB）")
+    parser.add_argument('--audio-mb', type=float, default=4, help="合成音频流的大小（MB）")
+    parser.add_argument('--fixtures', help="保存的视频页目录，文件名为 <BV号>.html")
+    args = parser.parse_args()
+
+    fake = FakeBilibili(args.host, args.port, args.latency, args.bandwidth * 1024 * 1024 or None,
+                        args.fail_rate, args.disconnect_rate, int(args.video_mb * 1024 * 1024),
+                        int(args.audio_mb * 1024 * 1024), args.fixtures)
+    print(f"已启动：{fake.base_url}/video/BV1xx411c7mD/")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+        print(json.dumps(fake.stats), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# bilibili_session.py
+
+import time
+import hashlib
+import threading
+from urllib.parse import urlencode
+import requests
+from requests.adapters import HTTPAdapter
+
+# WBI 签名的混淆表：img_key + sub_key 按此顺序重排后取前 32 个字符作为签名密钥
+_MIXIN_KEY_TABLE = [
+    46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49,
+    33, 9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13, 37, 48, 7, 16, 24, 55, 40, 61,
+    26, 17, 0, 1, 60, 51, 30, 4, 22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11, 36,
+    20, 34, 44, 52,
+]
+
+
+class PlayinfoNotFound(Exception):
+    """页面中没有找到 window.__playinfo__，通常是 Cookie 失效或被风控，需要回退到浏览器"""
+
+
+class BilibiliApiError(Exception):
+    """接口返回的 code 不为 0，例如视频不存在（-404）或请求被风控（-352、-412、-799）"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{message}（code={code}）")
+        self.code = code
+
+
+class BilibiliSession:
+    """基于 requests 的 B 站会话：复用 Selenium 登录后导出的 Cookie，直接通过 HTTP 获取视频页面
+连接池保持长连接，多个任务可以同时查询，不必排队等待唯一的浏览器"""
+
+    def __init__(self, base_url='https://www.bilibili.com', api_url='https://api.bilibili.com',
+                 pool_size=8, timeout=10):
+        self.base_url = base_url.rstrip('/')  # 测试时可以指向本地的 HTTP 服务
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "referer": "https://www.bilibili.com",
+            "User-Agent": 'Mozilla/5.0'
+        })
+        self.wbi_key_ttl = 3600  # WBI 密钥每天更换，缓存一小时
+        self._wbi_keys = None  # (img_key, sub_key, 获取时间)
+        self._wbi_lock = threading.Lock()
+
+    @classmethod
+    def from_browser(cls, driver, **kwargs):
+        """从已登录的 Selenium 浏览器创建会话"""
+        session = cls(**kwargs)
+        session.load_cookies_from_browser(driver)
+        return session
+
+    def load_cookies_from_browser(self, driver):
+        # 导出浏览器中的 Cookie，并使用与浏览器相同的 User-Agent，避免被当作不同的客户端
+        self.load_cookies(driver.get_cookies())
+        try:
+            self.session.headers['User-Agent'] = driver.execute_script("return navigator.userAgent")
+        except Exception as ex:
+            print(f"获取浏览器 User-Agent 失败: {ex}")
+
+    def load_cookies(self, cookies):
+        """载入 Selenium 格式的 Cookie 列表（包含 name、value、domain、path 等字段的字典）"""
+        for cookie in cookies:
+            self.session.cookies.set(cookie['name'], cookie['value'],
+                                     domain=cookie.get('domain'), path=cookie.get('path', '/'),
+                                     expires=cookie.get('expiry'))
+
+    def export_cookies(self):
+        """导出为 Selenium 格式的 Cookie 列表，可以保存到磁盘或注入浏览器"""
+        cookies = []
+        for cookie in self.session.cookies:
+            item = {'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain,
+                    'path': cookie.path, 'secure': bool(cookie.secure)}
+            if cookie.expires:
+                item['expiry'] = int(cookie.expires)
+            cookies.append(item)
+        return cookies
+
+    def account_id(self):
+        """当前 Cookie 所属账号的 mid（Cookie DedeUserID），没有登录 Cookie 时为空字符串；只读 Cookie，不发请求"""
+        for cookie in self.session.cookies:
+            if cookie.name == 'DedeUserID':
+                return cookie.value
+        return ''
+
+    def is_logged_in(self, uid=None):
+        """只发一次 nav 接口请求校验登录状态，传入 uid 时还会核对登录的是否是该账号
+网络错误、超时或服务器出错（5xx、返回内容无法解析）时无法判断，返回 None 而不是 False"""
+        try:
+            r = self.session.get(f'{self.api_url}/x/web-interface/nav', timeout=self.timeout)
+            r.raise_for_status()
+            data = r.json().get('data') or {}
+        except (requests.exceptions.RequestException, ValueError) as ex:
+            print(f"校验登录状态失败: {ex}")
+            return None
+        if not data.get('isLogin'):
+            return False
+        return not uid or str(data.get('mid')) == str(uid)
+
+    def get_api(self, path, params=None, wbi=False):
+        """请求 JSON 接口，返回其中的 data 字段，code 不为 0 时抛出 BilibiliApiError
+wbi=True 时按 WBI 规则签名，空间投稿列表等接口需要"""
+        if wbi:
+            params = sign_wbi(params or {}, *self.get_wbi_keys())
+        r = self.session.get(f'{self.api_url}{path}', params=params, timeout=self.timeout)
+        r.raise_for_status()
+        body = r.json()
+        if body.get('code') != 0:
+            if wbi and body.get('code') == -403:
+                self._wbi_keys = None  # 密钥可能已更换，下次请求时重新获取
+            raise BilibiliApiError(body.get('code'), body.get('message'))
+        return body.get('data')
+
+    def get_wbi_keys(self):
+        """返回 WBI 签名用的 (img_key, sub_key)，未登录时 nav 接口同样会返回"""
+        with self._wbi_lock:
+            if self._wbi_keys is None or time.time() - self._wbi_keys[2] > self.wbi_key_ttl:
+                # 未登录时 nav 的 code 为 -101，不能用 get_api
+                r = self.session.get(f'{self.api_url}/x/web-interface/nav', timeout=self.timeout)
+                r.raise_for_status()
+                wbi_img = r.json()['data']['wbi_img']
+                self._wbi_keys = (_url_key(wbi_img['img_url']), _url_key(wbi_img['sub_url']), time.time())
+            return self._wbi_keys[:2]
+
+    def fetch_video_page(self, video_id, page=None):
+        """通过 HTTP 获取视频页面源码，page 为分P序号（从 1 开始），页面中没有播放信息时抛出 PlayinfoNotFound"""
+        params = {'p': page} if page and page > 1 else None
+        r = self.session.get(f'{self.base_url}/video/{video_id}/', params=params, timeout=self.timeout)
+        r.raise_for_status()
+        if 'charset' not in r.headers.get('Content-Type', ''):
+            r.encoding = 'utf-8'  # 未声明编码时 requests 默认按 ISO-8859-1 解码，中文标题会乱码
+        if 'window.__playinfo__' not in r.text:
+            raise PlayinfoNotFound(f"{video_id} 的页面中没有播放信息")
+        return r.text
+
+    def close(self):
+        self.session.close()
+
+
+def _url_key(url):
+    # https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png -> 7cd084941338484aae1ad9425b84077c
+    return url.rsplit('/', 1)[-1].split('.')[0]
+
+
+def sign_wbi(params, img_key, sub_key, wts=None):
+    """按 WBI 规则签名：加上时间戳 wts，按键排序并去掉值中的 !'()* 后计算 w_rid，返回新的参数字典"""
+    mixin_key = ''.join((img_key + sub_key)[i] for i in _MIXIN_KEY_TABLE)[:32]
+    params = dict(params, wts=int(time.time() if wts is None else wts))
+    signed = {key: ''.join(c for c in str(value) if c not in "!'()*") for key, value in sorted(params.items())}
+    signed['w_rid'] = hashlib.md5((urlencode(signed) + mixin_key).encode()).hexdigest()
+    return signed
@@ -3,13 +3,10 @@
 import os
 import sys
 import time
-from selenium import webdriver
-from selenium.webdriver.common.by import By  # 导入定位元素的方法
-from selenium.webdriver.chrome.service import Service  # 导入Chrome浏览器的Service
-from selenium.webdriver.chrome.options import Options  # 导入Chrome浏览器的选项配置
-from webdriver_manager.chrome import ChromeDriverManager  # 导入webdriver_manager，用于自动管理ChromeDriver
+import threading
 from dotenv import load_dotenv  # 导入dotenv，用于加载环境变量
-from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
+from bilibili_session import BilibiliSession
+from session_store import SessionStore
 
 # 加载 .env 文件中的环境变量，例如Bilibili的用户名、密码和UID
 load_dotenv()
@@ -18,40 +15,113 @@ class BrowserManager:
     """浏览器管理类，负责初始化和登录操作
 注：此模块仅作为演示自动化操作的实现，实际使用时，不必一定非要使用账号密码登录，会遇到至少一层验证码（运气好就是两层）
 你也可以在自动化登录触发验证码时点叉，关掉验证框进行扫码登录（但是扫码的账号的 UID 一定要是.env文件中对应账号的）
-我在代码中在验证密码时设置了很长的循环等待时间，所以不必担心超时"""
-
-    def __init__(self):
-        # 创建并初始化浏览器实例
-        self.browser = create_browser_instance()
+我在代码中在验证密码时设置了很长的循环等待时间，所以不必担心超时
+登录成功后 Cookie 会保存到磁盘，之后启动时先用一次 HTTP 请求校验，仍然有效就不再启动浏览器
+selenium 只在真正需要启动浏览器时才导入；allow_browser=False 时（无界面的服务器、定时任务）
+从不启动浏览器，保存的登录状态失效时以未登录状态继续"""
+
+    def __init__(self, session_store=None, allow_browser=True):
+        self.session_store = session_store or SessionStore()
+        self.http_session = BilibiliSession()  # 携带登录 Cookie 的 HTTP 会话
+        self.browser = None  # 浏览器按需启动
+        self.allow_browser = allow_browser
+        self._lock = threading.Lock()
+        self.ensure_login()
+
+    def ensure_login(self):
+        """恢复保存的登录状态，已失效时才启动浏览器进行交互式登录"""
+        stored = self.session_store.load()
+        if stored.get('cookies'):
+            self.http_session.load_cookies(stored['cookies'])
+            if stored.get('user_agent'):
+                self.http_session.session.headers['User-Agent'] = stored['user_agent']
+            logged_in = self.http_session.is_logged_in(os.getenv('BILIBILI_UID'))
+            if logged_in:
+                print("已恢复保存的登录状态，跳过浏览器登录")
+                # 保存服务器可能刷新过的 Cookie
+                self.session_store.save(cookies=self.http_session.export_cookies())
+                return
+            if logged_in is None:
+                # 网络错误时无法判断，保留保存的 Cookie 继续使用，不因一次请求失败就要求重新登录
+                print("暂时无法校验登录状态，继续使用保存的登录状态")
+                return
+            print("保存的登录状态已失效，需要重新登录")
+            self.session_store.clear_cookies()
+            self.http_session.session.cookies.clear()
+        if not self.allow_browser:
+            print("未登录：当前模式不启动浏览器，将以未登录状态下载（清晰度可能受限）")
+            return
+        self.get_browser()
 
     def get_browser(self):
-        # 提供获取浏览器实例的方法
-        return self.browser
-
+        # 提供获取浏览器实例的方法，第一次调用时才启动浏览器
+        with self._lock:
+            if self.browser is None:
+                if not self.allow_browser:
+                    raise RuntimeError("当前模式不允许启动浏览器，请先在图形界面或使用 --login 登录一次")
+                stored = self.session_store.load()
+                driver_path = self.get_driver_path(stored)
+                self.browser = create_browser_instance(driver_path, stored.get('cookies'))
+                # 把浏览器中的登录状态同步给 HTTP 会话并保存到磁盘
+                self.http_session.load_cookies_from_browser(self.browser)
+                self.session_store.save(cookies=self.browser.get_cookies(),
+                                        user_agent=self.http_session.session.headers['User-Agent'])
+            return self.browser
+
+    def get_http_session(self):
+        return self.http_session
+
+    def get_driver_path(self, stored):
+        """返回 ChromeDriver 路径，优先使用上次保存且仍然存在的路径，避免每次都重新下载驱动"""
+        driver_path = stored.get('driver_path')
+        if driver_path and os.path.exists(driver_path):
+            return driver_path
+        from webdriver_manager.chrome import ChromeDriverManager  # 只在需要下载驱动时导入
+        # 自动安装并获取ChromeDriver的路径，无需手动配置驱动路径甚至环境变量
+        driver_path = ChromeDriverManager().install()
+        print(f"webdriver_manager下载使用的 ChromeDriver 路径: {driver_path}")
+        self.session_store.save(driver_path=driver_path)
+        return driver_path
+
+    def quit(self):
+        with self._lock:
+            if self.browser is not None:
+                self.browser.quit()
+                self.browser = None
+
+
+def create_browser_instance(driver_path, cookies=None):
+    # selenium 导入较慢，只在启动浏览器时导入
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By  # 导入定位元素的方法
+    from selenium.webdriver.chrome.service import Service  # 导入Chrome浏览器的Service
+    from selenium.webdriver.chrome.options import Options  # 导入Chrome浏览器的选项配置
+    from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
 
-def create_browser_instance():
     # 从环境变量中获取Bilibili的用户名、密码和UID
     USERNAME = os.getenv('BILIBILI_USERNAME')
     PASSWORD = os.getenv('BILIBILI_PASSWORD')
     UID = os.getenv('BILIBILI_UID')
 
-    # 检查是否成功获取到必要的环境变量
-    if not USERNAME or not PASSWORD or not UID:
-        raise ValueError("环境变量 BILIBILI_USERNAME, BILIBILI_PASSWORD 或 BILIBILI_UID 未正确加载")
-
     # 设置Chrome浏览器的选项
     chrome_options = Options()
     chrome_options.add_argument("--no-sandbox")  # 解决DevToolsActivePort文件不存在的报错
     chrome_options.add_argument("--disable-dev-shm-usage")  # 解决共享内存不足的问题
 
-    # 自动安装并获取ChromeDriver的路径，无需手动配置驱动路径甚至环境变量，缺点是每次都会重新下载驱动
-    driver_path = ChromeDriverManager().install()
-    print(f"webdriver_manager下载使用的 ChromeDriver 路径: {driver_path}")
-
     # 创建Chrome浏览器实例
     driver = webdriver.Chrome(service=Service(driver_path), options=chrome_options)
     driver.implicitly_wait(10)  # 设置隐式等待时间为5秒
 
+    # 有保存的 Cookie 时先尝试直接注入，仍处于登录状态就不必再输入账号密码
+    if cookies and UID and restore_cookies(driver, cookies, UID):
+        print("已使用保存的登录状态打开浏览器")
+        return driver
+
+    # 检查是否成功获取到必要的环境变量
+    if not USERNAME or not PASSWORD or not UID:
+        driver.quit()
+        raise ValueError("环境变量 BILIBILI_USERNAME, BILIBILI_PASSWORD 或 BILIBILI_UID 未正确加载")
+
     print("正在打开 bilibili...")
     driver.get("https://account.bilibili.com/login")
 
@@ -109,4 +179,25 @@ def create_browser_instance():
     if not logged_in:
         print("\n登录超时，未检测到 UID。")
         driver.quit()
-        raise TimeoutError("登录超时，未成功检测到登录状态。")
\ No newline at end of file
+        raise TimeoutError("登录超时，未成功检测到登录状态。")
+
+
+def restore_cookies(driver, cookies, uid):
+    """把保存的 Cookie 注入浏览器并刷新页面，检测头像链接中是否包含 UID 判断是否已登录"""
+    from selenium.webdriver.common.by import By
+    from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
+
+    driver.get("https://www.bilibili.com")
+    for cookie in cookies:
+        cookie = {key: cookie[key] for key in ('name', 'value', 'domain', 'path', 'expiry', 'secure')
+                  if cookie.get(key) is not None}
+        try:
+            driver.add_cookie(cookie)
+        except WebDriverException as e:
+            print(f"注入 Cookie {cookie['name']} 失败: {e}")
+    driver.refresh()
+    try:
+        avatar_href = driver.find_element(By.CSS_SELECTOR, "a.header-entry-avatar").get_attribute("href")
+        return uid in (avatar_href or '')
+    except (NoSuchElementException, TimeoutException):
+        return False
\ No newline at end of file
@@ -0,0 +1,171 @@
+# cli.py
+"""命令行入口：不打开图形界面，也不导入 tkinter 和 selenium，适合服务器、定时任务和脚本
+
+    python cli.py download BV1xxxxxxxxx https://b23.tv/xxxx ...   下载完成后退出
+    python cli.py download https://space.bilibili.com/<mid>        多P视频、合集、视频列表和 UP 主空间会展开为分P
+    python cli.py download -i list.txt                             从文件读取（- 表示标准输入）
+    python cli.py serve --port 8765                                后台服务，通过 HTTP/JSON 接口提交任务
+
+使用保存的登录状态（先在图形界面登录一次，或加 --login 允许启动浏览器登录），
+登录状态失效且不允许启动浏览器时以未登录状态下载。"""
+
+import os
+import sys
+import argparse
+import threading
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description="B站视频下载（无图形界面）")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--workers', type=int, default=2, help="同时下载的任务数（默认 2）")
+    common.add_argument('--connections', type=int, default=4, help="每个流的并行连接数，1 为单连接（默认 4）")
+    common.add_argument('--rate', type=float, default=0, help="总限速，MB/s，0 为不限（默认 0）")
+    common.add_argument('--merge-mode', choices=('files', 'stream'), default='files',
+                        help="files：先下载再合并，可断点续传；stream：边下载边合并（需要 FFmpeg）")
+    common.add_argument('--engine', choices=('auto', 'python', 'ffmpeg'), default='auto',
+                        help="合并引擎（默认 auto：内置合并，失败时用 FFmpeg）")
+    common.add_argument('--merge-workers', type=int, help="同时进行的合并数（默认按 CPU 核数，最多 2）")
+    common.add_argument('--merge-queue', type=int,
+                        help="最多几个已下载完的视频排队等待合并，排满后暂停开始新的下载（默认与合并数相同）")
+    common.add_argument('--keep-intermediate', action='store_true', help="合并后保留 download 目录中的视频流和音频流")
+    common.add_argument('--login', action='store_true', help="保存的登录状态失效时允许启动浏览器登录")
+
+    commands = parser.add_subparsers(dest='command', required=True)
+    download = commands.add_parser('download', parents=[common], help="下载指定的视频后退出")
+    download.add_argument('inputs', nargs='*', help="BV 号、视频链接（包括 b23.tv 短链接）、合集或 UP 主空间链接")
+    download.add_argument('-i', '--input-file', help="包含 BV 号或链接的文本文件，- 表示标准输入")
+    download.add_argument('-q', '--quiet', action='store_true', help="不输出进度")
+
+    serve = commands.add_parser('serve', parents=[common], help="启动后台服务，通过 HTTP/JSON 接口接收任务")
+    serve.add_argument('--host', default='127.0.0.1', help="监听地址（默认 127.0.0.1，仅本机可访问）")
+    serve.add_argument('--port', type=int, default=8765, help="监听端口（默认 8765）")
+    serve.add_argument('--token', default=os.getenv('BILIBILI_DAEMON_TOKEN'),
+                       help="访问令牌，请求需带 Authorization: Bearer <token>（默认读取 BILIBILI_DAEMON_TOKEN，"
+                            "都没有时随机生成并在启动时打印）")
+    return parser
+
+
+def create_scheduler(args, listener=None, download_index=None):
+    """按命令行参数创建 (浏览器管理器, 调度器, 传输指标)"""
+    # 下载相关的模块只在真正执行命令时才导入，--help 等可以立即返回
+    from browser_manager import BrowserManager
+    from video_processor import VideoProcessor, DEFAULT_HEADERS
+    from download_scheduler import DownloadScheduler
+    from metadata_cache import MetadataCache
+    from metrics import MetricsRegistry
+
+    browser_manager = BrowserManager(allow_browser=args.login)
+    metrics = MetricsRegistry(log_path=os.path.join('logs', 'transfers.jsonl'),
+                              snapshot_path=os.path.join('logs', 'metrics.prom'))
+    video_processor = VideoProcessor(browser_manager, connections=args.connections,
+                                     http_session=browser_manager.get_http_session(),
+                                     metadata_cache=MetadataCache(cache_dir=os.path.join('cache', 'metadata')),
+                                     merge_mode=args.merge_mode, merge_engine=args.engine, metrics=metrics,
+                                     download_index=download_index or open_index(),
+                                     merge_workers=args.merge_workers, merge_queue=args.merge_queue,
+                                     keep_intermediate=args.keep_intermediate)
+    scheduler = DownloadScheduler(video_processor, DEFAULT_HEADERS, args.workers, listener=listener)
+    if args.rate > 0:
+        scheduler.set_bandwidth(int(args.rate * 1024 * 1024))
+    return browser_manager, scheduler, metrics
+
+
+def open_index():
+    """打开已完成下载的索引，与图形界面共用同一个文件"""
+    from download_index import DownloadIndex
+    return DownloadIndex(os.path.join('cache', 'downloads.sqlite3'))
+
+
+def read_inputs(args):
+    text = '\n'.join(args.inputs)
+    if args.input_file == '-':
+        text += '\n' + sys.stdin.read()
+    elif args.input_file:
+        with open(args.input_file, 'r', encoding='utf-8') as f:
+            text += '\n' + f.read()
+    return text
+
+
+def run_download(args):
+    from enumerator import Enumerator, parse_targets
+    from metrics import ProgressEvents
+
+    targets = parse_targets(read_inputs(args))
+    if not targets:
+        print("未找到有效的视频 ID", file=sys.stderr)
+        return 2
+    # 先只查本地索引，输入的视频都已下载时连登录校验也不做
+    download_index = open_index()
+    if all(target[0] == 'video' and download_index.is_complete(target[1], target[2]) for target in targets):
+        print(f"输入的 {len(targets)} 个视频都已下载，无需重新下载（删除输出文件后可重新下载）")
+        return 0
+
+    print_lock = threading.Lock()
+    metrics_ref = []
+
+    def print_progress():
+        # 进度事件已合并，每个任务最多每秒输出一行
+        for job in events.drain():
+            line = f"[{job.key}] {job.status} {job.progress:.0f}%"
+            if job.status == 'running' and metrics_ref:
+                line += f" {metrics_ref[0].job_speed(job.key) / 1024 / 1024:.1f} MB/s"
+            if job.error:
+                line += f" {job.error}"
+            with print_lock:
+                print(line, flush=True)
+
+    events = ProgressEvents(print_progress, interval=1.0)
+    browser_manager, scheduler, metrics = create_scheduler(
+        args, listener=None if args.quiet else events.publish, download_index=download_index)
+    metrics_ref.append(metrics)
+    jobs = []
+    try:
+        enumerator = Enumerator(browser_manager.get_http_session(), download_index)
+        # 边展开边提交，列表很长时前面的视频已经开始下载
+        enumerator.expand(targets, lambda part: jobs.append(scheduler.submit_part(part)))
+        if not jobs:
+            print("没有展开出可下载的视频", file=sys.stderr)
+            return 1
+        scheduler.wait([job.job_id for job in jobs])
+        if not args.quiet:
+            print_progress()
+    except KeyboardInterrupt:
+        print("\n已中断，再次运行相同的命令会从断点继续下载")
+        return 130
+    finally:
+        scheduler.shutdown()
+        browser_manager.quit()
+
+    failed = [job for job in jobs if job.status != 'done']
+    for job in failed:
+        print(f"{job.key} 未完成：{job.error or job.status}", file=sys.stderr)
+    print(f"完成 {len(jobs) - len(failed)}/{len(jobs)} 个任务")
+    return 1 if failed else 0
+
+
+def run_serve(args):
+    from daemon import DownloadDaemon
+
+    browser_manager, scheduler, metrics = create_scheduler(args)
+    daemon = DownloadDaemon(scheduler, metrics, args.host, args.port, args.token)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止服务，运行中的任务会保留断点")
+    finally:
+        daemon.shutdown()
+        scheduler.shutdown()
+        browser_manager.quit()
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'download':
+        return run_download(args)
+    return run_serve(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+# daemon.py
+
+import json
+import hmac
+import secrets
+import threading
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from enumerator import Enumerator, parse_targets
+
+
+class ApiError(Exception):
+    """请求不合法，status 为返回的 HTTP 状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class DownloadDaemon:
+    """后台下载服务：通过本机的 HTTP/JSON 接口接收和管理下载任务
+    GET  /jobs                    列出所有任务
+    POST /jobs                    提交任务，{"input": "链接或 BV 号文本"} 或 {"video_ids": [...]}，可带 "priority"；
+                                  多P视频、合集和空间在后台展开，边展开边加入队列，立即返回 202
+    GET  /jobs/<id>               查看任务
+    POST /jobs/<id>/pause|resume|cancel
+    POST /jobs/<id>/priority      {"priority": 数值}
+    POST /jobs/<id>/bandwidth     {"rate_limit": 字节每秒或 null, "weight": 数值}
+    POST /bandwidth               {"rate": 字节每秒或 null}，总限速
+    GET  /metrics                 Prometheus 文本格式的传输指标
+默认只监听 127.0.0.1；所有请求都需要带上 Authorization: Bearer <token>，未指定 token 时随机生成并在启动时打印
+POST 请求的 Content-Type 必须是 application/json，带有其他网站 Origin 的请求一律拒绝，
+浏览器中打开的网页无法不经预检就向本机接口提交任务（CSRF）"""
+
+    def __init__(self, scheduler, metrics, host='127.0.0.1', port=8765, token=None):
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.token = token or secrets.token_urlsafe(24)
+        self.generated_token = not token
+        self.enumerator = Enumerator(scheduler.video_processor.http_session,
+                                     scheduler.video_processor.download_index)
+        handler = type('Handler', (_ApiHandler,), {'daemon': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def serve_forever(self):
+        host, port = self.address
+        print(f"后台服务已启动：http://{host}:{port}/jobs")
+        if self.generated_token:
+            print(f"本次随机生成的访问令牌（请求需带 Authorization: Bearer <令牌>）：{self.token}")
+        self.server.serve_forever()
+
+    def start(self):
+        """在后台线程中运行，返回线程"""
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, method, path, body):
+        # 返回 (状态码, JSON 对象或文本)
+        parts = [p for p in urlsplit(path).path.split('/') if p]
+        scheduler = self.scheduler
+
+        if parts == ['metrics'] and method == 'GET':
+            return 200, self.metrics.prometheus_text()
+        if parts == ['bandwidth'] and method == 'POST':
+            scheduler.set_bandwidth(self._optional_number(body, 'rate'))
+            return 200, {'rate': scheduler.video_processor.bandwidth.rate}
+        if parts == ['jobs']:
+            if method == 'GET':
+                return 200, [job.to_dict() for job in list(scheduler.jobs.values())]
+            if method == 'POST':
+                return 202, {'status': 'enumerating', 'targets': self._submit(body)}
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            job = self._job(parts[1])
+            action = parts[2] if len(parts) == 3 else None
+            if len(parts) == 2 and method == 'GET':
+                return 200, job.to_dict()
+            if method == 'POST' and action in ('pause', 'resume', 'cancel'):
+                getattr(scheduler, action)(job.job_id)
+                return 200, job.to_dict()
+            if method == 'POST' and action == 'priority':
+                priority = body.get('priority')
+                if not isinstance(priority, int):
+                    raise ApiError(400, "priority 必须是整数")
+                scheduler.set_priority(job.job_id, priority)
+                return 200, job.to_dict()
+            if method == 'POST' and action == 'bandwidth':
+                weight = self._optional_number(body, 'weight')
+                scheduler.set_job_bandwidth(job.job_id, self._optional_number(body, 'rate_limit'), weight)
+                return 200, job.to_dict()
+        raise ApiError(404, f"不支持的请求：{method} {path}")
+
+    def _submit(self, body):
+        priority = body.get('priority', 0)
+        if not isinstance(priority, int):
+            raise ApiError(400, "priority 必须是整数")
+        video_ids = body.get('video_ids')
+        if video_ids is None:
+            text = body.get('input')
+            if not isinstance(text, str):
+                raise ApiError(400, "需要 input（文本）或 video_ids（列表）")
+            targets = parse_targets(text)
+        elif not (isinstance(video_ids, list) and all(isinstance(v, str) for v in video_ids)):
+            raise ApiError(400, "video_ids 必须是字符串列表")
+        else:
+            targets = parse_targets(' '.join(video_ids))
+        if not targets:
+            raise ApiError(400, "未找到有效的视频 ID")
+        # 展开可能需要很多次接口请求，在后台进行，展开出的分P陆续出现在 GET /jobs 中
+        threading.Thread(target=self.enumerator.expand,
+                         args=(targets, lambda part: self.scheduler.submit_part(part, priority)),
+                         daemon=True).start()
+        return len(targets)
+
+    def _job(self, value):
+        try:
+            return self.scheduler.jobs[int(value)]
+        except (ValueError, KeyError):
+            raise ApiError(404, f"任务 {value} 不存在")
+
+    @staticmethod
+    def _optional_number(body, key):
+        value = body.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            raise ApiError(400, f"{key} 必须是非负数或 null")
+        return value or None
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    daemon = None  # 由 DownloadDaemon 设置
+    max_body = 1024 * 1024
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass  # 不在终端打印每个请求
+
+    def _dispatch(self, method):
+        try:
+            self._check_origin()
+            self._check_token()
+            body = self._read_body() if method == 'POST' else {}
+            status, payload = self.daemon.handle(method, self.path, body)
+        except ApiError as ex:
+            status, payload = ex.status, {'error': str(ex)}
+        except Exception as ex:
+            print(f"处理请求 {method} {self.path} 时出错: {ex}")
+            status, payload = 500, {'error': str(ex)}
+
+        if isinstance(payload, str):
+            data = payload.encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _check_origin(self):
+        # 浏览器发起的跨站请求都带 Origin，只允许与本服务同源的请求；命令行工具和脚本一般不带
+        origin = self.headers.get('Origin')
+        if origin is not None and urlsplit(origin).netloc != self.headers.get('Host', ''):
+            raise ApiError(403, "不接受来自其他网站的请求")
+
+    def _check_token(self):
+        token = self.daemon.token
+        supplied = self.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+            raise ApiError(401, "需要有效的 Authorization: Bearer <token>")
+
+    def _read_body(self):
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            # 网页表单和 text/plain 请求可以不经 CORS 预检直接发出，只接受 JSON
+            raise ApiError(415, "Content-Type 必须是 application/json")
+        length = self.headers.get('Content-Length', '0')
+        if not length.isdigit() or int(length) > self.max_body:
+            raise ApiError(413 if length.isdigit() else 400, "请求体过大或缺少 Content-Length")
+        raw = self.rfile.read(int(length))
+        if not raw:
+            return {}
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            raise ApiError(400, "请求体不是合法的 JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "请求体必须是 JSON 对象")
+        return body
@@ -0,0 +1,160 @@
+# download_index.py
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from link_parser import part_key
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """分块读取文件计算 SHA-256，用于无法在写出时计算哈希的情况（例如 FFmpeg 合并）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadIndex:
+    """已完成下载的本地索引（SQLite），按 (BV号, cid, 清晰度, 编码) 记录输出文件的路径、大小和 SHA-256
+批量下载时先查索引：以当前登录的账号下载过（或已是视频提供的最高清晰度）、输出文件仍然存在且大小不变的分P直接跳过，
+不发任何网络请求；其余分P在取得播放信息后按实际要下载的清晰度和编码再查一次，
+之前以较低清晰度（例如未登录或换了账号时）下载的会重新下载；
+同时为每个分P分配文件名：标题清理后与其他视频重名时，在文件名后加上 [BV号]，分配结果保存在索引中，重复运行时保持不变"""
+
+    OUTPUT_FOLDER = 'output'  # 分配文件名时检查其中是否已有同名的输出文件
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # 下载线程、展开线程和界面线程共用一个连接，由 self._lock 串行化
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')  # 命令行和后台服务可以同时读写
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS downloads (
+                    bvid TEXT NOT NULL,
+                    cid INTEGER NOT NULL,       -- 未知时为 0
+                    page INTEGER NOT NULL,
+                    parts INTEGER,              -- 视频的分P总数，未知时为 NULL
+                    quality INTEGER NOT NULL,   -- 视频流的清晰度 ID，例如 80 为 1080P
+                    codec TEXT NOT NULL,
+                    title TEXT,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    finished_at REAL NOT NULL,
+                    top_quality INTEGER NOT NULL DEFAULT 0,  -- 1 表示 quality 是该视频提供的最高清晰度
+                    account TEXT,               -- 下载时登录账号的 mid，未登录为空字符串，未知时为 NULL
+                    PRIMARY KEY (bvid, cid, quality, codec)
+                )''')
+            columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(downloads)')}
+            if 'top_quality' not in columns:  # 旧版本创建的索引
+                self._conn.execute('ALTER TABLE downloads ADD COLUMN top_quality INTEGER NOT NULL DEFAULT 0')
+            if 'account' not in columns:
+                self._conn.execute('ALTER TABLE downloads ADD COLUMN account TEXT')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS downloads_page ON downloads (bvid, page)')
+            # Windows 和 macOS 的文件名不区分大小写，按不区分大小写比较是否重名
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS filenames (
+                    filename TEXT PRIMARY KEY COLLATE NOCASE,
+                    owner TEXT NOT NULL UNIQUE,  -- BV号，第 2P 起为 BV号_p页码
+                    fixed INTEGER NOT NULL DEFAULT 0  -- 1 表示已开始写出输出文件，不再改名
+                )''')
+            columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(filenames)')}
+            if 'fixed' not in columns:
+                self._conn.execute('ALTER TABLE filenames ADD COLUMN fixed INTEGER NOT NULL DEFAULT 0')
+
+    def find(self, bvid, cid=None, page=None, quality=None, codec=None, account=None):
+        """返回该分P的有效下载记录（字典），没有或输出文件已被删除、修改时返回 None；cid 未知时按分P序号查找
+给出 quality 和 codec 时只接受清晰度和编码都相同的记录；不给出时（尚未取得播放信息）只接受
+最高清晰度的记录，以及 account（当前登录账号的 mid，未登录为空字符串）下载的记录，同一账号能取得的清晰度不会变"""
+        if cid:
+            sql, params = 'bvid = ? AND cid = ?', [bvid, cid]
+        else:
+            sql, params = 'bvid = ? AND page = ?', [bvid, page or 1]
+        if quality is None and codec is None:
+            sql += ' AND (top_quality = 1 OR account = ?)'
+            params.append(account)  # account 为 None 时 SQL 中的比较不成立
+        else:
+            sql += ' AND quality = ? AND codec = ?'
+            params += [quality or 0, codec or '']
+        rows = self._query(f'SELECT * FROM downloads WHERE {sql} ORDER BY finished_at DESC', params)
+        for row in rows:
+            if self._valid(row):
+                return dict(row)
+        return None
+
+    def is_complete(self, bvid, page=None, account=None):
+        """不发网络请求判断视频（或其中的第 page P）是否已全部下载完成，可接受的记录与不给出 quality 的 find 相同"""
+        rows = [row for row in self._query('SELECT * FROM downloads WHERE bvid = ? AND (top_quality = 1 OR account = ?)',
+                                           (bvid, account))
+                if self._valid(row)]
+        pages = {row['page'] for row in rows}
+        if page is not None:
+            return page in pages
+        parts = max((row['parts'] or 0 for row in rows), default=0)
+        return parts > 0 and pages.issuperset(range(1, parts + 1))
+
+    def claim_filename(self, filename, bvid, page=None):
+        """为分P分配文件名（不含扩展名）：沿用该分P之前分配的文件名；
+filename 已被其他分P占用或输出目录中已有同名文件时改为“filename [BV号]”；
+占用者还没有开始写出输出文件时同样改为带 BV 号的文件名，同时下载的同名视频不论哪个先开始，得到的文件名都一样"""
+        owner = part_key(bvid, page)
+        suffixed = f"{filename} [{owner}]"
+        with self._lock, self._conn:
+            row = self._conn.execute('SELECT filename FROM filenames WHERE owner = ?', (owner,)).fetchone()
+            if row is not None:
+                return row['filename']
+            holder = self._conn.execute('SELECT * FROM filenames WHERE filename = ?', (filename,)).fetchone()
+            if holder is None and not self._output_exists(filename):
+                self._conn.execute('INSERT INTO filenames (filename, owner) VALUES (?, ?)', (filename, owner))
+                return filename
+            if holder is not None and not holder['fixed'] and not self._output_exists(holder['filename']):
+                self._conn.execute('UPDATE OR IGNORE filenames SET filename = ? WHERE owner = ?',
+                                   (f"{holder['filename']} [{holder['owner']}]", holder['owner']))
+            self._conn.execute('INSERT OR IGNORE INTO filenames (filename, owner) VALUES (?, ?)', (suffixed, owner))
+        return suffixed  # 带 BV号的文件名也被占用（手动修改过索引）时不再登记
+
+    def fix_filename(self, bvid, page=None):
+        """开始写出输出文件前调用：返回分P最终的文件名，之后不再因为重名而改名；没有分配过时返回 None"""
+        owner = part_key(bvid, page)
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE filenames SET fixed = 1 WHERE owner = ?', (owner,))
+            row = self._conn.execute('SELECT filename FROM filenames WHERE owner = ?', (owner,)).fetchone()
+        return row['filename'] if row is not None else None
+
+    def record(self, bvid, cid, page, parts, quality, codec, title, path, sha256, top_quality=False,
+               account=None):
+        """登记一个已完成的分P，大小取输出文件的当前大小；top_quality 表示 quality 是视频提供的最高清晰度，
+account 为下载时登录账号的 mid（未登录为空字符串，未知为 None）"""
+        size = os.path.getsize(path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO downloads (bvid, cid, page, parts, quality, codec, title, path, size, '
+                'sha256, finished_at, top_quality, account) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (bvid, cid or 0, page or 1, parts, quality or 0, codec or '', title, path, size, sha256,
+                 time.time(), int(bool(top_quality)), account))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _query(self, sql, params):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _output_exists(self, filename):
+        return os.path.exists(os.path.join(self.OUTPUT_FOLDER, f"{filename}.mp4"))
+
+    @staticmethod
+    def _valid(row):
+        # 只比较大小，不重新计算哈希，查询在毫秒级完成
+        try:
+            return os.path.getsize(row['path']) == row['size']
+        except OSError:
+            return False
@@ -0,0 +1,272 @@
+# download_scheduler.py
+
+import heapq
+import itertools
+import threading
+from link_parser import part_key
+
+
+class DownloadJob:
+    """单个下载任务，保存 BV 号、优先级、状态和进度
+它同时作为 process_video 的控制对象：process_video 通过 stop_download 判断本任务是否应中断"""
+
+    QUEUED = 'queued'        # 排队等待中
+    RUNNING = 'running'      # 正在下载
+    MERGING = 'merging'      # 下载完成，排队合并或正在合并
+    PAUSED = 'paused'        # 已暂停，可继续
+    CANCELLED = 'cancelled'  # 已取消
+    DONE = 'done'            # 下载与合并完成
+    ERROR = 'error'          # 出错
+
+    def __init__(self, job_id, video_id, priority=0, page=None, cid=None, part_title=None, parts=None):
+        self.job_id = job_id
+        self.video_id = video_id
+        self.page = page  # 分P序号，None 为视频的第一P
+        self.cid = cid
+        self.part_title = part_title  # 多P视频的分P标题，会加到文件名中
+        self.parts = parts  # 视频的分P总数，登记到下载索引
+        self.priority = priority  # 数值越大越先执行
+        self.rate_limit = None  # 本任务的限速（字节/秒），None 为不限
+        self.weight = 1  # 总带宽不足时按权重分配，运行中提高优先级也会提高权重
+        self.status = self.QUEUED
+        self.progress = 0.0
+        self.error = None
+        self.paused = False
+        self.cancelled = False
+        self._version = 0  # 每次重新入队时递增，用于识别优先队列中过期的条目
+
+    FINISHED = (DONE, CANCELLED, ERROR)  # 不会再自动变化的状态
+
+    @property
+    def stop_download(self):
+        return self.paused or self.cancelled
+
+    @property
+    def key(self):
+        """BV号，多P视频的第 2P 起为 BV号_p页码"""
+        return part_key(self.video_id, self.page)
+
+    def to_dict(self):
+        """转换为可以序列化为 JSON 的字典，供命令行和 HTTP 接口使用"""
+        return {
+            'job_id': self.job_id,
+            'video_id': self.video_id,
+            'page': self.page,
+            'cid': self.cid,
+            'part_title': self.part_title,
+            'status': self.status,
+            'progress': round(self.progress, 1),
+            'priority': self.priority,
+            'rate_limit': self.rate_limit,
+            'weight': self.weight,
+            'error': self.error,
+        }
+
+
+class _JobProgressQueue:
+    """交给 process_video 的进度队列，把进度、完成和错误消息转换为任务状态"""
+
+    def __init__(self, scheduler, job):
+        self.scheduler = scheduler
+        self.job = job
+
+    def put(self, item):
+        self.scheduler._on_progress(self.job, item)
+
+
+class DownloadScheduler:
+    """下载调度器：维护任务队列，按优先级把任务分配给有上限的工作线程池
+每个任务有独立的状态、进度和暂停/取消标志，状态变化时调用 listener(job) 通知界面"""
+
+    def __init__(self, video_processor, headers, max_workers=2, listener=None):
+        self.video_processor = video_processor
+        self.headers = headers
+        self.max_workers = max_workers  # 同时执行的任务数上限
+        self.listener = listener
+        self.jobs = {}  # job_id -> DownloadJob，按提交顺序保存
+        self._heap = []  # (-priority, 序号, job_id, version)
+        self._counter = itertools.count()
+        self._job_ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._workers = 0  # 当前存活的工作线程数
+        self._shutdown = False
+        video_processor.set_parallel_jobs(max_workers)
+
+    def submit(self, video_id, priority=0, page=None, cid=None, part_title=None, parts=None):
+        """提交一个下载任务，返回 DownloadJob"""
+        with self._cond:
+            job = DownloadJob(next(self._job_ids), video_id, priority, page, cid, part_title, parts)
+            self.jobs[job.job_id] = job
+            self._enqueue(job)
+        self._notify(job)
+        return job
+
+    def submit_part(self, part, priority=0):
+        """提交 enumerator 展开得到的一个分P"""
+        return self.submit(part.bvid, priority, part.page, part.cid, part.part, part.parts)
+
+    def pause(self, job_id):
+        """暂停任务：排队中的任务不再被取出，运行中的任务中断下载并保留断点"""
+        with self._cond:
+            job = self.jobs[job_id]
+            if job.status not in (DownloadJob.QUEUED, DownloadJob.RUNNING):
+                return
+            job.paused = True
+            if job.status == DownloadJob.QUEUED:
+                job.status = DownloadJob.PAUSED
+        self._notify(job)
+
+    def resume(self, job_id):
+        """继续已暂停或出错的任务，重新排队后从断点继续下载"""
+        with self._cond:
+            job = self.jobs[job_id]
+            if job.status not in (DownloadJob.PAUSED, DownloadJob.ERROR):
+                return
+            job.paused = False
+            job.error = None
+            job.status = DownloadJob.QUEUED
+            self._enqueue(job)
+        self._notify(job)
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self.jobs[job_id]
+            if job.status in (DownloadJob.DONE, DownloadJob.CANCELLED):
+                return
+            job.cancelled = True
+            if job.status != DownloadJob.RUNNING:
+                job.status = DownloadJob.CANCELLED
+                self._cond.notify_all()
+        self._notify(job)
+
+    def set_priority(self, job_id, priority):
+        with self._cond:
+            job = self.jobs[job_id]
+            job.priority = priority
+            job.weight = max(1, 1 + priority)
+            if job.status == DownloadJob.QUEUED:
+                self._enqueue(job)  # 旧条目会因 version 不匹配而被跳过
+        self.video_processor.bandwidth.update()
+        self._notify(job)
+
+    def set_job_bandwidth(self, job_id, rate_limit=None, weight=None):
+        """设置任务的限速（字节/秒，None 为不限）和带宽权重，运行中的任务立即生效"""
+        job = self.jobs[job_id]
+        job.rate_limit = rate_limit
+        if weight is not None:
+            job.weight = weight
+        self.video_processor.bandwidth.update()
+        self._notify(job)
+
+    def set_bandwidth(self, rate):
+        """设置所有任务的总限速（字节/秒），None 或 0 为不限"""
+        self.video_processor.bandwidth.set_rate(rate)
+
+    def set_max_workers(self, max_workers):
+        """运行时调整并发上限，多出的工作线程在完成手头任务后退出"""
+        self.video_processor.set_parallel_jobs(max_workers)
+        with self._cond:
+            self.max_workers = max_workers
+            self._spawn_workers()
+            self._cond.notify_all()
+
+    def wait(self, job_ids=None, timeout=None):
+        """等待指定的任务（默认全部）完成、出错或被取消，超时返回 False"""
+        with self._cond:
+            jobs = [self.jobs[job_id] for job_id in job_ids] if job_ids is not None else None
+            return self._cond.wait_for(
+                lambda: all(job.status in DownloadJob.FINISHED
+                            for job in (jobs if jobs is not None else self.jobs.values())),
+                timeout)
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            for job in self.jobs.values():
+                if job.status == DownloadJob.RUNNING:
+                    job.paused = True
+            self._cond.notify_all()
+
+    def _enqueue(self, job):
+        # 调用方需持有 self._cond
+        job._version += 1
+        heapq.heappush(self._heap, (-job.priority, next(self._counter), job.job_id, job._version))
+        self._spawn_workers()
+        self._cond.notify()
+
+    def _spawn_workers(self):
+        # 调用方需持有 self._cond；工作线程按需创建，不超过 max_workers
+        while self._workers < self.max_workers and self._workers < len(self._heap):
+            self._workers += 1
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def _next_job(self):
+        # 调用方需持有 self._cond；取出优先级最高且仍在排队的任务，没有时返回 None
+        while self._heap:
+            _, _, job_id, version = heapq.heappop(self._heap)
+            job = self.jobs[job_id]
+            if version == job._version and job.status == DownloadJob.QUEUED:
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = None
+                while not self._shutdown and self._workers <= self.max_workers:
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    if not self._cond.wait(timeout=30):
+                        # 长时间空闲的线程退出，有新任务时再创建；退出前再取一次，恰好在超时时入队的任务不会没有线程执行
+                        job = self._next_job()
+                        break
+                if job is None:
+                    self._workers -= 1
+                    return
+                job.status = DownloadJob.RUNNING
+                job.progress = 0.0
+            self._notify(job)
+
+            try:
+                self.video_processor.process_video(
+                    job.video_id, self.headers, _JobProgressQueue(self, job), job,
+                    page=job.page, part_title=job.part_title, cid=job.cid, parts=job.parts)
+            except Exception as ex:
+                self._on_progress(job, f"error: {ex}")
+
+            with self._cond:
+                # process_video 返回时下载已结束，合并在合并队列中继续
+                if job.status == DownloadJob.RUNNING:
+                    job.status = DownloadJob.MERGING
+                    job.progress = 0.0
+            self._notify(job)
+
+    def _on_progress(self, job, item):
+        with self._cond:
+            if isinstance(item, str) and item.startswith("error"):
+                if job.cancelled:
+                    job.status = DownloadJob.CANCELLED
+                elif job.paused:
+                    job.status = DownloadJob.PAUSED
+                else:
+                    job.status = DownloadJob.ERROR
+                    job.error = item
+            elif item in ('done', 'merging') and job.cancelled:
+                # 合并无法中途停止，合并期间被取消的任务在进入合并阶段或合并结束时仍保持已取消
+                job.status = DownloadJob.CANCELLED
+            elif item == 'done':
+                job.status = DownloadJob.DONE
+                job.progress = 100.0
+            elif item == 'merging':
+                job.status = DownloadJob.MERGING
+                job.progress = 0.0
+            else:
+                job.progress = float(item)
+            if job.status in DownloadJob.FINISHED:
+                self._cond.notify_all()  # 唤醒 wait()
+        self._notify(job)
+
+    def _notify(self, job):
+        if self.listener is not None:
+            self.listener(job)
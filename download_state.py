@@ -0,0 +1,128 @@
+# download_state.py
+
+import os
+import json
+import time
+import threading
+from urllib.parse import urlsplit
+
+# 每个连接每隔 CHECKPOINT_SECONDS 秒，或写入 CHECKPOINT_BYTES 字节后，刷新一次磁盘并保存状态
+# 每次需要两次 fsync（数据文件和状态文件），按时间间隔进行，高速下载时也不会频繁同步磁盘
+CHECKPOINT_SECONDS = 2
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+
+
+def checkpoint_due(written, since):
+    """自上次保存状态（time.monotonic() 为 since）以来已写入 written 字节，判断是否该保存一次"""
+    return written >= CHECKPOINT_BYTES or (written > 0 and time.monotonic() - since >= CHECKPOINT_SECONDS)
+
+
+class DownloadState:
+    """断点续传状态：记录 URL、文件大小、校验信息（ETag/Last-Modified）和已写入磁盘的字节区间
+状态保存在 .part 文件旁的 .part.json 中，区间均为左闭右开 [start, end)"""
+
+    def __init__(self, state_path, url, total, etag=None, last_modified=None, completed=None):
+        self.state_path = state_path
+        self.url = url
+        self.total = total  # 文件总大小，服务器未给出时为 None
+        self.etag = etag
+        self.last_modified = last_modified
+        self.completed = [list(r) for r in (completed or [])]  # 已完成的区间，保持有序且互不重叠
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, state_path):
+        # 读取状态文件，不存在或已损坏时返回 None
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return cls(state_path, data['url'], data['total'], data.get('etag'),
+                       data.get('last_modified'), data.get('completed'))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    @staticmethod
+    def _url_key(url):
+        # B站 CDN 链接带有签名和过期时间参数，每次获取都会变化，只比较路径部分
+        return urlsplit(url).path
+
+    def matches(self, url, total, etag=None, last_modified=None):
+        """判断服务器上的文件是否仍是上次下载的那一个"""
+        if self._url_key(url) != self._url_key(self.url) or total != self.total:
+            return False
+        if etag and self.etag:
+            return etag == self.etag
+        if last_modified and self.last_modified:
+            return last_modified == self.last_modified
+        return True
+
+    def add_range(self, start, end):
+        """记录 [start, end) 已写入并刷新到磁盘，与相邻区间合并"""
+        if end <= start:
+            return
+        with self._lock:
+            merged = []
+            for s, e in self.completed:
+                if e < start or s > end:
+                    merged.append([s, e])
+                else:
+                    start, end = min(s, start), max(e, end)
+            merged.append([start, end])
+            merged.sort()
+            self.completed = merged
+
+    def checkpoint(self, f, start, end):
+        """先把文件缓冲刷新到磁盘再记录 [start, end) 已完成，保证状态不会领先于磁盘上的数据"""
+        if end <= start:
+            return
+        f.flush()
+        os.fsync(f.fileno())
+        self.add_range(start, end)
+        self.save()
+
+    def completed_bytes(self):
+        with self._lock:
+            return sum(e - s for s, e in self.completed)
+
+    def contiguous_bytes(self):
+        """从文件开头起连续完成的字节数，单连接续传时从这里继续"""
+        with self._lock:
+            if self.completed and self.completed[0][0] == 0:
+                return self.completed[0][1]
+            return 0
+
+    def missing_ranges(self):
+        """返回尚未完成的区间列表"""
+        with self._lock:
+            missing = []
+            pos = 0
+            for s, e in self.completed:
+                if s > pos:
+                    missing.append((pos, s))
+                pos = max(pos, e)
+            if self.total is not None and pos < self.total:
+                missing.append((pos, self.total))
+            return missing
+
+    def save(self):
+        # 先写临时文件再替换，避免写到一半崩溃导致状态文件损坏
+        with self._lock:
+            data = {
+                'url': self.url,
+                'total': self.total,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+                'completed': self.completed,
+            }
+            tmp_path = self.state_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.state_path)
+
+    def remove(self):
+        try:
+            os.remove(self.state_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,187 @@
+# enumerator.py
+
+import re
+import time
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from bilibili_session import BilibiliApiError
+from link_parser import resolve_short_links, extract_video_ids, part_key
+
+_SPACE = re.compile(r'space\.bilibili\.com/(\d+)(\S*)')
+_LISTS = re.compile(r'/lists/(\d+)')
+
+# 被风控或请求过于频繁时返回的 code，稍等后可以重试
+_RETRY_CODES = (-352, -412, -799)
+
+
+class VideoPart:
+    """展开得到的一个下载单元：视频中的一P"""
+
+    def __init__(self, bvid, cid, page, title, part=None, parts=1):
+        self.bvid = bvid
+        self.cid = cid
+        self.page = page  # 分P序号，从 1 开始
+        self.title = title  # 视频标题
+        self.part = part  # 分P标题，只有一P的视频为 None
+        self.parts = parts  # 视频的分P总数
+
+    @property
+    def key(self):
+        return part_key(self.bvid, self.page)
+
+
+def parse_targets(text):
+    """把输入文本解析为待展开的目标，按出现顺序去重：
+    ('video', BV号, 分P序号或 None)    单个视频，链接中没有 p 参数时展开全部分P
+    ('season', mid, 合集 ID)           UP 主的合集
+    ('series', mid, 列表 ID)           UP 主的视频列表
+    ('space', mid)                     UP 主空间中的全部投稿
+其中的 b23.tv 短链接会先被解析"""
+    targets = []
+    for token in resolve_short_links(text).split():
+        space = _SPACE.search(token)
+        if space:
+            targets.append(_space_target(int(space.group(1)), space.group(2)))
+            continue
+        video_ids = extract_video_ids(token)
+        page = None
+        if len(video_ids) == 1:
+            value = parse_qs(urlsplit(token).query).get('p', [''])[0]
+            page = int(value) if value.isdigit() and int(value) > 0 else None
+        targets += [('video', video_id, page) for video_id in video_ids]
+    return list(dict.fromkeys(targets))
+
+
+def _space_target(mid, rest):
+    # rest 为 space.bilibili.com/<mid> 之后的路径和参数
+    query = parse_qs(urlsplit(rest).query)
+    sid = query.get('sid', [''])[0]
+    if 'collectiondetail' in rest and sid.isdigit():
+        return ('season', mid, int(sid))
+    if 'seriesdetail' in rest and sid.isdigit():
+        return ('series', mid, int(sid))
+    lists = _LISTS.match(rest)  # 新版空间的链接：/lists/<id>?type=season 或 type=series
+    if lists:
+        kind = 'series' if query.get('type', [''])[0] == 'series' else 'season'
+        return (kind, mid, int(lists.group(1)))
+    return ('space', mid)
+
+
+class Enumerator:
+    """展开阶段：把多P视频、合集、视频列表和 UP 主空间展开为一个个分P
+列表接口的各页在线程池中并发请求，每查到一个视频的分P就立即回调，
+不必等整个列表查完，频道里有上千个视频时下载也能在几秒内开始
+给出 index（DownloadIndex）时跳过已下载的分P，全部分P都已下载的视频连分P信息也不再查询"""
+
+    def __init__(self, http_session, index=None, workers=4, page_size=30, max_retries=3, retry_delay=2):
+        self.http_session = http_session  # BilibiliSession
+        self.index = index
+        self.workers = workers  # 同时进行的接口请求数，过高容易被风控
+        self.page_size = page_size  # 列表接口每页的视频数
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+    def expand(self, targets, on_part, should_stop=None):
+        """展开 targets，每得到一个分P就在调用线程中调用 on_part(VideoPart)，返回展开的分P数
+同一分P只回调一次；某个目标或某一页失败时打印错误并继续展开其余部分；
+should_stop() 为真时停止，尚未开始的请求被取消"""
+        seen = set()
+        pool = ThreadPoolExecutor(self.workers, thread_name_prefix='enumerator')
+        pending = {pool.submit(self._expand_target, target): target for target in targets}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    target = pending.pop(future)
+                    try:
+                        parts, follow_ups = future.result()
+                    except (requests.exceptions.RequestException, BilibiliApiError,
+                            KeyError, TypeError, ValueError) as ex:
+                        print(f"展开 {target} 失败: {ex}")
+                        continue
+                    if should_stop is not None and should_stop():
+                        return len(seen)
+                    for part in parts:
+                        if part.key not in seen:
+                            seen.add(part.key)
+                            on_part(part)
+                    for label, func, *args in follow_ups:
+                        pending[pool.submit(func, *args)] = label
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return len(seen)
+
+    def _expand_target(self, target):
+        # 返回 (分P列表, 后续请求列表)，后续请求为 (出错时显示的名称, 方法, 参数...)
+        if target[0] == 'video':
+            return self._video_parts(target[1], target[2])
+        return self._list_page(target, 1)
+
+    def _video_parts(self, bvid, page=None):
+        # 同一账号能取得的清晰度不变，以当前账号下载过的分P不必再查询
+        account = self.http_session.account_id()
+        if self.index is not None and self.index.is_complete(bvid, page, account):
+            print(f"{part_key(bvid, page)} 已下载，跳过")
+            return [], []
+        data = self._call('/x/web-interface/view', {'bvid': bvid})
+        pages = data.get('pages') or [{'cid': data['cid'], 'page': 1}]
+        multi = len(pages) > 1
+        parts = [VideoPart(bvid, p['cid'], p['page'], data['title'],
+                           (p.get('part') or f"P{p['page']}") if multi else None, len(pages))
+                 for p in pages]
+        if page is not None:
+            parts = [part for part in parts if part.page == page]
+            if not parts:
+                raise ValueError(f"{bvid} 没有第 {page}P")
+        if self.index is not None:
+            done = [part for part in parts if self.index.find(bvid, part.cid, part.page, account=account) is not None]
+            if done:
+                print(f"{bvid} 的 {len(done)} 个分P已下载，跳过")
+                parts = [part for part in parts if part not in done]
+        return parts, []
+
+    def _list_page(self, target, page_num):
+        # 先查询本页每个视频的分P，好让下载尽快开始；第一页还得知总数，其余各页随后并发请求
+        kind, *ids = target
+        bvids, total = getattr(self, f'_{kind}_page')(*ids, page_num)
+        follow_ups = [(bvid, self._video_parts, bvid) for bvid in bvids]
+        if page_num == 1:
+            pages = -(-total // self.page_size)
+            follow_ups += [(f"{target} 第 {n} 页", self._list_page, target, n) for n in range(2, pages + 1)]
+        return [], follow_ups
+
+    def _season_page(self, mid, season_id, page_num):
+        data = self._call('/x/polymer/web-space/seasons_archives_list',
+                          {'mid': mid, 'season_id': season_id, 'page_num': page_num,
+                           'page_size': self.page_size})
+        return [item['bvid'] for item in data.get('archives') or []], data['page']['total']
+
+    def _series_page(self, mid, series_id, page_num):
+        data = self._call('/x/series/archives',
+                          {'mid': mid, 'series_id': series_id, 'pn': page_num, 'ps': self.page_size,
+                           'sort': 'asc'})
+        return [item['bvid'] for item in data.get('archives') or []], data['page']['total']
+
+    def _space_page(self, mid, page_num):
+        data = self._call('/x/space/wbi/arc/search',
+                          {'mid': mid, 'pn': page_num, 'ps': self.page_size, 'order': 'pubdate'}, wbi=True)
+        vlist = (data.get('list') or {}).get('vlist') or []
+        return [item['bvid'] for item in vlist], data['page']['count']
+
+    def _call(self, path, params, wbi=False):
+        # 被风控、请求过于频繁或网络错误时等待后重试，等待时间逐次加长
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.http_session.get_api(path, params, wbi=wbi)
+            except BilibiliApiError as ex:
+                retryable = ex.code in _RETRY_CODES or (wbi and ex.code == -403)
+                if not retryable or attempt == self.max_retries:
+                    raise
+                reason = ex
+            except requests.exceptions.RequestException as ex:
+                if attempt == self.max_retries:
+                    raise
+                reason = ex
+            print(f"请求 {path} 失败（{reason}），{self.retry_delay * (attempt + 1)} 秒后重试")
+            time.sleep(self.retry_delay * (attempt + 1))
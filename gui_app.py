@@ -1,66 +1,172 @@
-import re
-import queue
+import os
 import threading
 import tkinter as tk
-from tkinter import messagebox
+from tkinter import messagebox, filedialog
 from tkinter import ttk
-import requests
-from video_processor import VideoProcessor
-from bs4 import BeautifulSoup
+import link_parser
+from video_processor import VideoProcessor, DEFAULT_HEADERS
+from download_scheduler import DownloadScheduler, DownloadJob
+from metadata_cache import MetadataCache
+from metrics import MetricsRegistry, ProgressEvents
+from enumerator import Enumerator, parse_targets
+from download_index import DownloadIndex
 
 class BilibiliDownloaderApp:
     """GUI应用类，负责界面创建和用户交互"""
 
-    def __init__(self, browser_manager):
-        self.browser = browser_manager.get_browser()  # 获取已登录的浏览器实例
-        self.video_processor = VideoProcessor(self.browser)  # 创建视频处理器实例
+    # 任务状态在界面上的显示文字
+    STATUS_TEXT = {
+        DownloadJob.QUEUED: "等待中",
+        DownloadJob.RUNNING: "下载中",
+        DownloadJob.MERGING: "合并中",
+        DownloadJob.PAUSED: "已暂停",
+        DownloadJob.CANCELLED: "已取消",
+        DownloadJob.DONE: "已完成",
+        DownloadJob.ERROR: "出错",
+    }
+
+    def __init__(self, browser_manager, max_workers=2):
+        self.browser_manager = browser_manager  # 浏览器只在 HTTP 方式失败时才启动
+        # 携带登录 Cookie 的 HTTP 会话，页面请求优先走 HTTP，不占用浏览器
+        self.http_session = browser_manager.get_http_session()
+        # 元数据缓存同时写入磁盘，重启后仍可复用未过期的条目
+        self.metadata_cache = MetadataCache(cache_dir=os.path.join('cache', 'metadata'))
+        # 传输指标：事件追加到 logs/transfers.jsonl，Prometheus 格式的快照写入 logs/metrics.prom
+        self.metrics = MetricsRegistry(log_path=os.path.join('logs', 'transfers.jsonl'),
+                                       snapshot_path=os.path.join('logs', 'metrics.prom'))
+        # 已完成下载的索引：再次下载时跳过已完成的分P，并避免同名视频互相覆盖
+        self.download_index = DownloadIndex(os.path.join('cache', 'downloads.sqlite3'))
+        self.video_processor = VideoProcessor(browser_manager, http_session=self.http_session,
+                                              metadata_cache=self.metadata_cache,
+                                              metrics=self.metrics,
+                                              download_index=self.download_index)  # 创建视频处理器实例
+        # 把多P视频、合集和 UP 主空间展开为分P，边展开边加入下载队列
+        self.enumerator = Enumerator(self.http_session, self.download_index)
         self.root = tk.Tk()  # 初始化Tkinter主窗口
         self.root.title("B站视频下载工具")  # 设置窗口标题
-        self.stop_download = False  # 标志位，控制下载过程是否中断
+
+        # 任务变化事件先合并，最多每 0.1 秒通过虚拟事件通知主线程一次，没有变化时不做任何刷新
+        self.progress_events = ProgressEvents(self.notify_progress)
+        # 创建下载调度器，任务状态变化时把任务交给 progress_events，由主线程刷新界面
+        self.scheduler = DownloadScheduler(self.video_processor, DEFAULT_HEADERS, max_workers,
+                                           listener=self.progress_events.publish)
+
         self.create_widgets()  # 创建界面控件
+        self.root.bind('<<ProgressUpdate>>', self.update_progress)
         self.root.mainloop()  # 进入主循环，显示窗口
+        self.scheduler.shutdown()
+        self.browser_manager.quit()
 
     def create_widgets(self):
         # 创建标签，提示用户输入
-        video_label = tk.Label(self.root, text="输入视频分享链接：")
+        video_label = tk.Label(self.root, text="输入视频、合集或空间链接：\n（可粘贴多个，每行一个）")
         video_label.grid(row=0, column=0, padx=5, pady=5)
 
-        # 创建文本输入框，供用户输入视频链接或BV号
-        self.video_entry = tk.Entry(self.root, width=50)
-        self.video_entry.grid(row=0, column=1, padx=5, pady=5)
+        # 创建多行文本框，供用户输入一个或多个视频链接或BV号
+        self.video_entry = tk.Text(self.root, width=50, height=4)
+        self.video_entry.grid(row=0, column=1, columnspan=3, padx=5, pady=5)
 
         # 创建“查找”按钮，点击后查找视频信息
         search_button = tk.Button(self.root, text="查找", command=self.search_video_info)
         search_button.grid(row=1, column=0, padx=5, pady=5, sticky=tk.EW)
 
+        # 创建“从文件导入”按钮，从文本文件中读取 BV 号列表加入队列
+        import_button = tk.Button(self.root, text="从文件导入", command=self.import_from_file)
+        import_button.grid(row=1, column=1, padx=5, pady=5, sticky=tk.EW)
+
+        # 创建“下载并合并”按钮，把输入的所有视频加入下载队列
+        download_button = tk.Button(self.root, text="下载并合并", command=self.start_download)
+        download_button.grid(row=1, column=2, padx=5, pady=5, sticky=tk.EW)
+
+        # 同时下载的任务数
+        workers_frame = tk.Frame(self.root)
+        workers_frame.grid(row=1, column=3, padx=5, pady=5)
+        tk.Label(workers_frame, text="同时下载：").pack(side=tk.LEFT)
+        self.workers_var = tk.IntVar(value=self.scheduler.max_workers)
+        tk.Spinbox(workers_frame, from_=1, to=8, width=3, textvariable=self.workers_var,
+                   command=self.change_max_workers).pack(side=tk.LEFT)
+
+        # 边下载边合并，不写中间文件，但暂停后无法断点续传
+        self.stream_var = tk.BooleanVar(value=self.video_processor.merge_mode == 'stream')
+        tk.Checkbutton(workers_frame, text="边下载边合并", variable=self.stream_var,
+                       command=self.change_merge_mode).pack(side=tk.LEFT)
+
+        # 总限速，0 表示不限，下载过程中修改立即生效
+        tk.Label(workers_frame, text="限速(MB/s)：").pack(side=tk.LEFT)
+        self.rate_var = tk.DoubleVar(value=0)
+        rate_box = tk.Spinbox(workers_frame, from_=0, to=1000, increment=0.5, width=5,
+                              textvariable=self.rate_var, command=self.change_bandwidth)
+        rate_box.pack(side=tk.LEFT)
+        rate_box.bind('<Return>', lambda event: self.change_bandwidth())
+
         # 创建标签来显示视频标题
         self.video_title_label = tk.Label(self.root, text="视频标题：", anchor="w")
-        self.video_title_label.grid(row=2, column=0, columnspan=2, padx=5, pady=5, sticky=tk.W)
+        self.video_title_label.grid(row=2, column=0, columnspan=4, padx=5, pady=5, sticky=tk.W)
 
-        # 创建进度条，显示下载和合并进度
-        self.progress_var = tk.DoubleVar()
-        progress_bar = ttk.Progressbar(self.root, variable=self.progress_var, maximum=100)
-        progress_bar.grid(row=3, column=0, columnspan=2, padx=5, pady=10, sticky=tk.EW)
+        # 创建任务列表，显示每个任务的状态和进度
+        columns = ("video_id", "status", "progress", "speed", "priority")
+        self.job_tree = ttk.Treeview(self.root, columns=columns, show="headings", height=10)
+        for column, text, width in zip(columns, ("BV号", "状态", "进度", "速度", "优先级"),
+                                       (160, 200, 60, 90, 60)):
+            self.job_tree.heading(column, text=text)
+            self.job_tree.column(column, width=width, anchor=tk.W if column == "status" else tk.CENTER)
+        self.job_tree.grid(row=3, column=0, columnspan=4, padx=5, pady=10, sticky=tk.NSEW)
 
-        # 创建进度队列，用于在子线程与主线程之间传递进度信息
-        self.progress_queue = queue.Queue()
-
-        # 创建“下载并合并”按钮，绑定点击事件
-        download_button = tk.Button(self.root, text="下载并合并", command=self.start_download)
-        download_button.grid(row=4, column=1, padx=5, pady=20)
+        # 创建任务操作按钮，作用于选中的任务
+        for column, (text, command) in enumerate((
+                ("暂停下载", self.pause_download),
+                ("继续下载", self.resume_download),
+                ("取消下载", self.cancel_download),
+                ("提高优先级", self.raise_priority))):
+            button = tk.Button(self.root, text=text, command=command)
+            button.grid(row=4, column=column, padx=5, pady=20, sticky=tk.EW)
 
-        # 创建“暂停下载”按钮
-        pause_button = tk.Button(self.root, text="暂停下载", command=self.pause_download)
-        pause_button.grid(row=4, column=0, padx=5, pady=20)
+    def selected_jobs(self):
+        """返回任务列表中选中的任务，未选中时返回全部任务"""
+        selection = self.job_tree.selection() or self.job_tree.get_children()
+        return [self.scheduler.jobs[int(item)] for item in selection]
 
     def pause_download(self):
         """暂停下载按钮的回调函数"""
-        self.stop_download = True
-        messagebox.showinfo("暂停", "下载已暂停！")
+        for job in self.selected_jobs():
+            self.scheduler.pause(job.job_id)
+
+    def resume_download(self):
+        """继续下载按钮的回调函数，从断点继续"""
+        for job in self.selected_jobs():
+            self.scheduler.resume(job.job_id)
+
+    def cancel_download(self):
+        """取消下载按钮的回调函数"""
+        jobs = self.selected_jobs()
+        if jobs and messagebox.askyesno("取消", f"确定要取消选中的 {len(jobs)} 个任务吗？"):
+            for job in jobs:
+                self.scheduler.cancel(job.job_id)
+
+    def raise_priority(self):
+        """提高选中任务的优先级，排队中的任务会更早开始"""
+        for job in self.selected_jobs():
+            self.scheduler.set_priority(job.job_id, job.priority + 1)
+
+    def change_max_workers(self):
+        self.scheduler.set_max_workers(self.workers_var.get())
+
+    def change_bandwidth(self):
+        try:
+            rate = self.rate_var.get()
+        except tk.TclError:
+            return  # 输入不是数字，忽略
+        self.scheduler.set_bandwidth(int(rate * 1024 * 1024) if rate > 0 else None)
+
+    def change_merge_mode(self):
+        self.video_processor.merge_mode = 'stream' if self.stream_var.get() else 'files'
+
+    def get_input(self):
+        return self.video_entry.get("1.0", tk.END).strip()
 
     def search_video_info(self):
         """查找并显示视频信息（标题）"""
-        input_string = self.video_entry.get()
+        input_string = self.get_input()
         if not input_string:
             messagebox.showerror("错误", "请输入视频ID或链接。")
             return
@@ -81,14 +187,8 @@ class BilibiliDownloaderApp:
             return
 
         try:
-            # 使用已登录的浏览器访问视频页面
-            self.browser.get(f'https://www.bilibili.com/video/{video_id}/')
-            self.browser.implicitly_wait(3)  # 等待页面加载
-
-            # 解析页面内容，获取视频标题
-            soup = BeautifulSoup(self.browser.page_source, 'html.parser')
-            title = soup.find('meta', attrs={'name': 'title'})['content']
-            title = re.sub(r'[_\-–—]*哔哩哔哩.*$', '', title)  # 去除标题中的后缀
+            # 获取视频信息，优先通过 HTTP，失败时使用浏览器
+            title, _, _ = self.video_processor.get_video_info(video_id)
 
             # 显示视频标题
             self.video_title_label.config(text=f"视频标题：{title}")
@@ -97,85 +197,60 @@ class BilibiliDownloaderApp:
             print(f"获取视频信息失败: {ex}")
 
     def start_download(self):
-        # 获取用户输入的链接或BV号
-        input_string = self.video_entry.get()
+        # 获取用户输入的链接或BV号，可以是多个
+        input_string = self.get_input()
         if not input_string:
             messagebox.showerror("错误", "请输入视频ID或链接。")
             return
+        self.enqueue_input(input_string)
 
-        # 如果输入的是短链接，则解析为完整链接
-        if 'b23.tv' in input_string:
-            try:
-                input_string = self.resolve_short_link(input_string)
-            except ValueError as ex:
-                messagebox.showerror("错误", str(ex))
-                return
-
-        try:
-            # 提取视频ID
-            video_id = self.extract_video_id(input_string)
-        except ValueError as ex:
-            messagebox.showerror("错误", str(ex))
+    def import_from_file(self):
+        """从文本文件导入 BV 号或链接列表"""
+        path = filedialog.askopenfilename(title="选择包含 BV 号的文件",
+                                          filetypes=[("文本文件", "*.txt"), ("所有文件", "*.*")])
+        if not path:
             return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.enqueue_input(f.read())
+        except OSError as ex:
+            messagebox.showerror("错误", f"读取文件失败: {ex}")
 
-        # 设置请求头，模拟浏览器访问
-        headers = {
-            "referer": "https://www.bilibili.com",
-            "origin": "https://www.bilibili.com",
-            "User-Agent": 'Mozilla/5.0'
-        }
-
-        # 重置停止下载的标志位
-        self.stop_download = False
+    def enqueue_input(self, input_string):
+        """解析输入中的视频、合集和 UP 主空间链接，在后台展开为分P，每展开一个就加入下载队列"""
+        targets = parse_targets(input_string)
+        if not targets:
+            messagebox.showerror("错误", "未找到有效的视频 ID")
+            return
+        threading.Thread(target=self.enumerator.expand, args=(targets, self.scheduler.submit_part),
+                         daemon=True).start()
 
-        # 创建新线程，调用视频处理器的 process_video 方法，开始下载和合并
-        threading.Thread(target=self.video_processor.process_video, args=(video_id, headers, self.progress_queue, self)).start()
+    def notify_progress(self):
+        # 在工作线程中调用，通过虚拟事件让主线程刷新任务列表
+        try:
+            self.root.event_generate('<<ProgressUpdate>>', when='tail')
+        except tk.TclError:
+            pass  # 窗口已关闭
 
-        # 开始更新进度条
-        self.update_progress()
+    def update_progress(self, event=None):
+        # 取出合并后发生变化的任务，刷新任务列表
+        for job in self.progress_events.drain():
+            self.refresh_job(job)
 
-    def update_progress(self):
-        try:
-            # 从进度队列中获取当前进度
-            progress = self.progress_queue.get_nowait()
-            if isinstance(progress, str) and progress.startswith("error"):
-                # 如果收到错误信息，弹出错误提示
-                messagebox.showerror("错误", progress)
-            elif progress == 'done':
-                # 下载和合并完成，弹出成功提示
-                messagebox.showinfo("成功", "下载与合并完成！")
-            else:
-                # 更新进度条的值
-                self.progress_var.set(progress)
-            # 定时器，继续检查进度队列
-            self.root.after(100, self.update_progress)
-        except queue.Empty:
-            # 如果队列为空，稍后再次检查
-            self.root.after(100, self.update_progress)
-
-    @staticmethod
-    def resolve_short_link(input_string):
-        """从输入中提取并解析b站手机端短链接"""
-        short_link_pattern = re.compile(r'(b23.tv/\S+)')
-        match = short_link_pattern.search(input_string)
-        if match:
-            short_link = match.group(1)
-            short_link_url = f"https://{short_link}"
-            try:
-                response = requests.head(short_link_url, allow_redirects=True)
-                return response.url
-            except requests.exceptions.RequestException as e:
-                print(f"短链接解析失败: {e}")
-                return None
+    def refresh_job(self, job):
+        status = self.STATUS_TEXT[job.status]
+        if job.status == DownloadJob.ERROR:
+            status = f"{status}：{job.error.removeprefix('error: ')}"
+        speed = ''
+        if job.status == DownloadJob.RUNNING:
+            speed = f"{self.metrics.job_speed(job.key) / 1024 / 1024:.1f} MB/s"
+        values = (job.key, status, f"{job.progress:.0f}%", speed, job.priority)
+        item = str(job.job_id)
+        if self.job_tree.exists(item):
+            self.job_tree.item(item, values=values)
         else:
-            raise ValueError("未找到有效的短链接")
-
-    @staticmethod
-    def extract_video_id(input_string):
-        """从输入的链接中提取 BV 号"""
-        bv_pattern = re.compile(r'BV[0-9A-Za-z]+')
-        match = bv_pattern.search(input_string)
-        if match:
-            return match.group(0)
-        else:
-            raise ValueError("未找到有效的视频 ID")
\ No newline at end of file
+            self.job_tree.insert('', tk.END, iid=item, values=values)
+
+    # 链接解析放在 link_parser 中，命令行和后台服务共用
+    resolve_short_link = staticmethod(link_parser.resolve_short_link)
+    extract_video_id = staticmethod(link_parser.extract_video_id)
@@ -0,0 +1,46 @@
+# link_parser.py
+
+import re
+import requests
+
+_SHORT_LINK = re.compile(r'b23.tv/\S+')
+_VIDEO_ID = re.compile(r'BV[0-9A-Za-z]+')
+
+
+def resolve_short_link(input_string):
+    """从输入中提取并解析b站手机端短链接"""
+    match = _SHORT_LINK.search(input_string)
+    if not match:
+        raise ValueError("未找到有效的短链接")
+    short_link_url = f"https://{match.group(0)}"
+    try:
+        response = requests.head(short_link_url, allow_redirects=True)
+        return response.url
+    except requests.exceptions.RequestException as e:
+        print(f"短链接解析失败: {e}")
+        return None
+
+
+def resolve_short_links(input_string):
+    """把文本中的所有短链接替换为解析后的完整链接，解析失败的保持原样"""
+    def replace(match):
+        return resolve_short_link(match.group(0)) or match.group(0)
+    return _SHORT_LINK.sub(replace, input_string)
+
+
+def extract_video_ids(input_string):
+    """从输入文本中按顺序提取所有不重复的 BV 号"""
+    return list(dict.fromkeys(_VIDEO_ID.findall(input_string)))
+
+
+def extract_video_id(input_string):
+    """从输入的链接中提取 BV 号"""
+    match = _VIDEO_ID.search(input_string)
+    if match:
+        return match.group(0)
+    raise ValueError("未找到有效的视频 ID")
+
+
+def part_key(video_id, page=None):
+    """视频中某一P的标识：第 1P 与视频本身相同，其余为 BV号_p页码，用于元数据缓存、传输指标和任务列表"""
+    return video_id if not page or page == 1 else f"{video_id}_p{page}"
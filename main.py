@@ -3,6 +3,7 @@
 from browser_manager import BrowserManager  # 导入浏览器管理器模块，用于自动登录Bilibili账户
 from gui_app import BilibiliDownloaderApp  # 导入GUI应用程序模块，提供图形用户界面
 from tkinter import messagebox  # 导入Tkinter的messagebox模块，用于显示消息提示框
+# 不需要图形界面时（服务器、定时任务、脚本）请使用 cli.py，它不会导入 tkinter 和 selenium
 
 if __name__ == "__main__":
     try:
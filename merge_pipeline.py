@@ -0,0 +1,115 @@
+# merge_pipeline.py
+
+import os
+import time
+import threading
+from collections import deque
+
+
+def default_merge_workers():
+    # 内置合并和 FFmpeg（-c copy）都不重新编码，主要是顺序读写磁盘，同一块磁盘上并发过多反而更慢；
+    # CPU 核数少时再减少，给下载线程和界面留出余量
+    return max(1, min((os.cpu_count() or 1) // 2, 2))
+
+
+class MergeTask:
+    """一次待合并的音视频"""
+
+    def __init__(self, video_file, audio_file, output_folder, output_filename, progress_queue,
+                 engine=None, video_id=None, record=None):
+        self.video_file = video_file
+        self.audio_file = audio_file
+        self.output_folder = output_folder
+        self.output_filename = output_filename
+        self.progress_queue = progress_queue
+        self.engine = engine
+        self.video_id = video_id
+        self.record = record
+        self.queued_at = None  # 进入合并队列的时间（time.monotonic()）
+        self.wait_seconds = None  # 在队列中等待的时间，开始合并时填入
+
+    def remove_inputs(self):
+        """合并成功后删除 download 目录中的视频流和音频流文件，删除失败只打印提示"""
+        for path in (self.video_file, self.audio_file):
+            try:
+                os.remove(path)
+            except OSError as ex:
+                print(f"删除中间文件 {path} 失败: {ex}")
+
+
+class MergePipeline:
+    """合并阶段：与下载分开的有界工作线程池
+同时进行的合并不超过 workers 个，排队等待的不超过 max_pending 个；队列已满时 submit 阻塞，
+提交合并的下载线程因此不会去下载下一个视频，下载不会远远跑在合并前面把磁盘占满
+队列深度和等待时间记录到 metrics"""
+
+    def __init__(self, merge, workers=None, max_pending=None, metrics=None):
+        self.merge = merge  # merge(MergeTask) 在工作线程中同步完成一次合并并报告结果
+        self.workers = workers or default_merge_workers()
+        self.max_pending = max_pending if max_pending is not None else self.workers
+        self.metrics = metrics  # MetricsRegistry，None 为不记录
+        self._queue = deque()
+        self._running = 0  # 正在合并的任务数
+        self._threads = 0  # 当前存活的工作线程数
+        self._cond = threading.Condition()
+
+    def submit(self, task):
+        """把 task 排入合并队列，等待中的合并已有 max_pending 个时阻塞到有空位为止"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._queue) < self.max_pending)
+            task.queued_at = time.monotonic()
+            self._queue.append(task)
+            self._spawn_workers()
+            self._cond.notify_all()
+        self._report()
+
+    def set_workers(self, workers):
+        """运行时调整同时进行的合并数，多出的工作线程在完成手头的合并后退出"""
+        with self._cond:
+            self.workers = max(1, workers)
+            self._spawn_workers()
+            self._cond.notify_all()
+
+    def stats(self):
+        """返回 (排队等待的合并数, 正在进行的合并数)"""
+        with self._cond:
+            return len(self._queue), self._running
+
+    def _spawn_workers(self):
+        # 调用方需持有 self._cond；工作线程按需创建，不超过 workers
+        while self._threads < self.workers and self._threads < self._running + len(self._queue):
+            self._threads += 1
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                task = None
+                while self._threads <= self.workers:
+                    if self._queue:
+                        task = self._queue.popleft()
+                        break
+                    # 等待超时后回到循环开头再检查一次队列，恰好在超时时排入的合并不会没有线程处理
+                    if not self._cond.wait(timeout=30) and not self._queue:
+                        break  # 长时间空闲的线程退出，有新的合并时再创建
+                if task is None:
+                    # 空闲退出时队列必定为空，且仍持有锁，之后排入的合并会由 submit 创建新线程
+                    self._threads -= 1
+                    return
+                self._running += 1
+                task.wait_seconds = time.monotonic() - task.queued_at
+                self._cond.notify_all()  # 队列有了空位，唤醒阻塞在 submit 中的下载线程
+            self._report()
+
+            try:
+                self.merge(task)
+            except Exception as ex:
+                print(f"合并 {task.output_filename} 时出错: {ex}")
+            finally:
+                with self._cond:
+                    self._running -= 1
+                self._report()
+
+    def _report(self):
+        if self.metrics is not None:
+            self.metrics.merge_queue(*self.stats())
@@ -0,0 +1,107 @@
+# metadata_cache.py
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+
+class MetadataCache:
+    """视频元数据缓存：按 BV 号保存 (标题, 文件名, 播放信息)
+内存中按 LRU 淘汰，条目的过期时间取默认 TTL 与播放信息中 CDN 签名链接 deadline 两者中较早的一个
+指定 cache_dir 时同时写入磁盘，程序重启后仍可复用未过期的条目"""
+
+    def __init__(self, max_entries=256, ttl=1800, cache_dir=None, expiry_margin=60):
+        self.max_entries = max_entries  # 内存中最多保存的条目数
+        self.ttl = ttl  # 默认有效期（秒）
+        self.cache_dir = cache_dir
+        self.expiry_margin = expiry_margin  # 在链接真正过期前提前这么多秒视为过期，留出下载时间
+        self._entries = OrderedDict()  # video_id -> (过期时间, 标题, 文件名, 播放信息)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def url_deadline(video_info):
+        """返回播放信息中所有流链接的最早 deadline（Unix 时间戳），没有时返回 None"""
+        dash = (video_info.get('data') or {}).get('dash') or {}
+        deadlines = []
+        for stream in (dash.get('video') or []) + (dash.get('audio') or []):
+            urls = [stream.get('base_url')] + list(stream.get('backup_url') or [])
+            for url in filter(None, urls):
+                value = parse_qs(urlsplit(url).query).get('deadline', [''])[0]
+                if value.isdigit():
+                    deadlines.append(int(value))
+        return min(deadlines) if deadlines else None
+
+    def get(self, video_id):
+        """返回未过期的 (标题, 文件名, 播放信息)，没有时返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(video_id)
+                    return entry[1:]
+                del self._entries[video_id]
+
+        entry = self._load_from_disk(video_id)
+        if entry is None or entry[0] <= now:
+            return None
+        with self._lock:
+            self._store(video_id, entry)
+        return entry[1:]
+
+    def put(self, video_id, title, filename, video_info):
+        expires_at = time.time() + self.ttl
+        deadline = self.url_deadline(video_info)
+        if deadline is not None:
+            expires_at = min(expires_at, deadline - self.expiry_margin)
+        entry = (expires_at, title, filename, video_info)
+        with self._lock:
+            self._store(video_id, entry)
+        self._save_to_disk(video_id, entry)
+
+    def invalidate(self, video_id):
+        """删除条目，例如缓存的流链接返回 403 时"""
+        with self._lock:
+            self._entries.pop(video_id, None)
+        if self.cache_dir:
+            try:
+                os.remove(self._disk_path(video_id))
+            except FileNotFoundError:
+                pass
+
+    def _store(self, video_id, entry):
+        # 调用方需持有 self._lock
+        self._entries[video_id] = entry
+        self._entries.move_to_end(video_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)  # 淘汰最久未使用的条目
+
+    def _disk_path(self, video_id):
+        return os.path.join(self.cache_dir, f"{video_id}.json")
+
+    def _load_from_disk(self, video_id):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(video_id), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data['expires_at'], data['title'], data['filename'], data['video_info']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_to_disk(self, video_id, entry):
+        if not self.cache_dir:
+            return
+        expires_at, title, filename, video_info = entry
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._disk_path(video_id)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'expires_at': expires_at, 'title': title, 'filename': filename,
+                           'video_info': video_info}, f, ensure_ascii=False)
+            os.replace(path + '.tmp', path)
+        except OSError as ex:
+            print(f"写入元数据缓存失败: {ex}")
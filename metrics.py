@@ -0,0 +1,255 @@
+# metrics.py
+
+import os
+import json
+import time
+import threading
+from collections import deque
+
+
+class StreamStats:
+    """单个流（一个任务的视频流或音频流）的传输统计，由下载的各个连接线程共同更新"""
+
+    def __init__(self, registry, video_id, stream, stall_threshold=1.0, speed_window=3.0):
+        self.registry = registry
+        self.video_id = video_id
+        self.stream = stream  # 'video' 或 'audio'
+        self.stall_threshold = stall_threshold  # 整个流超过这么多秒没有收到数据即计为卡顿
+        self.speed_window = speed_window  # 计算当前速度的时间窗口（秒）
+        self.bytes = 0
+        self.requests = 0
+        self.ttfb_total = 0.0  # 各次请求首字节时间之和
+        self.retries = 0
+        self.stall_seconds = 0.0
+        self.status = 'running'
+        self.started = time.time()
+        self.finished = None
+        self._first_byte = None
+        self._last_byte = None
+        self._samples = deque()  # (时间, 字节数)，用于计算当前速度
+        self._lock = threading.Lock()
+
+    def ttfb(self, seconds):
+        """记录一次请求从发出到收到第一块数据的时间"""
+        with self._lock:
+            self.requests += 1
+            self.ttfb_total += seconds
+
+    def add(self, nbytes):
+        now = time.monotonic()
+        with self._lock:
+            if self._first_byte is None:
+                self._first_byte = now
+            elif now - self._last_byte > self.stall_threshold:
+                self.stall_seconds += now - self._last_byte
+            self._last_byte = now
+            self.bytes += nbytes
+            self._samples.append((now, nbytes))
+            while self._samples and now - self._samples[0][0] > self.speed_window:
+                self._samples.popleft()
+
+    def retry(self, reason):
+        with self._lock:
+            self.retries += 1
+        self.registry.log('retry', video_id=self.video_id, stream=self.stream, reason=str(reason))
+
+    def finish(self, status):
+        """下载结束时调用，status 为 'done'、'paused' 或 'error'，同时写入日志"""
+        with self._lock:
+            self.status = status
+            self.finished = time.time()
+        self.registry.log('stream_finished', **self.summary())
+        self.registry.save_snapshot()
+
+    def speed(self):
+        """最近 speed_window 秒内的速度（字节/秒）"""
+        now = time.monotonic()
+        with self._lock:
+            recent = sum(n for t, n in self._samples if now - t <= self.speed_window)
+        return recent / self.speed_window
+
+    def average_speed(self):
+        with self._lock:
+            if self._first_byte is None or self._last_byte == self._first_byte:
+                return 0.0
+            return self.bytes / (self._last_byte - self._first_byte)
+
+    def summary(self):
+        average_speed = self.average_speed()
+        with self._lock:
+            return {
+                'video_id': self.video_id,
+                'stream': self.stream,
+                'status': self.status,
+                'bytes': self.bytes,
+                'bytes_per_second': round(average_speed, 1),
+                'ttfb_seconds': round(self.ttfb_total / self.requests, 4) if self.requests else None,
+                'requests': self.requests,
+                'retries': self.retries,
+                'stall_seconds': round(self.stall_seconds, 3),
+                'elapsed_seconds': round((self.finished or time.time()) - self.started, 3),
+            }
+
+
+class MetricsRegistry:
+    """传输指标：按任务（BV 号）和流记录速度、首字节时间、重试次数、卡顿时间和合并耗时
+指定 log_path 时每个事件追加一行 JSON；指定 snapshot_path 时每个流或合并结束后
+把 Prometheus 文本格式的快照写入该文件，也可以随时调用 prometheus_text() 获取"""
+
+    def __init__(self, log_path=None, snapshot_path=None, max_streams=1000):
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        self.max_streams = max_streams  # 最多保留的流统计数，超出时丢弃最早结束的流
+        self._streams = {}  # (video_id, stream) -> StreamStats，同一个流重新下载时替换为新的统计
+        self._merges = {}  # video_id -> {'engine', 'seconds', 'status', 'wait_seconds'}
+        self._merge_queue = (0, 0)  # 合并阶段的 (排队等待数, 正在合并数)
+        self._lock = threading.Lock()
+
+    def stream(self, video_id, stream):
+        """开始统计一个流，返回 StreamStats"""
+        stats = StreamStats(self, video_id, stream)
+        with self._lock:
+            self._streams.pop((video_id, stream), None)
+            self._streams[(video_id, stream)] = stats
+            if len(self._streams) > self.max_streams:
+                finished = [key for key, s in self._streams.items() if s.status != 'running']
+                for key in finished[:len(self._streams) - self.max_streams]:
+                    del self._streams[key]
+        return stats
+
+    def merge_finished(self, video_id, engine, seconds, status, wait_seconds=None):
+        # wait_seconds 为在合并队列中等待的时间，边下载边合并时为 None
+        with self._lock:
+            self._merges[video_id] = {'engine': engine, 'seconds': seconds, 'status': status,
+                                      'wait_seconds': wait_seconds}
+        self.log('merge_finished', video_id=video_id, engine=engine, seconds=round(seconds, 3),
+                 status=status, wait_seconds=None if wait_seconds is None else round(wait_seconds, 3))
+        self.save_snapshot()
+
+    def merge_queue(self, waiting, running):
+        """记录合并阶段当前排队等待和正在进行的合并数"""
+        with self._lock:
+            self._merge_queue = (waiting, running)
+
+    def job_speed(self, video_id):
+        """任务所有流的当前速度之和（字节/秒）"""
+        with self._lock:
+            streams = [s for (vid, _), s in self._streams.items() if vid == video_id]
+        return sum(s.speed() for s in streams if s.status == 'running')
+
+    def log(self, event, **fields):
+        if not self.log_path:
+            return
+        line = json.dumps(dict(time=round(time.time(), 3), event=event, **fields), ensure_ascii=False)
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+        except OSError as ex:
+            print(f"写入传输日志失败: {ex}")
+
+    def prometheus_text(self):
+        """返回 Prometheus 文本格式的指标快照"""
+        with self._lock:
+            streams = list(self._streams.values())
+            merges = dict(self._merges)
+            waiting, running = self._merge_queue
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        rows = []  # (标签, StreamStats, 汇总)
+        for stats in streams:
+            summary = stats.summary()
+            rows.append(({'video_id': summary['video_id'], 'stream': summary['stream']}, stats, summary))
+        metric('bilibili_download_bytes_total', 'counter', '已下载的字节数',
+               [(key, d['bytes']) for key, s, d in rows])
+        metric('bilibili_download_speed_bytes', 'gauge', '最近几秒的下载速度（字节/秒）',
+               [(key, round(s.speed(), 1)) for key, s, d in rows if d['status'] == 'running'])
+        metric('bilibili_download_average_speed_bytes', 'gauge', '从首字节到最后一个字节的平均速度（字节/秒）',
+               [(key, d['bytes_per_second']) for key, s, d in rows])
+        metric('bilibili_download_ttfb_seconds', 'gauge', '各次请求首字节时间的平均值',
+               [(key, d['ttfb_seconds']) for key, s, d in rows if d['ttfb_seconds'] is not None])
+        metric('bilibili_download_requests_total', 'counter', '发出的请求数',
+               [(key, d['requests']) for key, s, d in rows])
+        metric('bilibili_download_retries_total', 'counter', '失败重试或切换镜像的次数',
+               [(key, d['retries']) for key, s, d in rows])
+        metric('bilibili_download_stall_seconds_total', 'counter', '整个流收不到数据的累计时间',
+               [(key, d['stall_seconds']) for key, s, d in rows])
+        metric('bilibili_download_running', 'gauge', '流是否正在下载',
+               [(key, int(d['status'] == 'running')) for key, s, d in rows])
+        metric('bilibili_merge_seconds', 'gauge', '音视频合并耗时',
+               [({'video_id': video_id, 'engine': m['engine'], 'status': m['status']}, round(m['seconds'], 3))
+                for video_id, m in merges.items()])
+        metric('bilibili_merge_wait_seconds', 'gauge', '下载完成后在合并队列中等待的时间',
+               [({'video_id': video_id}, round(m['wait_seconds'], 3))
+                for video_id, m in merges.items() if m['wait_seconds'] is not None])
+        metric('bilibili_merge_queue_depth', 'gauge', '排队等待合并的任务数', [({}, waiting)])
+        metric('bilibili_merge_running', 'gauge', '正在合并的任务数', [({}, running)])
+        return '\n'.join(lines) + '\n'
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or '.', exist_ok=True)
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as ex:
+            print(f"写入指标快照失败: {ex}")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class ProgressEvents:
+    """合并任务状态变化事件：作为调度器的 listener 接收变化的任务，同一任务在 interval 秒内的多次变化只保留最新一次
+有新的变化时调用 notify()（最多每 interval 秒一次）唤醒界面，界面再调用 drain() 取出变化的任务，不需要定时轮询"""
+
+    def __init__(self, notify, interval=0.1):
+        self.notify = notify
+        self.interval = interval
+        self._pending = {}  # job_id -> job，保持首次变化的顺序
+        self._scheduled = False
+        self._last_notify = 0.0
+        self._lock = threading.Lock()
+
+    def publish(self, job):
+        with self._lock:
+            self._pending[job.job_id] = job
+            if self._scheduled:
+                return  # 已经安排了通知，这次变化会一并取出
+            self._scheduled = True
+            delay = self._last_notify + self.interval - time.monotonic()
+        if delay > 0:
+            timer = threading.Timer(delay, self._fire)
+            timer.daemon = True
+            timer.start()
+        else:
+            self._fire()
+
+    def drain(self):
+        """取出自上次以来发生变化的任务"""
+        with self._lock:
+            jobs = list(self._pending.values())
+            self._pending.clear()
+        return jobs
+
+    def _fire(self):
+        with self._lock:
+            self._scheduled = False
+            self._last_notify = time.monotonic()
+        try:
+            self.notify()
+        except RuntimeError:
+            pass  # 界面已关闭
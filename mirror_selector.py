@@ -0,0 +1,147 @@
+# mirror_selector.py
+
+import time
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+
+
+def stream_urls(stream):
+    """返回播放信息中一个流的全部地址：base_url 在前，backup_url 在后，去除重复"""
+    urls = [stream.get('base_url') or stream.get('baseUrl')]
+    urls += list(stream.get('backup_url') or stream.get('backupUrl') or [])
+    result = []
+    for url in urls:
+        if url and url not in result:
+            result.append(url)
+    return result
+
+
+class MirrorStalled(requests.exceptions.RequestException):
+    """当前镜像的吞吐量低于下限，剩余的区间应换到其他镜像下载"""
+
+
+class Mirror:
+    """一个 CDN 镜像地址及其探测结果"""
+
+    def __init__(self, url, total, etag=None, last_modified=None, ttfb=0.0, speed=None):
+        self.url = url
+        self.total = total
+        self.etag = etag
+        self.last_modified = last_modified
+        self.ttfb = ttfb  # 首字节时间（秒）
+        self.speed = speed  # 探测时的吞吐量（字节/秒），只探测了 1 字节时为 None
+
+    @property
+    def host(self):
+        return urlsplit(self.url).netloc
+
+    @property
+    def validator(self):
+        # 用于 If-Range，各镜像的 ETag 不一定相同，使用该镜像自己返回的值
+        return self.etag or self.last_modified
+
+    def estimated_time(self, nbytes):
+        """按首字节时间和吞吐量估算下载 nbytes 字节需要的秒数"""
+        if not self.speed:
+            return self.ttfb
+        return self.ttfb + nbytes / self.speed
+
+
+class MirrorSet:
+    """同一个文件的一组镜像，按预计下载时间从快到慢排列，由下载同一文件的各连接共享
+某个镜像出错或卡顿时把它移到末尾，之后的请求改用下一个镜像"""
+
+    def __init__(self, mirrors):
+        self._mirrors = list(mirrors)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._mirrors)
+
+    def current(self):
+        with self._lock:
+            return self._mirrors[0]
+
+    def has_faster(self, mirror, speed, margin=1.5):
+        """记下 mirror 实测的吞吐量 speed，返回是否有其他镜像已知比它快 margin 倍以上
+其他镜像的速度未知（只探测了 1 字节）时不算更快，避免把能用的慢镜像换成未知的镜像"""
+        with self._lock:
+            mirror.speed = speed
+            return any(m is not mirror and m.speed and m.speed > speed * margin for m in self._mirrors)
+
+    def demote(self, mirror, reason):
+        """把出错或卡顿的镜像移到末尾；多个连接同时报告同一个镜像时只移动一次"""
+        with self._lock:
+            if len(self._mirrors) < 2 or self._mirrors[0] is not mirror:
+                return
+            self._mirrors.append(self._mirrors.pop(0))
+            print(f"镜像 {mirror.host} {reason}，切换到 {self._mirrors[0].host}")
+
+
+class ThroughputMonitor:
+    """监视单个连接的吞吐量：每 window 秒计算一次，低于 min_speed 字节/秒且 has_faster(实测速度) 为真时
+抛出 MirrorStalled；没有更快的镜像时继续使用当前镜像，慢一些也比反复切换好
+完全收不到数据的情况由请求的读取超时处理"""
+
+    def __init__(self, min_speed, window=5, has_faster=None):
+        self.min_speed = min_speed
+        self.window = window
+        self.has_faster = has_faster
+        self._start = time.monotonic()
+        self._received = 0
+
+    def update(self, nbytes):
+        self._received += nbytes
+        now = time.monotonic()
+        elapsed = now - self._start
+        if elapsed < self.window:
+            return
+        speed = self._received / elapsed
+        if speed < self.min_speed and (self.has_faster is None or self.has_faster(speed)):
+            raise MirrorStalled(f"吞吐量 {speed / 1024:.0f} KB/s 低于下限 {self.min_speed / 1024:.0f} KB/s")
+        self._start = now
+        self._received = 0
+
+    def exclude(self, seconds):
+        """不把这段时间计入吞吐量，例如等待带宽限速的时间"""
+        self._start += seconds
+
+
+class MirrorSelector:
+    """对主地址和备用地址同时发起小范围的 Range 请求，按首字节时间和吞吐量选出最快的镜像
+probe(url, headers, sample_bytes) 负责实际的请求并返回 Mirror，由下载器提供"""
+
+    def __init__(self, probe, sample_bytes=256 * 1024, race_timeout=3):
+        self.probe = probe
+        self.sample_bytes = sample_bytes  # 每个镜像探测时读取的字节数
+        self.race_timeout = race_timeout  # 超过这个时间仍未完成探测的镜像不参与排序
+
+    def race(self, urls, headers, segment_size):
+        """并行探测所有地址，返回按下载 segment_size 字节的预计时间排序的 MirrorSet
+大小与其他镜像不一致的地址会被丢弃；所有地址都失败时抛出第一个地址的异常"""
+        if len(urls) == 1:
+            return MirrorSet([self.probe(urls[0], headers, 1)])
+
+        pool = ThreadPoolExecutor(max_workers=len(urls))
+        futures = [pool.submit(self.probe, url, headers, self.sample_bytes) for url in urls]
+        try:
+            done, pending = wait(futures, timeout=self.race_timeout)
+            # 限定时间内没有镜像成功时，继续等待第一个成功的镜像或全部失败
+            while pending and not any(f.exception() is None for f in done):
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done |= finished
+        finally:
+            pool.shutdown(wait=False)  # 不等待仍未完成的慢镜像
+
+        mirrors = [f.result() for f in futures if f in done and f.exception() is None]
+        if not mirrors:
+            raise next(f.exception() for f in futures if f in done)
+        total = mirrors[0].total
+        mirrors = [m for m in mirrors if m.total == total]
+        mirrors.sort(key=lambda m: m.estimated_time(segment_size))
+        ranking = '，'.join(f"{m.host} {m.ttfb * 1000:.0f}ms" +
+                           (f" {m.speed / 1024 / 1024:.1f}MB/s" if m.speed else '') for m in mirrors)
+        print(f"镜像测速：{ranking}")
+        return MirrorSet(mirrors)
@@ -0,0 +1,296 @@
+# mp4_remuxer.py
+
+import os
+import mmap
+import heapq
+import struct
+
+
+class RemuxError(Exception):
+    """输入不是可以直接拼接的分片 MP4（fMP4），调用方应改用 FFmpeg 合并"""
+
+
+def _iter_boxes(data, start, end):
+    # 遍历 [start, end) 范围内的同级 box，产出 (类型, box 起点, 头部长度, box 终点)
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise RemuxError("box 头部不完整")
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos  # 一直延伸到文件末尾
+        if size < header or pos + size > end:
+            raise RemuxError(f"box {box_type!r} 的长度 {size} 超出范围")
+        yield box_type, pos, header, pos + size
+        pos += size
+
+
+def _find_box(data, start, end, box_type):
+    for found_type, box_start, header, box_end in _iter_boxes(data, start, end):
+        if found_type == box_type:
+            return box_start, header, box_end
+    return None
+
+
+def _find_path(data, start, end, path):
+    # 按路径逐层查找子 box，例如 (b'mdia', b'hdlr')，返回 (box 起点, 头部长度, box 终点)
+    found = None
+    for box_type in path:
+        found = _find_box(data, start, end, box_type)
+        if found is None:
+            return None
+        start, end = found[0] + found[1], found[2]
+    return found
+
+
+def _box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def _rescale(value, from_scale, to_scale, size):
+    # 换算时间刻度，0xFFFF... 表示未知时长，保持不变；超出字段范围时截断
+    limit = (1 << (8 * size)) - 1
+    if value == limit or from_scale == to_scale:
+        return value
+    return min(value * to_scale // from_scale, limit)
+
+
+class _FragmentedInput:
+    """一个只含单条音轨或视轨的分片 MP4 输入，用 mmap 只读映射，不把 mdat 读入内存"""
+
+    def __init__(self, path, handler_type):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise RemuxError(f"{os.path.basename(path)} 是空文件")
+        self.view = memoryview(self.data)
+        try:
+            self._parse(handler_type)
+        except BaseException:
+            self.close()
+            raise
+
+    def _parse(self, handler_type):
+        data = self.data
+        self.ftyp = None
+        moov = None
+        self.fragments = []  # [解码时间（秒，读取 tfdt 前暂存 moof 内容起点）, moof 起点, moof 终点, 片段终点]
+        boxes = list(_iter_boxes(data, 0, len(data)))
+        index = 0
+        while index < len(boxes):
+            box_type, start, header, end = boxes[index]
+            index += 1
+            if box_type == b'ftyp':
+                self.ftyp = bytes(data[start:end])
+            elif box_type == b'moov':
+                moov = (start, header, end)
+            elif box_type == b'moof':
+                # moof 和紧随其后的 mdat 一起整体复制，trun 中相对 moof 的数据偏移保持有效
+                fragment_end = end
+                while index < len(boxes) and boxes[index][0] == b'mdat':
+                    fragment_end = boxes[index][3]
+                    index += 1
+                self.fragments.append([start + header, start, end, fragment_end])
+            # sidx、styp、mfra、free 等索引或占位 box 在输出中不需要，直接丢弃
+
+        if moov is None:
+            raise RemuxError(f"{os.path.basename(self.path)} 中没有 moov")
+        moov_start, moov_end = moov[0] + moov[1], moov[2]
+        if _find_box(data, moov_start, moov_end, b'mvex') is None or not self.fragments:
+            raise RemuxError(f"{os.path.basename(self.path)} 不是分片 MP4")
+
+        mvhd = _find_box(data, moov_start, moov_end, b'mvhd')
+        if mvhd is None:
+            raise RemuxError("缺少 mvhd")
+        self.mvhd = (mvhd[0], mvhd[2])
+        payload = mvhd[0] + mvhd[1]
+        if data[payload] == 1:
+            self.movie_timescale, self.movie_duration = struct.unpack_from('>IQ', data, payload + 20)
+        else:
+            self.movie_timescale, self.movie_duration = struct.unpack_from('>II', data, payload + 12)
+
+        # 找到指定类型（vide/soun）的轨道
+        self.trak = None
+        for box_type, start, header, end in _iter_boxes(data, moov_start, moov_end):
+            if box_type != b'trak':
+                continue
+            hdlr = _find_path(data, start + header, end, (b'mdia', b'hdlr'))
+            if hdlr is not None and bytes(data[hdlr[0] + hdlr[1] + 8:hdlr[0] + hdlr[1] + 12]) == handler_type:
+                self.trak = (start, header, end)
+                break
+        if self.trak is None:
+            raise RemuxError(f"{os.path.basename(self.path)} 中没有 {handler_type.decode()} 轨道")
+
+        trak_start, trak_header, trak_end = self.trak
+        tkhd = _find_box(data, trak_start + trak_header, trak_end, b'tkhd')
+        mdhd = _find_path(data, trak_start + trak_header, trak_end, (b'mdia', b'mdhd'))
+        if tkhd is None or mdhd is None:
+            raise RemuxError("轨道中缺少 tkhd 或 mdhd")
+        payload = tkhd[0] + tkhd[1]
+        self.track_id = struct.unpack_from('>I', data, payload + (20 if data[payload] == 1 else 12))[0]
+
+        payload = mdhd[0] + mdhd[1]
+        self.media_timescale = struct.unpack_from('>I', data, payload + (20 if data[payload] == 1 else 12))[0]
+
+        self.trex = None
+        mvex = _find_box(data, moov_start, moov_end, b'mvex')
+        for box_type, start, header, end in _iter_boxes(data, mvex[0] + mvex[1], mvex[2]):
+            if box_type == b'trex' and struct.unpack_from('>I', data, start + header + 4)[0] == self.track_id:
+                self.trex = (start, end)
+        if self.trex is None:
+            raise RemuxError("缺少对应轨道的 trex")
+
+        # 读取每个片段的 tfdt，用于按时间交错两条轨道的片段
+        for position, fragment in enumerate(self.fragments):
+            tfdt = _find_path(data, fragment[0], fragment[2], (b'traf', b'tfdt'))
+            if tfdt is not None and self.media_timescale:
+                payload = tfdt[0] + tfdt[1]
+                fmt = '>Q' if data[payload] == 1 else '>I'
+                fragment[0] = struct.unpack_from(fmt, data, payload + 4)[0] / self.media_timescale
+            else:
+                fragment[0] = position / len(self.fragments)  # 没有 tfdt 时按片段序号均匀交错
+
+    def patched_trak(self, track_id, movie_timescale):
+        """返回修改了轨道 ID、并把时长换算到输出 moov 时间刻度的 trak"""
+        start, header, end = self.trak
+        trak = bytearray(self.data[start:end])
+        tkhd = _find_box(trak, header, len(trak), b'tkhd')
+        payload = tkhd[0] + tkhd[1]
+        if trak[payload] == 1:
+            id_offset, duration_offset, size = payload + 20, payload + 28, 8
+        else:
+            id_offset, duration_offset, size = payload + 12, payload + 20, 4
+        struct.pack_into('>I', trak, id_offset, track_id)
+        fmt = '>Q' if size == 8 else '>I'
+        duration = struct.unpack_from(fmt, trak, duration_offset)[0]
+        struct.pack_into(fmt, trak, duration_offset,
+                         _rescale(duration, self.movie_timescale, movie_timescale, size))
+
+        # 编辑列表中的 segment_duration 同样使用 moov 的时间刻度
+        elst = _find_path(trak, header, len(trak), (b'edts', b'elst'))
+        if elst is not None:
+            payload = elst[0] + elst[1]
+            version = trak[payload]
+            entry_count = struct.unpack_from('>I', trak, payload + 4)[0]
+            size = 8 if version == 1 else 4
+            fmt = '>Q' if size == 8 else '>I'
+            for i in range(entry_count):
+                offset = payload + 8 + i * (2 * size + 4)
+                value = struct.unpack_from(fmt, trak, offset)[0]
+                struct.pack_into(fmt, trak, offset, _rescale(value, self.movie_timescale, movie_timescale, size))
+        return bytes(trak)
+
+    def patched_trex(self, track_id):
+        trex = bytearray(self.data[self.trex[0]:self.trex[1]])
+        header = 16 if struct.unpack_from('>I', trex, 0)[0] == 1 else 8
+        struct.pack_into('>I', trex, header + 4, track_id)
+        return bytes(trex)
+
+    def patched_moof(self, fragment, track_id, sequence_number, new_position):
+        """返回修改了序号和轨道 ID 的 moof；显式给出 base_data_offset 时按新位置平移"""
+        _, moof_start, moof_end, _ = fragment
+        moof = bytearray(self.data[moof_start:moof_end])
+        header = 16 if struct.unpack_from('>I', moof, 0)[0] == 1 else 8
+        for box_type, start, box_header, end in _iter_boxes(moof, header, len(moof)):
+            if box_type == b'mfhd':
+                struct.pack_into('>I', moof, start + box_header + 4, sequence_number)
+            elif box_type == b'traf':
+                tfhd = _find_box(moof, start + box_header, end, b'tfhd')
+                if tfhd is None:
+                    raise RemuxError("traf 中缺少 tfhd")
+                payload = tfhd[0] + tfhd[1]
+                flags = int.from_bytes(moof[payload + 1:payload + 4], 'big')
+                struct.pack_into('>I', moof, payload + 4, track_id)
+                if flags & 0x000001:  # base-data-offset-present，偏移是相对文件开头的绝对位置
+                    base = struct.unpack_from('>Q', moof, payload + 8)[0]
+                    struct.pack_into('>Q', moof, payload + 8, base - moof_start + new_position)
+        return moof
+
+    def close(self):
+        self.view.release()
+        self.data.close()
+        self._file.close()
+
+
+def remux(video_file, audio_file, output_file, progress_callback=None, digest=None):
+    """把分片 MP4 格式的视频流和音频流直接拼接为一个同时含两条轨道的 MP4，不重新编码
+输出仍是分片 MP4：ftyp + moov（两个 trak）+ 按解码时间交错的 moof/mdat
+progress_callback(百分比) 按已写入的字节数汇报进度；输入不符合要求时抛出 RemuxError
+digest 为 hashlib 的哈希对象时，写出的数据同时计入哈希，不必合并后再读一遍输出文件"""
+    try:
+        _remux(video_file, audio_file, output_file, progress_callback, digest)
+    except (struct.error, IndexError, ValueError, ZeroDivisionError) as ex:
+        # box 被截断或字段不合规范时按偏移读取会越界，同样视为无法拼接，由调用方改用 FFmpeg
+        raise RemuxError(f"输入文件的结构无法解析：{ex!r}") from ex
+
+
+def _remux(video_file, audio_file, output_file, progress_callback, digest):
+    video = _FragmentedInput(video_file, b'vide')
+    try:
+        audio = _FragmentedInput(audio_file, b'soun')
+    except BaseException:
+        video.close()
+        raise
+
+    partial_output = output_file + '.part'
+    try:
+        # 以视频文件的 mvhd 为基础，时长取两条轨道中较长的，下一个可用轨道 ID 为 3
+        movie_timescale = video.movie_timescale
+        mvhd = bytearray(video.data[video.mvhd[0]:video.mvhd[1]])
+        payload = 16 if struct.unpack_from('>I', mvhd, 0)[0] == 1 else 8
+        version = mvhd[payload]
+        audio_duration = _rescale(audio.movie_duration, audio.movie_timescale, movie_timescale,
+                                  8 if version == 1 else 4)
+        duration = max(video.movie_duration, audio_duration)
+        if version == 1:
+            struct.pack_into('>Q', mvhd, payload + 24, duration)
+            struct.pack_into('>I', mvhd, payload + 108, 3)
+        else:
+            struct.pack_into('>I', mvhd, payload + 16, duration)
+            struct.pack_into('>I', mvhd, payload + 96, 3)
+
+        moov = _box(b'moov', bytes(mvhd)
+                    + video.patched_trak(1, movie_timescale)
+                    + audio.patched_trak(2, movie_timescale)
+                    + _box(b'mvex', video.patched_trex(1) + audio.patched_trex(2)))
+        ftyp = video.ftyp or _box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2avc1mp41')
+
+        # 按解码时间交错两条轨道的片段，播放器边下边播时不必在两条轨道之间大范围跳读
+        fragments = heapq.merge(((f[0], 0, f) for f in video.fragments),
+                                ((f[0], 1, f) for f in audio.fragments))
+        total = len(ftyp) + len(moov) + sum(f[3] - f[1] for f in video.fragments + audio.fragments)
+        written = 0
+        last_percent = -1
+
+        with open(partial_output, 'wb', buffering=1024 * 1024) as out:
+            def write(data):
+                out.write(data)
+                if digest is not None:
+                    digest.update(data)
+
+            write(ftyp)
+            write(moov)
+            written = len(ftyp) + len(moov)
+            for sequence_number, (_, track_index, fragment) in enumerate(fragments, start=1):
+                source = video if track_index == 0 else audio
+                moof = source.patched_moof(fragment, track_index + 1, sequence_number, written)
+                write(moof)
+                write(source.view[fragment[2]:fragment[3]])  # mdat 直接从映射内存写出，不复制
+                written += fragment[3] - fragment[1]
+                percent = written * 100 // total
+                if progress_callback is not None and percent != last_percent:
+                    last_percent = percent
+                    progress_callback(percent)
+        os.replace(partial_output, output_file)
+    finally:
+        video.close()
+        audio.close()
+        if os.path.exists(partial_output):
+            os.remove(partial_output)
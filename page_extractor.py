@@ -0,0 +1,50 @@
+# page_extractor.py
+
+import re
+import json
+import html
+
+_META_TITLE = re.compile(r'<meta\s[^>]*?name=["\']title["\'][^>]*>')
+_CONTENT_ATTR = re.compile(r'content=(["\'])(.*?)\1', re.S)
+_ASSIGN = re.compile(r'\s*=\s*')
+_decoder = json.JSONDecoder()
+
+
+def extract_page_data(page_source, initial_state=False):
+    """从视频页面源码中只提取需要的数据，不构建完整的 DOM 树
+返回字典：title 为 <meta name="title"> 的内容，playinfo 为 window.__playinfo__ 解析后的 JSON，未找到的项为 None
+window.__INITIAL_STATE__ 是页面中最大的 JSON，下载用不到，只在 initial_state=True 时才解析并放入 initial_state"""
+    data = {
+        'title': _find_meta_title(page_source),
+        'playinfo': _find_json(page_source, 'window.__playinfo__'),
+    }
+    if initial_state:
+        data['initial_state'] = _find_json(page_source, 'window.__INITIAL_STATE__')
+    return data
+
+
+def _find_meta_title(page_source):
+    # 用 str.find 跳到每个 <meta 标签，只在标签范围内做正则匹配，找到第一个即停止
+    pos = page_source.find('<meta')
+    while pos != -1:
+        match = _META_TITLE.match(page_source, pos)
+        if match:
+            content = _CONTENT_ATTR.search(match.group(0))
+            if content:
+                return html.unescape(content.group(2))
+        pos = page_source.find('<meta', pos + 5)
+    return None
+
+
+def _find_json(page_source, marker):
+    # 定位到赋值语句后用 raw_decode 直接解析到对象结束，不依赖后面紧跟 </script>，也不会被字符串中的 } 截断
+    pos = page_source.find(marker)
+    while pos != -1:
+        assign = _ASSIGN.match(page_source, pos + len(marker))
+        if assign:
+            try:
+                return _decoder.raw_decode(page_source, assign.end())[0]
+            except ValueError:
+                pass  # 不是合法的 JSON（例如出现在字符串或注释中），继续向后查找
+        pos = page_source.find(marker, pos + len(marker))
+    return None
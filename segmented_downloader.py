@@ -0,0 +1,349 @@
+# segmented_downloader.py
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+from download_state import DownloadState, checkpoint_due
+from mirror_selector import Mirror, MirrorSelector, MirrorStalled, ThroughputMonitor
+from stream_reader import StreamReader, StopChecker, preallocate
+
+
+# 测速时每个下载同时探测的镜像数（主地址加备用地址），用于估算连接池大小
+PROBE_FANOUT = 3
+
+
+class RangeNotSupported(Exception):
+    """服务器不支持 Range 请求，调用方应回退到单连接下载"""
+
+
+class SegmentedDownloader:
+    """多连接分段下载器：探测文件大小后按字节区间切分，并行拉取并写入预分配文件的对应偏移
+B站 CDN 对单个连接限速，多条连接同时拉取不同区间可以把带宽跑满
+给出备用地址时先测速选出最快的镜像，下载中某个镜像出错或卡顿，剩余的区间改从其他镜像下载"""
+
+    def __init__(self, connections=4, segment_size=4 * 1024 * 1024, timeout=10,
+                 min_speed=64 * 1024, stall_window=5, max_downloads=1):
+        self.connections = connections  # 并行连接数
+        self.segment_size = segment_size  # 每个分段的字节数
+        self.timeout = timeout
+        self.min_speed = min_speed  # 有备用镜像时，单个连接低于这个速度（字节/秒）即视为卡顿
+        self.stall_window = stall_window  # 计算吞吐量的时间窗口（秒）
+        self.mirror_selector = MirrorSelector(self.probe_mirror)
+
+        # 使用连接池复用 TCP/TLS 连接；同一个下载器被多个同时进行的下载共用（视频流、音频流和多个任务），
+        # 每个主机的池要能容纳所有下载的分段连接和测速请求，否则多出的连接用完即被丢弃，失去长连接复用
+        self.max_downloads = max_downloads
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=16, pool_maxsize=self._pool_size())
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+
+    def _pool_size(self):
+        return (self.connections + PROBE_FANOUT) * self.max_downloads
+
+    def set_max_downloads(self, max_downloads):
+        """设置同时使用本下载器的下载数，连接池随之扩大；只扩大不缩小，进行中的下载不受影响"""
+        if max_downloads <= self.max_downloads:
+            return
+        self.max_downloads = max_downloads
+        # 换用新的连接池管理器，进行中的请求结束后把连接放回原来的池
+        self._adapter.init_poolmanager(16, self._pool_size())
+
+    def probe_mirror(self, url, headers, sample_bytes=1):
+        """请求文件开头的 sample_bytes 字节，返回记录了大小、校验信息、首字节时间和吞吐量的 Mirror
+服务器不支持 Range 时抛出 RangeNotSupported"""
+        probe_headers = dict(headers, Range=f'bytes=0-{sample_bytes - 1}')
+        started = time.monotonic()
+        with self.session.get(url, headers=probe_headers, stream=True, timeout=self.timeout) as r:
+            r.raise_for_status()
+            content_range = r.headers.get('Content-Range', '')
+            if r.status_code != 206 or '/' not in content_range:
+                raise RangeNotSupported(f"状态码 {r.status_code}，Content-Range: {content_range!r}")
+            total = content_range.rsplit('/', 1)[1].strip()
+            if not total.isdigit():
+                raise RangeNotSupported(f"无法确定文件大小，Content-Range: {content_range!r}")
+
+            # 首字节时间从发出请求算起，吞吐量只统计第一个数据块之后的部分
+            first_byte_at = None
+            received = after_first = 0
+            for chunk in r.iter_content(chunk_size=65536):
+                if first_byte_at is None:
+                    first_byte_at = time.monotonic()
+                else:
+                    after_first += len(chunk)
+                received += len(chunk)
+                if received >= sample_bytes:
+                    break
+            now = time.monotonic()
+            ttfb = (first_byte_at or now) - started
+            speed = after_first / max(now - first_byte_at, 1e-6) if after_first else None
+            return Mirror(url, int(total), r.headers.get('ETag'), r.headers.get('Last-Modified'),
+                          ttfb, speed)
+
+    def select_mirrors(self, url, headers, backup_urls=()):
+        """只有一个地址时只做探测，否则对所有镜像测速，返回按速度排序的 MirrorSet"""
+        urls = [url] + [u for u in backup_urls if u != url]
+        return self.mirror_selector.race(urls, headers, self.segment_size)
+
+    def _monitor(self, mirrors, mirror):
+        # 只有存在可切换的镜像时才检测卡顿，而且只在已知有更快的镜像时才切换，否则慢一些也继续用当前镜像
+        if len(mirrors) > 1 and self.min_speed:
+            return ThroughputMonitor(self.min_speed, self.stall_window,
+                                     lambda speed: mirrors.has_faster(mirror, speed))
+        return None
+
+    def split(self, start, end):
+        # 按 segment_size 把 [start, end) 切分为若干左闭右开区间
+        return [(s, min(s + self.segment_size, end)) for s in range(start, end, self.segment_size)]
+
+    def download(self, url, part_path, headers, should_stop, max_retries=5, retry_delay=2,
+                 progress_callback=None, backup_urls=(), throttle=None, stats=None):
+        """分段并行下载到 part_path，被 should_stop() 中断时返回 False，成功返回 True
+已写入磁盘的区间记录在 part_path + '.json' 中，再次调用时只下载缺失的部分
+progress_callback(已下载字节数, 总字节数) 在每收到一块数据后被调用
+backup_urls 为同一文件的备用镜像地址，参与测速并在当前镜像出错或卡顿时接替
+throttle(字节数) 在每收到一块数据后调用，用于限速，返回 False 表示在等待中被中断
+stats 为 metrics.StreamStats，记录首字节时间、字节数和重试次数"""
+        mirrors = self.select_mirrors(url, headers, backup_urls)
+        best = mirrors.current()
+        url, total, etag, last_modified = best.url, best.total, best.etag, best.last_modified
+        if total == 0:
+            raise RangeNotSupported("文件大小为 0")
+
+        state_path = part_path + '.json'
+        state = DownloadState.load(state_path)
+        if (state is None or not state.matches(url, total, etag, last_modified)
+                or not os.path.exists(part_path) or os.path.getsize(part_path) != total):
+            if state is not None:
+                print("服务器文件已变化或续传记录无效，重新开始下载")
+            # 预分配目标文件，各分段直接写入自己的偏移位置
+            state = DownloadState(state_path, url, total, etag, last_modified)
+            with open(part_path, 'wb') as f:
+                preallocate(f, total)
+            state.save()
+        else:
+            print(f"从断点继续下载：已完成 {state.completed_bytes()}/{total} 字节")
+
+        # 各分段线程共享的已下载字节计数，续传时从已完成的字节数开始
+        downloaded = [state.completed_bytes()]
+        counter_lock = threading.Lock()
+
+        def advance(nbytes):
+            with counter_lock:
+                downloaded[0] += nbytes
+                done = downloaded[0]
+            if progress_callback is not None:
+                progress_callback(done, total)
+
+        advance(0)
+        segments = [segment for start, end in state.missing_ranges()
+                    for segment in self.split(start, end)]
+        if not segments:
+            state.remove()
+            return True
+
+        abort = threading.Event()  # 任一分段失败或被暂停时通知其余分段尽快退出
+        print(f"分段下载：{total} 字节，{len(segments)} 段待下载，{self.connections} 个连接")
+
+        with ThreadPoolExecutor(max_workers=min(self.connections, len(segments))) as pool:
+            futures = [pool.submit(self._fetch_segment, mirrors, part_path, headers, start, end,
+                                   state, should_stop, abort, max_retries, retry_delay, advance,
+                                   throttle, stats)
+                       for start, end in segments]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                abort.set()
+                raise
+
+        if should_stop():
+            print("下载已暂停")
+            return False
+        state.remove()
+        return True
+
+    def _fetch_segment(self, mirrors, part_path, headers, start, end, state,
+                       should_stop, abort, max_retries, retry_delay, advance, throttle, stats):
+        # 拉取单个分段 [start, end)，重试时从本段已写入的位置继续，并改用当前最快的镜像
+        pos = start
+        attempt = 0
+        should_stop = StopChecker(should_stop)
+        with open(part_path, 'r+b') as f:
+            while pos < end:
+                if abort.is_set() or should_stop():
+                    abort.set()
+                    return
+                recorded = attempt_start = pos  # 已记入状态文件的位置
+                checkpointed_at = time.monotonic()
+                mirror = mirrors.current()
+                monitor = self._monitor(mirrors, mirror)
+                try:
+                    range_headers = dict(headers, Range=f'bytes={pos}-{end - 1}')
+                    if mirror.validator:
+                        # 文件一旦变化服务器会返回 200 而不是 206
+                        range_headers['If-Range'] = mirror.validator
+                    requested = time.monotonic()
+                    with self.session.get(mirror.url, headers=range_headers, stream=True,
+                                          timeout=self.timeout) as r:
+                        r.raise_for_status()
+                        if r.status_code != 206:
+                            raise RangeNotSupported(f"分段请求返回状态码 {r.status_code}，服务器文件可能已变化")
+                        f.seek(pos)
+                        for chunk in StreamReader(r):
+                            if abort.is_set() or should_stop():
+                                abort.set()
+                                return
+                            if chunk:
+                                if requested is not None and stats is not None:
+                                    stats.ttfb(time.monotonic() - requested)
+                                requested = None
+                                if not self._wait_throttle(throttle, len(chunk), monitor):
+                                    abort.set()
+                                    return
+                                chunk = chunk[:end - pos]  # 防止服务器多返回数据越界写入
+                                f.write(chunk)
+                                pos += len(chunk)
+                                advance(len(chunk))
+                                if stats is not None:
+                                    stats.add(len(chunk))
+                                if monitor is not None:
+                                    monitor.update(len(chunk))
+                                if checkpoint_due(pos - recorded, checkpointed_at):
+                                    state.checkpoint(f, recorded, pos)
+                                    recorded, checkpointed_at = pos, time.monotonic()
+                                if pos >= end:
+                                    break
+                    if pos < end:
+                        raise requests.exceptions.ChunkedEncodingError(
+                            f"分段 {start}-{end - 1} 连接提前结束，已收到 {pos - start} 字节")
+                except requests.exceptions.RequestException as ex:
+                    if pos > attempt_start:
+                        attempt = 0  # 本次请求收到过数据，连接时断时续但仍在进展，重新计数
+                    attempt = self._retry_or_raise(mirrors, mirror, start, end, ex, attempt, max_retries,
+                                                   retry_delay, stats)
+                finally:
+                    # 无论成功、暂停还是出错，都把已写入的部分刷新到磁盘并记录下来
+                    state.checkpoint(f, recorded, pos)
+
+    def stream(self, url, headers, should_stop, max_retries=5, retry_delay=2, backup_urls=(),
+               throttle=None, stats=None):
+        """按顺序读取整个文件而不写入磁盘，返回 (总大小, 数据块迭代器)
+同时最多 connections 个分段在并行下载，内存中最多缓存 connections 个分段
+服务器不支持 Range 时在返回前抛出 RangeNotSupported"""
+        mirrors = self.select_mirrors(url, headers, backup_urls)
+        total = mirrors.current().total
+        return total, self._iter_segments(mirrors, headers, total, should_stop, max_retries, retry_delay,
+                                          throttle, stats)
+
+    def _iter_segments(self, mirrors, headers, total, should_stop, max_retries, retry_delay, throttle,
+                       stats):
+        segments = iter(self.split(0, total))
+        abort = threading.Event()
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.connections) as pool:
+            def submit_next():
+                segment = next(segments, None)
+                if segment is not None:
+                    pending.append(pool.submit(self._fetch_bytes, mirrors, headers, *segment,
+                                               should_stop, abort, max_retries, retry_delay, throttle,
+                                               stats))
+
+            for _ in range(self.connections):
+                submit_next()
+            try:
+                while pending:
+                    data = pending.popleft().result()
+                    if data is None:
+                        return  # 被暂停
+                    submit_next()
+                    yield data
+            finally:
+                # 出错、暂停或调用方提前停止迭代时，让仍在下载的分段尽快退出
+                abort.set()
+                for future in pending:
+                    future.cancel()
+
+    def _fetch_bytes(self, mirrors, headers, start, end, should_stop, abort, max_retries, retry_delay,
+                     throttle, stats):
+        # 把分段 [start, end) 读入内存，被中断时返回 None
+        buffer = bytearray()
+        size = end - start
+        attempt = 0
+        should_stop = StopChecker(should_stop)
+        while len(buffer) < size:
+            if abort.is_set() or should_stop():
+                return None
+            mirror = mirrors.current()
+            monitor = self._monitor(mirrors, mirror)
+            attempt_start = len(buffer)
+            try:
+                range_headers = dict(headers, Range=f'bytes={start + len(buffer)}-{end - 1}')
+                if mirror.validator:
+                    range_headers['If-Range'] = mirror.validator
+                requested = time.monotonic()
+                with self.session.get(mirror.url, headers=range_headers, stream=True,
+                                      timeout=self.timeout) as r:
+                    r.raise_for_status()
+                    if r.status_code != 206:
+                        raise RangeNotSupported(f"分段请求返回状态码 {r.status_code}")
+                    for chunk in StreamReader(r):
+                        if abort.is_set() or should_stop():
+                            return None
+                        if requested is not None and stats is not None:
+                            stats.ttfb(time.monotonic() - requested)
+                        requested = None
+                        if not self._wait_throttle(throttle, len(chunk), monitor):
+                            return None
+                        buffer += chunk[:size - len(buffer)]
+                        if stats is not None:
+                            stats.add(len(chunk))
+                        if monitor is not None:
+                            monitor.update(len(chunk))
+                        if len(buffer) >= size:
+                            break
+                if len(buffer) < size:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"分段 {start}-{end - 1} 连接提前结束，已收到 {len(buffer)} 字节")
+            except requests.exceptions.RequestException as ex:
+                if len(buffer) > attempt_start:
+                    attempt = 0
+                attempt = self._retry_or_raise(mirrors, mirror, start, end, ex, attempt, max_retries,
+                                               retry_delay, stats)
+        return bytes(buffer)
+
+    @staticmethod
+    def _wait_throttle(throttle, nbytes, monitor):
+        # 按带宽限制等待，等待的时间不计入卡顿检测；在等待中被中断时返回 False
+        if throttle is None:
+            return True
+        started = time.monotonic()
+        allowed = throttle(nbytes)
+        if monitor is not None:
+            monitor.exclude(time.monotonic() - started)
+        return allowed
+
+    @staticmethod
+    def _retry_or_raise(mirrors, mirror, start, end, ex, attempt, max_retries, retry_delay, stats):
+        # 分段请求失败时的处理：次数用尽则抛出，否则换到下一个镜像，没有其他镜像时等待后重试；返回新的失败次数
+        # 卡顿只在已知有更快的镜像时才会发生，换过去即可，不计入重试次数
+        if isinstance(ex, MirrorStalled):
+            if stats is not None:
+                stats.retry(ex)
+            mirrors.demote(mirror, f"卡顿（{ex}）")
+            return attempt
+        if attempt + 1 >= max_retries:
+            print(f"分段 {start}-{end - 1} 下载失败，最大重试次数已达到：{ex}")
+            raise ex
+        if stats is not None:
+            stats.retry(ex)
+        if len(mirrors) > 1:
+            mirrors.demote(mirror, f"出错（{ex}）")
+            return attempt + 1  # 其他镜像可以立即接着下载，不必等待
+        print(f"分段 {start}-{end - 1} 下载失败：{ex}，{retry_delay} 秒后重试...")
+        time.sleep(retry_delay)
+        return attempt + 1
@@ -0,0 +1,46 @@
+# session_store.py
+
+import os
+import json
+
+# 登录状态默认保存在用户主目录下，不放在项目目录中，避免被误提交或分享
+DEFAULT_SESSION_DIR = os.path.join(os.path.expanduser('~'), '.bilibili_downloader')
+
+
+class SessionStore:
+    """登录会话持久化：保存登录后的 Cookie、User-Agent 和 ChromeDriver 路径
+Cookie 等同于账号凭据，目录权限设为 700、文件权限设为 600，只有当前用户可以读写"""
+
+    def __init__(self, session_dir=DEFAULT_SESSION_DIR):
+        self.session_dir = session_dir
+        self.path = os.path.join(session_dir, 'session.json')
+
+    def load(self):
+        # 读取保存的会话，不存在或已损坏时返回空字典
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, **fields):
+        """更新并保存会话中的字段，例如 cookies、user_agent、driver_path"""
+        data = self.load()
+        data.update(fields)
+        os.makedirs(self.session_dir, mode=0o700, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        # 创建文件时就指定 600 权限，避免先以默认权限写入再修改的时间窗口
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        try:
+            os.chmod(self.path, 0o600)
+        except OSError:
+            pass  # Windows 上 chmod 只能控制只读属性，忽略
+
+    def clear_cookies(self):
+        # 登录状态失效时清除 Cookie，保留 ChromeDriver 路径
+        if os.path.exists(self.path):
+            self.save(cookies=[])
@@ -0,0 +1,172 @@
+# stream_merger.py
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import requests
+from segmented_downloader import RangeNotSupported
+from stream_reader import StreamReader
+
+
+class StreamMergeError(Exception):
+    """边下载边合并失败（FFmpeg 出错或提前退出），调用方可以改用先下载再合并"""
+
+
+class StreamMerger:
+    """边下载边合并：把视频流和音频流通过命名管道（FIFO）直接送入 FFmpeg，不写中间文件
+磁盘读写和峰值占用都只有输出文件一份，最后一个字节到达后很快就能得到合并好的文件
+命名管道只在 POSIX 系统上可用；这种方式无法断点续传，暂停会丢弃已下载的部分"""
+
+    def __init__(self, downloader=None, timeout=10):
+        self.downloader = downloader  # SegmentedDownloader，为 None 时用单连接顺序读取
+        self.timeout = timeout
+
+    @staticmethod
+    def is_supported():
+        return hasattr(os, 'mkfifo') and shutil.which('ffmpeg') is not None
+
+    def merge(self, video_urls, audio_urls, output_file, headers, should_stop,
+              progress_callbacks=(None, None), max_retries=5, retry_delay=2, throttle=None,
+              stats=(None, None)):
+        """下载并合并到 output_file，成功返回 True，被 should_stop() 中断返回 False
+video_urls/audio_urls 为主地址在前的镜像地址列表，throttle(字节数) 用于限速，stats 为两个流的 StreamStats；下载出错时抛出对应的 requests 异常，FFmpeg 出错时抛出 StreamMergeError"""
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix='bilibili_fifo_')
+        video_fifo = os.path.join(temp_dir, 'video.m4s')
+        audio_fifo = os.path.join(temp_dir, 'audio.m4s')
+        os.mkfifo(video_fifo)
+        os.mkfifo(audio_fifo)
+        partial_output = output_file + '.part'
+        succeeded = False
+
+        command = [
+            'ffmpeg',
+            '-hide_banner',
+            '-loglevel', 'error',
+            '-y',
+            '-i', video_fifo,
+            '-i', audio_fifo,
+            '-c:v', 'copy',   # 直接复制视频流，不重新编码
+            '-c:a', 'copy',   # 直接复制音频流，不重新编码
+            '-map', '0:v:0',  # 指定使用第一个输入文件的视频流
+            '-map', '1:a:0',  # 指定使用第二个输入文件的音频流
+            '-f', 'mp4',      # 输出文件名以 .part 结尾，需要显式指定格式
+            partial_output
+        ]
+
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE)
+            stderr_output = []
+            stderr_reader = threading.Thread(target=lambda: stderr_output.append(process.stderr.read()))
+            stderr_reader.start()
+
+            errors = []
+            feeders = [
+                threading.Thread(target=self._feed, args=(urls, fifo, headers, should_stop, callback,
+                                                          errors, max_retries, retry_delay, throttle,
+                                                          stream_stats))
+                for urls, fifo, callback, stream_stats in (
+                    (video_urls, video_fifo, progress_callbacks[0], stats[0]),
+                    (audio_urls, audio_fifo, progress_callbacks[1], stats[1]))
+            ]
+            for feeder in feeders:
+                feeder.start()
+
+            while any(feeder.is_alive() for feeder in feeders):
+                if process.poll() is None and (errors or should_stop()):
+                    process.kill()  # 出错或暂停时结束 FFmpeg，写入管道的线程会随之收到 BrokenPipeError
+                if process.poll() is not None:
+                    self._unblock(video_fifo, audio_fifo)
+                time.sleep(0.1)
+
+            process.wait()
+            stderr_reader.join()
+
+            if should_stop():
+                print("下载已暂停，边下载边合并的部分已丢弃")
+                return False
+            # 优先抛出下载本身的错误，管道断开通常只是 FFmpeg 被结束或出错的结果
+            for ex in errors:
+                if not isinstance(ex, StreamMergeError):
+                    raise ex
+            if process.returncode != 0:
+                message = (stderr_output[0] if stderr_output else b'').decode('utf-8', 'replace')
+                raise StreamMergeError(f"FFmpeg 返回 {process.returncode}：{message.strip()}")
+            if errors:
+                raise errors[0]
+
+            os.replace(partial_output, output_file)
+            succeeded = True
+            print(f"边下载边合并完成：{os.path.basename(output_file)}")
+            return True
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not succeeded and os.path.exists(partial_output):
+                os.remove(partial_output)
+
+    def _open_source(self, urls, headers, should_stop, max_retries, retry_delay, throttle, stats):
+        # 优先多连接按顺序读取并在镜像间切换，服务器不支持 Range 时退回单连接读取主地址
+        if self.downloader is not None:
+            try:
+                return self.downloader.stream(urls[0], headers, should_stop, max_retries, retry_delay,
+                                              urls[1:], throttle, stats)
+            except RangeNotSupported as ex:
+                print(f"服务器不支持分段下载（{ex}），改用单连接")
+
+        requested = time.monotonic()
+        response = requests.get(urls[0], headers=headers, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        if stats is not None:
+            stats.ttfb(time.monotonic() - requested)
+        length = response.headers.get('Content-Length', '')
+
+        def iter_chunks():
+            with response:
+                for chunk in StreamReader(response):  # 每块在写入管道后才读取下一块，可以复用缓冲区
+                    if should_stop() or (throttle is not None and not throttle(len(chunk))):
+                        return
+                    if stats is not None:
+                        stats.add(len(chunk))
+                    yield chunk
+
+        return (int(length) if length.isdigit() else None), iter_chunks()
+
+    def _feed(self, urls, fifo_path, headers, should_stop, progress_callback, errors,
+              max_retries, retry_delay, throttle, stats):
+        # 下载一个流并按顺序写入命名管道，异常记录到 errors 中由主线程处理
+        chunks = None
+        try:
+            total, chunks = self._open_source(urls, headers, should_stop, max_retries, retry_delay,
+                                              throttle, stats)
+            if progress_callback is not None:
+                progress_callback(0, total)
+            # 打开管道写端会阻塞，直到 FFmpeg 打开读端
+            with open(fifo_path, 'wb') as fifo:
+                done = 0
+                for chunk in chunks:
+                    fifo.write(chunk)
+                    done += len(chunk)
+                    if progress_callback is not None:
+                        progress_callback(done, total)
+            if total is not None and done < total and not should_stop():
+                raise requests.exceptions.ChunkedEncodingError(f"连接提前结束，已收到 {done}/{total} 字节")
+        except BrokenPipeError:
+            errors.append(StreamMergeError("FFmpeg 提前关闭了输入管道"))
+        except BaseException as ex:
+            errors.append(ex)
+        finally:
+            if chunks is not None:
+                chunks.close()  # 结束生成器，让后台仍在下载的分段停止
+
+    @staticmethod
+    def _unblock(*fifo_paths):
+        # FFmpeg 已退出时，以非阻塞方式打开再关闭读端，让仍阻塞在打开写端的线程返回并收到 BrokenPipeError
+        for path in fifo_paths:
+            try:
+                os.close(os.open(path, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
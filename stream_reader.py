@@ -0,0 +1,111 @@
+# stream_reader.py
+
+import os
+import time
+import errno
+import threading
+import http.client
+import requests
+
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+
+_local = threading.local()  # 每个下载线程一个可复用的缓冲区
+
+
+def _buffer(size):
+    # 返回当前线程至少 size 字节的缓冲区，同一线程的多次下载共用，不再为每块数据分配内存
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = _local.buffer = bytearray(size)
+    return buffer
+
+
+def preallocate(f, size):
+    """把 f 扩展到 size 字节并尽量向文件系统预先申请磁盘空间，减少碎片，磁盘空间不足时尽早报错
+不支持 posix_fallocate 的系统或文件系统退回为 truncate（稀疏文件）"""
+    f.flush()
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError as ex:
+            if ex.errno == errno.ENOSPC:  # 空间不足时退回稀疏文件只会推迟到写入时才失败
+                raise
+    f.truncate(size)
+
+
+class StreamReader:
+    """把 HTTP 响应体直接从连接读入可复用的缓冲区，按块迭代 memoryview
+块大小随下载速度自适应：从 min_chunk 起，按每块约 target_seconds 秒的数据量调整，最大 max_chunk，
+快速下载时每次循环处理数 MB 数据，慢速下载时仍能及时汇报进度和响应暂停
+响应有 Content-Encoding 或无法取得底层连接时退回 iter_content"""
+
+    def __init__(self, response, min_chunk=MIN_CHUNK, max_chunk=MAX_CHUNK, target_seconds=0.2):
+        self.response = response
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.target_seconds = target_seconds
+        self.chunk_size = min_chunk
+
+    def _raw_file(self):
+        # requests -> urllib3 -> http.client.HTTPResponse，后者的 readinto 直接从套接字读入缓冲区
+        if self.response.headers.get('Content-Encoding', 'identity').lower() not in ('', 'identity'):
+            return None
+        fp = getattr(self.response.raw, '_fp', None)
+        return fp if hasattr(fp, 'readinto') else None
+
+    def __iter__(self):
+        """依次产生 memoryview 数据块，每块只在下一次迭代前有效，需要保留时应先复制"""
+        fp = self._raw_file()
+        if fp is None:
+            yield from self.response.iter_content(chunk_size=self.min_chunk)
+            return
+
+        view = memoryview(_buffer(self.max_chunk))
+        while True:
+            started = time.monotonic()
+            try:
+                n = fp.readinto(view[:self.chunk_size])
+            except (http.client.HTTPException, OSError) as ex:
+                # 与 iter_content 一样转换为 requests 的异常，调用方按网络错误重试
+                raise requests.exceptions.ChunkedEncodingError(f"读取响应失败: {ex!r}") from ex
+            if not n:
+                self._release()
+                return
+            self._adapt(n, time.monotonic() - started)
+            if fp.isclosed():
+                # 已读完 Content-Length 指定的长度，先放回连接，调用方收到最后一块后不再迭代也不影响复用
+                self._release()
+                yield view[:n]
+                return
+            yield view[:n]
+
+    def _release(self):
+        # 绕过 urllib3 直接读取时它不知道响应已结束，经它读一次结尾，连接才会被放回连接池
+        self.response.raw.read()
+
+    def _adapt(self, nbytes, elapsed):
+        # 读满一块用时明显少于 target_seconds 时加倍，超过时减半
+        if nbytes < self.chunk_size:
+            return
+        if elapsed < self.target_seconds / 2:
+            self.chunk_size = min(self.chunk_size * 2, self.max_chunk)
+        elif elapsed > self.target_seconds * 2:
+            self.chunk_size = max(self.chunk_size // 2, self.min_chunk)
+
+
+class StopChecker:
+    """限制暂停检查的频率：两次检查之间至少间隔 interval 秒，其余调用直接返回 False"""
+
+    def __init__(self, should_stop, interval=0.05):
+        self.should_stop = should_stop
+        self.interval = interval
+        self._next = 0.0
+
+    def __call__(self):
+        now = time.monotonic()
+        if now < self._next:
+            return False
+        self._next = now + self.interval
+        return self.should_stop()
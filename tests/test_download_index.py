@@ -0,0 +1,162 @@
+# tests/test_download_index.py
+
+import os
+import io
+import sys
+import queue
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fake_cdn import FakeBilibili  # noqa: E402
+from download_index import DownloadIndex  # noqa: E402
+from bilibili_session import BilibiliSession  # noqa: E402
+from enumerator import Enumerator, parse_targets  # noqa: E402
+from video_processor import VideoProcessor  # noqa: E402
+
+
+class _Control:
+    stop_download = False
+    rate_limit = None
+    weight = 1
+
+
+class FindTest(unittest.TestCase):
+    """find 与 is_complete 按清晰度、编码和账号区分记录"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.index = DownloadIndex(os.path.join(self.folder.name, 'downloads.sqlite3'))
+
+    def tearDown(self):
+        self.index.close()
+        self.folder.cleanup()
+
+    def record(self, quality, codec, top_quality=False, account=None, page=1, parts=1):
+        path = os.path.join(self.folder.name, f"{quality}-{codec}-{page}.mp4")
+        with open(path, 'wb') as f:
+            f.write(b'x' * quality)
+        self.index.record('BV1idx', 1000 + page, page, parts, quality, codec, '标题', path, 'sha',
+                          top_quality=top_quality, account=account)
+        return path
+
+    def test_quality_and_codec_must_match(self):
+        self.record(64, 'avc1')
+        self.assertIsNotNone(self.index.find('BV1idx', 1001, 1, 64, 'avc1'))
+        self.assertIsNone(self.index.find('BV1idx', 1001, 1, 80, 'avc1'))
+        self.assertIsNone(self.index.find('BV1idx', 1001, 1, 64, 'hev1'))
+
+    def test_without_quality_accepts_top_quality_or_same_account(self):
+        self.record(64, 'avc1', account='')
+        self.assertIsNone(self.index.find('BV1idx', 1001, 1))  # 账号未知
+        self.assertIsNone(self.index.find('BV1idx', 1001, 1, account='42'))  # 换了账号
+        self.assertIsNotNone(self.index.find('BV1idx', 1001, 1, account=''))
+        self.assertIsNotNone(self.index.find('BV1idx', None, 1, account=''))  # cid 未知时按分P序号查找
+        self.record(120, 'avc1', top_quality=True)
+        self.assertEqual(self.index.find('BV1idx', 1001, 1, account='42')['quality'], 120)
+
+    def test_is_complete_needs_every_part(self):
+        self.record(80, 'avc1', account='42', page=1, parts=2)
+        self.assertTrue(self.index.is_complete('BV1idx', 1, account='42'))
+        self.assertFalse(self.index.is_complete('BV1idx', account='42'))
+        self.record(80, 'avc1', account='42', page=2, parts=2)
+        self.assertTrue(self.index.is_complete('BV1idx', account='42'))
+        self.assertFalse(self.index.is_complete('BV1idx', account=''))
+
+    def test_changed_output_is_not_found(self):
+        path = self.record(80, 'avc1', account='42')
+        with open(path, 'ab') as f:
+            f.write(b'more')
+        self.assertIsNone(self.index.find('BV1idx', 1001, 1, 80, 'avc1'))
+
+
+class ClaimFilenameTest(unittest.TestCase):
+    """同名视频的文件名不取决于哪个任务先开始，也不会覆盖输出目录中已有的文件"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.index = DownloadIndex(os.path.join(self.folder.name, 'downloads.sqlite3'))
+        self.index.OUTPUT_FOLDER = os.path.join(self.folder.name, 'output')
+        os.makedirs(self.index.OUTPUT_FOLDER)
+
+    def tearDown(self):
+        self.index.close()
+        self.folder.cleanup()
+
+    def test_concurrent_clash_suffixes_both(self):
+        self.assertEqual(self.index.claim_filename('同名', 'BV1a'), '同名')
+        self.assertEqual(self.index.claim_filename('同名', 'BV1b'), '同名 [BV1b]')
+        self.assertEqual(self.index.fix_filename('BV1a'), '同名 [BV1a]')
+        self.assertEqual(self.index.fix_filename('BV1b'), '同名 [BV1b]')
+        self.assertEqual(self.index.claim_filename('同名', 'BV1a'), '同名 [BV1a]')
+
+    def test_written_output_keeps_its_name(self):
+        self.assertEqual(self.index.claim_filename('同名', 'BV1a'), '同名')
+        self.assertEqual(self.index.fix_filename('BV1a'), '同名')
+        self.assertEqual(self.index.claim_filename('同名', 'BV1b', 2), '同名 [BV1b_p2]')
+        self.assertEqual(self.index.fix_filename('BV1a'), '同名')
+
+    def test_existing_output_file_is_not_claimed(self):
+        open(os.path.join(self.index.OUTPUT_FOLDER, '旧文件.mp4'), 'wb').close()
+        self.assertEqual(self.index.claim_filename('旧文件', 'BV1a'), '旧文件 [BV1a]')
+
+
+class RerunTest(unittest.TestCase):
+    """同一会话再次下载已完成的视频时，展开和下载都不发任何 HTTP 请求"""
+
+    def setUp(self):
+        self.fake = FakeBilibili(video_size=1024 * 1024, audio_size=256 * 1024).start()
+        self.folder = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.folder.name)  # download 和 output 目录是相对路径
+        self.index = DownloadIndex(os.path.join('cache', 'downloads.sqlite3'))
+        self.session = BilibiliSession(base_url=self.fake.base_url, api_url=self.fake.base_url)
+        self.session.session.cookies.set('DedeUserID', '1')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.session.close()
+        self.index.close()
+        self.fake.shutdown()
+        self.folder.cleanup()
+
+    def run_once(self):
+        processor = VideoProcessor(None, http_session=self.session, download_index=self.index,
+                                   merge_engine='python')
+        parts = []
+        Enumerator(self.session, self.index).expand(parse_targets('BV1rerun'), parts.append)
+        for part in parts:
+            progress = queue.Queue()
+            processor.process_video(part.bvid, {}, progress, _Control(), part.page, part.part, part.cid,
+                                    part.parts)
+            while True:
+                item = progress.get(timeout=30)
+                if item == 'done':
+                    break
+                self.assertFalse(isinstance(item, str) and item.startswith('error'), item)
+        return len(parts)
+
+    def test_second_run_makes_no_request(self):
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(self.run_once(), 1)
+            requests_made = self.fake.stats['requests']
+            self.assertEqual(self.run_once(), 0)
+        self.assertEqual(self.fake.stats['requests'], requests_made)
+
+    def test_other_account_checks_quality_again(self):
+        with redirect_stdout(io.StringIO()):
+            self.run_once()
+            requests_made = self.fake.stats['requests']
+            self.session.session.cookies.set('DedeUserID', '2')
+            self.assertEqual(self.run_once(), 1)
+        # 只请求了 view 接口和视频页，清晰度和编码相同，没有重新下载
+        self.assertEqual(self.fake.stats['requests'], requests_made + 2)
+        self.assertEqual(os.listdir('output'), ['基准测试视频 BV1rerun.mp4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
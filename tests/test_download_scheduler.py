@@ -0,0 +1,96 @@
+# tests/test_download_scheduler.py
+
+import os
+import sys
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from download_scheduler import DownloadScheduler, DownloadJob  # noqa: E402
+
+
+class _TimeoutCondition(threading.Condition):
+    """工作线程第一次带超时等待时先调用 on_timeout，再如同等待超时一样返回 False，模拟任务恰好在超时时到达"""
+
+    def __init__(self, on_timeout):
+        super().__init__()
+        self.on_timeout = on_timeout
+
+    def wait(self, timeout=None):
+        if timeout is not None and self.on_timeout is not None \
+                and threading.current_thread() is not threading.main_thread():
+            on_timeout, self.on_timeout = self.on_timeout, None
+            on_timeout()
+            return False
+        return super().wait(timeout)
+
+
+class _FakeProcessor:
+    """代替 VideoProcessor：下载立即完成并进入合并，合并由测试通过 finish_merge 结束"""
+
+    def __init__(self):
+        self.processed = []
+        self.queues = {}
+
+    def set_parallel_jobs(self, jobs):
+        pass
+
+    def process_video(self, video_id, headers, progress_queue, job, **kwargs):
+        self.processed.append(video_id)
+        self.queues[video_id] = progress_queue
+        progress_queue.put(50)
+        progress_queue.put('merging')
+
+    def finish_merge(self, video_id):
+        self.queues[video_id].put(100)
+        self.queues[video_id].put('done')
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.processor = _FakeProcessor()
+        self.changed = threading.Condition()
+        self.scheduler = DownloadScheduler(self.processor, {}, max_workers=1, listener=self.on_change)
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+
+    def on_change(self, job):
+        with self.changed:
+            self.changed.notify_all()
+
+    def wait_status(self, job, status):
+        with self.changed:
+            self.assertTrue(self.changed.wait_for(lambda: job.status == status, 10), job.status)
+
+    def test_job_arriving_at_idle_timeout_is_run(self):
+        late = []
+        self.scheduler._cond = _TimeoutCondition(lambda: late.append(self.scheduler.submit('BV1late')))
+        self.scheduler.submit('BV1first')
+        # 唯一的工作线程在等待超时时恰好收到新任务，它退出前应取走这个任务，而不是留在队列中无人执行
+        with self.changed:
+            self.assertTrue(self.changed.wait_for(
+                lambda: late and late[0].status == DownloadJob.MERGING, 10))
+        self.assertEqual(self.processor.processed, ['BV1first', 'BV1late'])
+
+    def test_cancel_while_merging_stays_cancelled(self):
+        job = self.scheduler.submit('BV1merge')
+        self.wait_status(job, DownloadJob.MERGING)
+        self.scheduler.cancel(job.job_id)
+        self.processor.finish_merge('BV1merge')
+        self.assertEqual(job.status, DownloadJob.CANCELLED)
+        self.assertTrue(self.scheduler.wait([job.job_id], timeout=1))
+
+    def test_finished_merge_is_done(self):
+        job = self.scheduler.submit('BV1done')
+        self.wait_status(job, DownloadJob.MERGING)
+        self.processor.finish_merge('BV1done')
+        self.assertEqual(job.status, DownloadJob.DONE)
+        self.assertEqual(job.progress, 100.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# tests/test_merge_pipeline.py
+
+import os
+import sys
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from merge_pipeline import MergePipeline, MergeTask  # noqa: E402
+
+
+class _TimeoutCondition(threading.Condition):
+    """工作线程第一次带超时等待时先调用 on_timeout，再如同等待超时一样返回 False，模拟合并恰好在超时时排入"""
+
+    def __init__(self, on_timeout):
+        super().__init__()
+        self.on_timeout = on_timeout
+
+    def wait(self, timeout=None):
+        if timeout is not None and self.on_timeout is not None \
+                and threading.current_thread() is not threading.main_thread():
+            on_timeout, self.on_timeout = self.on_timeout, None
+            on_timeout()
+            return False
+        return super().wait(timeout)
+
+
+def _task(name):
+    return MergeTask(f"{name}.mp4", f"{name}.mp3", 'output', f"{name}.mp4", None)
+
+
+class MergePipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.merged = []
+        self.changed = threading.Condition()
+
+    def merge(self, task):
+        with self.changed:
+            self.merged.append(task.output_filename)
+            self.changed.notify_all()
+
+    def wait_merged(self, count):
+        with self.changed:
+            return self.changed.wait_for(lambda: len(self.merged) >= count, 10)
+
+    def test_task_arriving_at_idle_timeout_is_merged(self):
+        pipeline = MergePipeline(self.merge, workers=1, max_pending=1)
+        pipeline._cond = _TimeoutCondition(lambda: pipeline.submit(_task('late')))
+        pipeline.submit(_task('first'))
+        # 唯一的工作线程在等待超时时恰好排入新的合并，它应继续处理，而不是退出后把合并留在队列中
+        self.assertTrue(self.wait_merged(2), self.merged)
+        self.assertEqual(self.merged, ['first.mp4', 'late.mp4'])
+        self.assertEqual(pipeline.stats(), (0, 0))
+
+    def test_submit_blocks_while_queue_is_full(self):
+        release = threading.Event()
+
+        def slow_merge(task):
+            release.wait(10)
+            self.merge(task)
+
+        pipeline = MergePipeline(slow_merge, workers=1, max_pending=1)
+        pipeline.submit(_task('a'))  # 由工作线程取走，正在合并
+        with pipeline._cond:
+            pipeline._cond.wait_for(lambda: pipeline.stats() == (0, 1), 10)
+        pipeline.submit(_task('b'))  # 排队
+        blocked = threading.Thread(target=pipeline.submit, args=(_task('c'),))
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())  # 队列已满，提交的线程等待
+        release.set()
+        blocked.join(10)
+        self.assertFalse(blocked.is_alive())
+        self.assertTrue(self.wait_merged(3))
+        self.assertEqual(self.merged, ['a.mp4', 'b.mp4', 'c.mp4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# tests/test_mp4_remuxer.py
+
+import os
+import sys
+import random
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fake_cdn import make_fmp4  # noqa: E402
+from mp4_remuxer import remux, RemuxError  # noqa: E402
+
+
+class RemuxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.video = make_fmp4(b'vide', 256 * 1024, fragment_size=64 * 1024, seed=1)
+        self.audio = make_fmp4(b'soun', 64 * 1024, timescale=44100, fragment_size=16 * 1024, seed=2)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def path(self, name, data=None):
+        path = os.path.join(self.folder.name, name)
+        if data is not None:
+            with open(path, 'wb') as f:
+                f.write(data)
+        return path
+
+    def test_remux_valid_input(self):
+        output = self.path('out.mp4')
+        remux(self.path('v.mp4', self.video), self.path('a.mp4', self.audio), output)
+        self.assertGreater(os.path.getsize(output), len(self.video) + len(self.audio) - 4096)
+        self.assertFalse(os.path.exists(output + '.part'))
+
+    def test_malformed_input_raises_remux_error(self):
+        # 随机截断或改写头部的字节，除了成功以外只能抛出 RemuxError，merge_audio_video 据此改用 FFmpeg
+        rng = random.Random(0)
+        audio = self.path('a.mp4', self.audio)
+        header_end = self.video.find(b'moof') + 256
+        for i in range(300):
+            data = bytearray(self.video)
+            if i % 3 == 0:
+                data = data[:rng.randrange(9, header_end)]
+            else:
+                for _ in range(rng.randint(1, 4)):
+                    data[rng.randrange(header_end)] = rng.randrange(256)
+            output = self.path('out.mp4')
+            try:
+                remux(self.path('v.mp4', bytes(data)), audio, output)
+            except RemuxError:
+                pass
+            self.assertFalse(os.path.exists(output + '.part'))
+
+
+if __name__ == '__main__':
+    unittest.main()
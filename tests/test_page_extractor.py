@@ -0,0 +1,39 @@
+# tests/test_page_extractor.py
+
+import os
+import sys
+import json
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from page_extractor import extract_page_data  # noqa: E402
+
+PLAYINFO = {"code": 0, "data": {"dash": {"video": [{"id": 80, "base_url": "https://cdn/v.m4s?a=}</script>"}]}}}
+STATE = {"bvid": "BV1test", "videoData": {"pages": [{"cid": 1, "page": 1}]}}
+PAGE = ('<html><head><meta charset="UTF-8"><meta data-vue-meta="true" name="title" '
+        'content="标题 &amp; 副标题_哔哩哔哩_bilibili"></head><body>'
+        f'<script>window.__playinfo__ = {json.dumps(PLAYINFO)}</script>'
+        f'<script>window.__INITIAL_STATE__={json.dumps(STATE)};(function(){{}}());</script></body></html>')
+
+
+class ExtractPageDataTest(unittest.TestCase):
+
+    def test_title_and_playinfo(self):
+        data = extract_page_data(PAGE)
+        self.assertEqual(data['title'], '标题 & 副标题_哔哩哔哩_bilibili')
+        self.assertEqual(data['playinfo'], PLAYINFO)  # 字符串中的 }</script> 不会截断 JSON
+
+    def test_initial_state_only_on_request(self):
+        self.assertNotIn('initial_state', extract_page_data(PAGE))
+        self.assertEqual(extract_page_data(PAGE, initial_state=True)['initial_state'], STATE)
+
+    def test_missing_items_are_none(self):
+        data = extract_page_data('<html><script>var x = "window.__playinfo__";</script></html>')
+        self.assertIsNone(data['title'])
+        self.assertIsNone(data['playinfo'])
+
+
+if __name__ == '__main__':
+    unittest.main()
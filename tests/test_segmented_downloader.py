@@ -0,0 +1,160 @@
+# tests/test_segmented_downloader.py
+
+import os
+import io
+import sys
+import time
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fake_cdn import FakeBilibili  # noqa: E402
+from segmented_downloader import SegmentedDownloader  # noqa: E402
+from video_processor import VideoProcessor  # noqa: E402
+
+
+class SlowMirrorTest(unittest.TestCase):
+    """主地址和备用地址都低于 min_speed 但仍在传输数据时，下载应当完成，而不是因反复“卡顿”耗尽重试次数"""
+
+    def setUp(self):
+        self.fake = FakeBilibili(bandwidth=400 * 1024, video_size=2 * 1024 * 1024).start()
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.fake.shutdown()
+        self.folder.cleanup()
+
+    def test_slow_mirrors_complete(self):
+        url = f"{self.fake.base_url}/cdn/BV1slow/video.m4s"
+        backup = f"{self.fake.base_url}/cdn-backup/BV1slow/video.m4s"
+        downloader = SegmentedDownloader(connections=2, segment_size=1024 * 1024, min_speed=640 * 1024,
+                                         stall_window=0.5)
+        downloader.mirror_selector.sample_bytes = 64 * 1024
+        part_path = os.path.join(self.folder.name, 'video.m4s.part')
+        with redirect_stdout(io.StringIO()):
+            ok = downloader.download(url, part_path, {}, lambda: False, max_retries=2, retry_delay=0.01,
+                                     backup_urls=[backup])
+        self.assertTrue(ok)
+        with open(part_path, 'rb') as f:
+            self.assertEqual(f.read(), self.fake.media('BV1slow', 'video'))
+
+
+class MirrorSelectionTest(unittest.TestCase):
+    """主地址和备用地址在不同的替身服务上，速度或延迟不同时选用较快的一个"""
+
+    def setUp(self):
+        self.servers = []
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        for fake in self.servers:
+            fake.shutdown()
+        self.folder.cleanup()
+
+    def server(self, **options):
+        fake = FakeBilibili(video_size=2 * 1024 * 1024, **options).start()
+        self.servers.append(fake)
+        return fake, f"{fake.base_url}/cdn/BV1race/video.m4s"
+
+    def download(self, url, backup):
+        downloader = SegmentedDownloader(connections=2, segment_size=512 * 1024)
+        downloader.mirror_selector.sample_bytes = 128 * 1024
+        with redirect_stdout(io.StringIO()):
+            chosen = downloader.select_mirrors(url, {}, [backup]).current().url
+            part_path = os.path.join(self.folder.name, 'video.m4s.part')
+            self.assertTrue(downloader.download(url, part_path, {}, lambda: False, backup_urls=[backup]))
+        with open(part_path, 'rb') as f:
+            self.assertEqual(f.read(), self.servers[0].media('BV1race', 'video'))
+        return chosen
+
+    def test_higher_bandwidth_is_chosen(self):
+        slow, slow_url = self.server(bandwidth=256 * 1024)
+        fast, fast_url = self.server()
+        self.assertEqual(self.download(slow_url, fast_url), fast_url)
+        # 慢的服务只发送了测速的数据
+        self.assertGreater(fast.mirror_stats['cdn']['bytes'], slow.mirror_stats['cdn']['bytes'] * 4)
+
+    def test_lower_latency_is_chosen(self):
+        far, far_url = self.server(latency=0.3)
+        near, near_url = self.server()
+        self.assertEqual(self.download(far_url, near_url), near_url)
+
+
+class MirrorFailoverTest(unittest.TestCase):
+    """下载中当前镜像返回 403 或传输到一半卡住时，剩余的部分改从备用镜像下载"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.fake = None
+
+    def tearDown(self):
+        self.fake.shutdown()
+        self.folder.cleanup()
+
+    def download(self, mirrors, timeout=10):
+        # 备用镜像有少许延迟，测速时选中主地址
+        self.fake = FakeBilibili(video_size=2 * 1024 * 1024,
+                                 mirrors=dict(mirrors, **{'cdn-backup': {'latency': 0.1}})).start()
+        url = f"{self.fake.base_url}/cdn/BV1fail/video.m4s"
+        backup = f"{self.fake.base_url}/cdn-backup/BV1fail/video.m4s"
+        downloader = SegmentedDownloader(connections=2, segment_size=1024 * 1024, timeout=timeout)
+        downloader.mirror_selector.sample_bytes = 64 * 1024
+        part_path = os.path.join(self.folder.name, 'video.m4s.part')
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(downloader.select_mirrors(url, {}, [backup]).current().url, url)
+            ok = downloader.download(url, part_path, {}, lambda: False, max_retries=2, retry_delay=0.01,
+                                     backup_urls=[backup])
+        self.assertTrue(ok)
+        with open(part_path, 'rb') as f:
+            self.assertEqual(f.read(), self.fake.media('BV1fail', 'video'))
+        self.assertGreater(self.fake.mirror_stats['cdn-backup']['bytes'], 0)
+
+    def test_forbidden_mid_download_fails_over(self):
+        # 前两次测速和第一个分段正常，之后主地址返回 403，如同签名链接失效
+        self.download({'cdn': {'status': 403, 'status_after': 3}})
+        self.assertGreater(self.fake.mirror_stats['cdn']['requests'], 3)
+
+    def test_stalled_body_fails_over(self):
+        # 主地址每个响应发送 512 KB 后不再发送数据也不断开，读取超时后换到备用镜像
+        started = time.monotonic()
+        self.download({'cdn': {'stall_after': 512 * 1024}}, timeout=0.5)
+        self.assertLess(time.monotonic() - started, 10)
+
+
+class PoolSizeTest(unittest.TestCase):
+    """多个下载共用一个下载器时，连接池容纳所有分段连接，连接用完放回池中复用而不是被丢弃"""
+
+    def setUp(self):
+        self.fake = FakeBilibili(video_size=4 * 1024 * 1024, audio_size=4 * 1024 * 1024).start()
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.fake.shutdown()
+        self.folder.cleanup()
+
+    def download_all(self, downloader, count):
+        def fetch(i):
+            url = f"{self.fake.base_url}/cdn/BV1pool{i}/video.m4s"
+            backup = f"{self.fake.base_url}/cdn-backup/BV1pool{i}/video.m4s"
+            return downloader.download(url, os.path.join(self.folder.name, f"{i}.part"), {}, lambda: False,
+                                       retry_delay=0.01, backup_urls=[backup])
+
+        with redirect_stdout(io.StringIO()), ThreadPoolExecutor(count) as pool:
+            return all(pool.map(fetch, range(count)))
+
+    def test_no_connection_discarded(self):
+        # 两个任务各自同时下载视频流和音频流
+        processor = VideoProcessor(None, connections=4, segment_size=256 * 1024)
+        processor.set_parallel_jobs(2)
+        downloader = processor.segmented_downloader
+        with self.assertNoLogs('urllib3.connectionpool', 'WARNING'):
+            self.assertTrue(self.download_all(downloader, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# tests/test_video_processor.py
+
+import os
+import io
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fake_cdn import FakeBilibili, make_fmp4  # noqa: E402
+from download_state import DownloadState  # noqa: E402
+from video_processor import VideoProcessor  # noqa: E402
+
+
+class _Control:
+    stop_download = False
+    rate_limit = None
+    weight = 1
+
+
+class ResumeTest(unittest.TestCase):
+    """download_file 暂停后续传得到与服务器完全相同的文件，服务器文件变化时从头下载"""
+
+    SIZE = 2 * 1024 * 1024
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.folder.name, 'video.mp4')
+        self.fake = None
+
+    def tearDown(self):
+        if self.fake is not None:
+            self.fake.shutdown()
+        self.folder.cleanup()
+
+    def start(self, **options):
+        self.fake = FakeBilibili(video_size=self.SIZE, **options).start()
+        self.url = f"{self.fake.base_url}/cdn/BV1resume/video.m4s"
+        return self.fake.media('BV1resume', 'video')
+
+    def download(self, connections=1, pause_at=None):
+        control = _Control()
+
+        def on_progress(done, total):
+            if pause_at is not None and done >= pause_at:
+                control.stop_download = True
+
+        processor = VideoProcessor(None, connections=connections, segment_size=512 * 1024)
+        with redirect_stdout(io.StringIO()):
+            return processor.download_file(self.url, self.dest, {}, control, max_retries=2, retry_delay=0.01,
+                                           progress_callback=on_progress)
+
+    def read_dest(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def check_pause_and_resume(self, connections):
+        data = self.start(bandwidth=2 * 1024 * 1024)
+        self.assertFalse(self.download(connections, pause_at=self.SIZE // 3))
+        self.assertTrue(os.path.exists(self.dest + '.part.json'))
+        self.assertTrue(self.download(connections))
+        self.assertEqual(self.read_dest(), data)
+        self.assertFalse(os.path.exists(self.dest + '.part.json'))
+
+    def test_single_connection_resume_is_identical(self):
+        self.check_pause_and_resume(1)
+
+    def test_segmented_resume_is_identical(self):
+        self.check_pause_and_resume(3)
+
+    def test_changed_file_without_validator_restarts(self):
+        self.start(bandwidth=2 * 1024 * 1024, validators=False)
+        self.assertFalse(self.download(pause_at=self.SIZE // 3))
+        # 没有 ETag/Last-Modified，If-Range 无法生效，只能从 Content-Range 中的大小发现文件已变化
+        changed = make_fmp4(b'vide', self.SIZE + 512 * 1024, seed=1)
+        self.fake.set_media('BV1resume', 'video', changed)
+        self.assertTrue(self.download())
+        self.assertEqual(self.read_dest(), changed)
+
+    def write_finished_part(self, data, total):
+        # 模拟已写完全部数据、尚未改名时进程退出
+        with open(self.dest + '.part', 'wb') as f:
+            f.write(data)
+        DownloadState(self.dest + '.part.json', self.url, total, completed=[[0, len(data)]]).save()
+
+    def test_finished_part_is_renamed_without_request(self):
+        data = self.start()
+        self.write_finished_part(data, len(data))
+        self.assertTrue(self.download())
+        self.assertEqual(self.read_dest(), data)
+        self.assertEqual(self.fake.stats['requests'], 0)
+
+    def test_finished_part_of_unknown_size_is_confirmed_by_416(self):
+        data = self.start()
+        self.write_finished_part(data, None)
+        self.assertTrue(self.download())
+        self.assertEqual(self.read_dest(), data)
+        self.assertEqual(self.fake.stats['requests'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
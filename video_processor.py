@@ -4,18 +4,100 @@ import os
 import re
 import time
 import json
+import hashlib
+import sqlite3
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import subprocess  # 在本程序中，它的最关键用处是调用 FFmpeg 这个外部工具，实现音视频的成功合并
 import requests
-from bs4 import BeautifulSoup
 from sanitize_filename import sanitize
+from segmented_downloader import SegmentedDownloader, RangeNotSupported
+from download_state import DownloadState, checkpoint_due
+from bilibili_session import PlayinfoNotFound
+from metadata_cache import MetadataCache
+from page_extractor import extract_page_data
+from stream_merger import StreamMerger, StreamMergeError
+from mp4_remuxer import remux, RemuxError
+from mirror_selector import stream_urls
+from bandwidth import BandwidthManager
+from metrics import MetricsRegistry
+from link_parser import part_key
+from download_index import file_sha256
+from stream_reader import StreamReader, StopChecker, preallocate
+from merge_pipeline import MergePipeline, MergeTask
+
+# 请求头，模拟浏览器访问，B站 CDN 会校验 referer
+DEFAULT_HEADERS = {
+    "referer": "https://www.bilibili.com",
+    "origin": "https://www.bilibili.com",
+    "User-Agent": 'Mozilla/5.0'
+}
+
+class CombinedProgress:
+    """把多个流各自的 (已下载字节数, 总字节数) 按字节数加权汇总成一个百分比放入进度队列"""
+
+    def __init__(self, count, progress_queue):
+        self.progress_queue = progress_queue
+        self.downloaded = [0] * count
+        self.totals = [None] * count
+        self.last_percent = -1
+        self._lock = threading.Lock()
+
+    def callback(self, index):
+        """返回第 index 个流使用的进度回调"""
+        def on_progress(done, total):
+            with self._lock:
+                self.downloaded[index] = done
+                self.totals[index] = total
+                known = [t for t in self.totals if t]
+                if not known:
+                    return
+                # 在所有流的大小都已知之前，只按已知大小的流估算，进度不会超过 100
+                percent = int(min(sum(self.downloaded), sum(known)) * 100 / sum(known))
+                if percent == self.last_percent:
+                    return  # 百分比没变就不再放入队列，避免刷屏
+                self.last_percent = percent
+            self.progress_queue.put(percent)
+        return on_progress
 
 
 class VideoProcessor:
     """视频处理类，负责视频信息获取、下载和合并"""
 
-    def __init__(self, browser):
-        self.browser = browser  # 已登录的浏览器实例
+    def __init__(self, browser_manager, connections=4, segment_size=4 * 1024 * 1024, http_session=None,
+                 metadata_cache=None, merge_mode='files', merge_engine='auto', bandwidth=None,
+                 metrics=None, download_index=None, merge_workers=None, merge_queue=None,
+                 keep_intermediate=False):
+        self.browser_manager = browser_manager  # 浏览器管理器，只在需要时才启动浏览器
+        self.browser_lock = threading.Lock()  # 只有一个浏览器，多个任务并发时需要串行访问
+        self.http_session = http_session  # BilibiliSession，优先通过 HTTP 获取页面，失败时才使用浏览器
+        # 查找和下载共用的元数据缓存，同一个视频不必重复加载页面
+        self.metadata_cache = metadata_cache if metadata_cache is not None else MetadataCache()
+        self.connections = connections  # 分段下载的并行连接数，设为 1 则只用单连接下载
+        self.segment_size = segment_size  # 分段下载时每段的字节数
+        # 分段下载器内部持有连接池，在多次下载之间复用
+        self.segmented_downloader = SegmentedDownloader(connections, segment_size) if connections > 1 else None
+        # 合并方式：'files' 先下载到 download 目录再合并，支持断点续传；
+        # 'stream' 边下载边通过命名管道送入 FFmpeg，不写中间文件，不支持时自动退回 'files'
+        self.merge_mode = merge_mode
+        self.stream_merger = StreamMerger(self.segmented_downloader)
+        # 合并引擎：'python' 用内置的 fMP4 拼接，不需要 FFmpeg；'ffmpeg' 只用 FFmpeg；
+        # 'auto' 先用内置拼接，输入不是分片 MP4 等情况下改用 FFmpeg
+        self.merge_engine = merge_engine
+        # 所有下载共用的带宽管理器：总限速，以及按控制对象的 rate_limit、weight 属性做单任务限速和加权分配
+        self.bandwidth = bandwidth if bandwidth is not None else BandwidthManager()
+        # 传输指标：每个流的速度、首字节时间、重试和卡顿，以及合并耗时
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        # 已完成下载的索引（DownloadIndex），用于跳过已下载的分P和分配不重名的文件名，None 为不使用
+        self.download_index = download_index
+        # 合并阶段：最多 merge_workers 个合并同时进行，最多 merge_queue 个排队，队列满时下载线程等待
+        self.merge_pipeline = MergePipeline(self._run_merge, merge_workers, merge_queue, self.metrics)
+        self.keep_intermediate = keep_intermediate  # 合并成功后是否保留 download 目录中的视频流和音频流
+
+    def set_parallel_jobs(self, jobs):
+        """告知同时处理的任务数，分段下载器的连接池按每个任务同时下载视频流和音频流扩大"""
+        if self.segmented_downloader is not None:
+            self.segmented_downloader.set_max_downloads(jobs * 2)
 
     @staticmethod
     def sanitize_filename(filename, max_length=255):
@@ -28,28 +110,140 @@ class VideoProcessor:
             filename = 'unnamed'
         return filename
 
-    def download_file(self, url, dest_path, headers, gui_app, max_retries=5, retry_delay=2):
-        """下载文件，支持中途中断"""
+    def download_file(self, url, dest_path, headers, gui_app, max_retries=5, retry_delay=2,
+                      progress_callback=None, cancel_event=None, backup_urls=(), stats=None):
+        """下载文件，支持中途中断和断点续传；服务器支持 Range 时使用多连接分段下载
+数据先写入 dest_path + '.part'，续传状态记录在 .part.json 中，下载完成后再改名为 dest_path
+progress_callback(已下载字节数, 总字节数) 用于汇报进度，cancel_event 被置位时与暂停一样中断下载
+backup_urls 为备用镜像地址，分段下载时参与测速和故障切换，单连接下载时每次重试轮换一个地址
+每收到一块数据都要先从 self.bandwidth 取得令牌，gui_app 同时作为带宽分配的任务标识
+stats 为 metrics.StreamStats，下载结束时按结果记为 done、paused 或 error"""
+        with self.bandwidth.track(gui_app):
+            try:
+                result = self._download_file(url, dest_path, headers, gui_app, max_retries, retry_delay,
+                                             progress_callback, cancel_event, backup_urls, stats)
+            except BaseException:
+                if stats is not None:
+                    stats.finish('error')
+                raise
+        if stats is not None:
+            stats.finish('done' if result else 'paused')
+        return result
+
+    def _download_file(self, url, dest_path, headers, gui_app, max_retries, retry_delay,
+                       progress_callback, cancel_event, backup_urls, stats):
+        def should_stop():
+            return gui_app.stop_download or (cancel_event is not None and cancel_event.is_set())
+
+        def throttle(nbytes):
+            return self.bandwidth.consume(gui_app, nbytes, should_stop)
+
         os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        part_path = dest_path + '.part'
+        state_path = part_path + '.json'
+
+        if self.segmented_downloader is not None:
+            try:
+                result = self.segmented_downloader.download(
+                    url, part_path, headers, should_stop, max_retries, retry_delay, progress_callback,
+                    backup_urls, throttle, stats)
+                if result:
+                    os.replace(part_path, dest_path)
+                    print(f"下载完成：{os.path.basename(dest_path)}")
+                return result
+            except RangeNotSupported as ex:
+                print(f"服务器不支持分段下载（{ex}），回退到单连接下载")
 
+        urls = [url] + [u for u in backup_urls if u != url]
         attempt = 0
         while attempt < max_retries:
+            url = urls[attempt % len(urls)]  # 失败后换一个镜像重试
             try:
+                # 每次尝试都重新读取续传状态，从上次刷新到磁盘的位置继续
+                state = DownloadState.load(state_path)
+                offset = state.contiguous_bytes() if state and os.path.exists(part_path) else 0
+                if offset and offset == state.total and os.path.getsize(part_path) >= offset:
+                    # 上次已写完全部数据，只是还没来得及改名（例如进程在此时退出），不必再请求
+                    print("续传记录显示文件已下载完整")
+                    return self._finish_part(state, part_path, dest_path)
+                request_headers = dict(headers)
+                if offset:
+                    request_headers['Range'] = f'bytes={offset}-'
+                    validator = state.etag or state.last_modified
+                    if validator:
+                        request_headers['If-Range'] = validator  # 文件已变化时服务器返回 200 整个文件
+
                 print(f"正在尝试下载（尝试 {attempt + 1}/{max_retries}）：{url}")
-                with requests.get(url, headers=headers, stream=True, timeout=10) as r:
+                requested = time.monotonic()
+                with requests.get(url, headers=request_headers, stream=True, timeout=10) as r:
+                    if offset and r.status_code == 416:
+                        # 断点已在文件末尾或超出了文件：大小与记录一致时已下载完整，否则文件已变化，从头下载
+                        if self._content_range_total(r) == offset:
+                            print("服务器确认文件已下载完整")
+                            return self._finish_part(state, part_path, dest_path)
+                        print("服务器文件已变化，丢弃断点重新下载")
+                        state.remove()
+                        os.remove(part_path)
+                        continue
                     r.raise_for_status()
-                    with open(dest_path, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            if gui_app.stop_download:  # 检查是否中断下载
-                                print("下载已暂停")
-                                return False  # 下载被暂停，返回 False
-                            if chunk:  # 检查是否有内容，避免空块
-                                f.write(chunk)
-                print(f"下载完成：{os.path.basename(dest_path)}")
-                return True  # 成功下载
+                    if stats is not None:
+                        stats.ttfb(time.monotonic() - requested)
+                    if offset and r.status_code == 206 and not self._resume_matches(state, r):
+                        # 没有 ETag/Last-Modified 时 If-Range 无法生效，服务器文件变了也会返回 206，
+                        # 继续写入会把新文件拼接到旧数据后面，丢弃断点从头重新请求
+                        print("服务器文件大小或校验信息已变化，丢弃断点重新下载")
+                        state.remove()
+                        os.remove(part_path)
+                        continue
+                    if offset and r.status_code == 206:
+                        print(f"从第 {offset} 字节继续下载")
+                        mode = 'r+b'
+                    else:
+                        if offset:
+                            print("服务器文件已变化或不支持续传，重新开始下载")
+                        offset = 0
+                        length = r.headers.get('Content-Length', '')
+                        state = DownloadState(state_path, url, int(length) if length.isdigit() else None,
+                                              r.headers.get('ETag'), r.headers.get('Last-Modified'))
+                        mode = 'wb'
+
+                    with open(part_path, mode) as f:
+                        f.seek(offset)
+                        f.truncate()  # 丢弃断点之后可能不完整的数据
+                        if state.total:
+                            preallocate(f, state.total)
+                        pos = recorded = offset
+                        checkpointed_at = time.monotonic()
+                        stop_requested = StopChecker(should_stop)
+                        try:
+                            # 数据直接读入可复用的缓冲区，每块数百 KB 到数 MB，暂停检查按时间间隔进行
+                            for chunk in StreamReader(r):
+                                if stop_requested() or not throttle(len(chunk)):  # 检查是否中断下载，并按限速等待
+                                    print("下载已暂停")
+                                    return False  # 下载被暂停，返回 False
+                                if chunk:  # 检查是否有内容，避免空块
+                                    f.write(chunk)
+                                    pos += len(chunk)
+                                    if stats is not None:
+                                        stats.add(len(chunk))
+                                    if progress_callback is not None:
+                                        progress_callback(pos, state.total)
+                                    if checkpoint_due(pos - recorded, checkpointed_at):
+                                        state.checkpoint(f, recorded, pos)
+                                        recorded, checkpointed_at = pos, time.monotonic()
+                        finally:
+                            # 暂停或出错时同样记录已写入的部分，下次从这里继续
+                            state.checkpoint(f, recorded, pos)
+
+                if state.total is not None and pos < state.total:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"连接提前结束，已收到 {pos}/{state.total} 字节")
+                return self._finish_part(state, part_path, dest_path)  # 成功下载
             except requests.exceptions.RequestException as ex:
                 print(f"下载失败：{ex}")
                 attempt += 1
+                if stats is not None and attempt < max_retries:
+                    stats.retry(ex)
                 if attempt < max_retries:
                     print(f"等待 {retry_delay} 秒后重试...")
                     time.sleep(retry_delay)
@@ -58,11 +252,44 @@ class VideoProcessor:
                     raise ex
 
     @staticmethod
-    def get_highest_quality_video(video_info):
+    def _finish_part(state, part_path, dest_path):
+        # 下载完整：删除续传记录，把 .part 文件改名为目标文件
+        state.remove()
+        os.replace(part_path, dest_path)
+        print(f"下载完成：{os.path.basename(dest_path)}")
+        return True
+
+    @staticmethod
+    def _content_range_total(response):
+        # Content-Range（bytes 0-99/1000 或 bytes */1000）中的文件总大小，没有时返回 None
+        total = response.headers.get('Content-Range', '').rpartition('/')[2].strip()
+        return int(total) if total.isdigit() else None
+
+    @classmethod
+    def _resume_matches(cls, state, response):
+        # 续传请求返回 206 时，用 Content-Range 中的总大小和响应的 ETag/Last-Modified 核对断点记录的是否是同一个文件；
+        # 镜像的地址可能不同，不比较 URL
+        total = cls._content_range_total(response)
+        if total is not None and state.total is not None and total != state.total:
+            return False
+        return state.matches(state.url, state.total, response.headers.get('ETag'),
+                             response.headers.get('Last-Modified'))
+
+    @staticmethod
+    def get_highest_quality_stream(video_info):
+        # 获取最高质量的视频流
+        return max(video_info['data']['dash']['video'], key=lambda x: x.get('height', 0))
+
+    @staticmethod
+    def is_top_quality(video_info, video_stream):
+        """video_stream 是否是视频提供的最高清晰度（accept_quality 包含需要登录或大会员的清晰度）"""
+        accepted = video_info['data'].get('accept_quality') or []
+        return bool(accepted) and video_stream.get('id') == max(accepted)
+
+    @classmethod
+    def get_highest_quality_video(cls, video_info):
         # 获取最高质量的视频流的 URL
-        highest_quality = max(
-            video_info['data']['dash']['video'], key=lambda x: x.get('height', 0))
-        return highest_quality['base_url']
+        return cls.get_highest_quality_stream(video_info)['base_url']
 
     @staticmethod
     def get_video_duration(video_file):
@@ -84,14 +311,61 @@ class VideoProcessor:
             print(f"发生异常：{ex}")
             return None
 
-    def merge_audio_video(self, video_file, audio_file, output_folder, output_filename, progress_queue):
-        # 合并音频和视频文件，使用 FFmpeg
-        os.makedirs(output_folder, exist_ok=True)
-        output_file = os.path.join(output_folder, output_filename)
+    def merge_audio_video(self, video_file, audio_file, output_folder, output_filename, progress_queue,
+                          engine=None, video_id=None, record=None):
+        """把合并排入合并队列后立即返回，结果通过 progress_queue 报告；合并队列已满时先阻塞等待
+engine 为 None 时使用 self.merge_engine；给出 video_id 时记录排队时间和合并耗时；
+给出 record（download_index.record 的参数，不含路径和哈希）时，合并成功后登记到下载索引"""
+        progress_queue.put('merging')  # 下载已完成，任务进入合并阶段，不再响应暂停
+        self.merge_pipeline.submit(MergeTask(video_file, audio_file, output_folder, output_filename,
+                                             progress_queue, engine or self.merge_engine, video_id, record))
+
+    def _run_merge(self, task):
+        # 在合并工作线程中同步合并，成功返回 True；成功时先删除中间文件再发送完成信号
+        os.makedirs(task.output_folder, exist_ok=True)
+        output_file = os.path.join(task.output_folder, self.output_filename(task.record, task.output_filename))
+        progress_queue = task.progress_queue
+        started = time.monotonic()
+        used, status = task.engine, 'error'
+        try:
+            digest = None
+            if task.engine in ('auto', 'python'):
+                try:
+                    used = 'python'
+                    digest = hashlib.sha256()  # 写出时同时计算哈希
+                    remux(task.video_file, task.audio_file, output_file, progress_callback=progress_queue.put,
+                          digest=digest)
+                except RemuxError as ex:
+                    if task.engine == 'python':
+                        progress_queue.put(f"error: 内置合并失败：{ex}")
+                        return False
+                    print(f"内置合并失败（{ex}），改用 FFmpeg")
+                    digest = None
+            if digest is None:
+                used = 'ffmpeg'
+                if not self._merge_with_ffmpeg(task.video_file, task.audio_file, output_file, progress_queue):
+                    return False
+            status = 'done'
+            self.record_download(task.record, output_file, digest.hexdigest() if digest else None)
+            if not self.keep_intermediate:
+                task.remove_inputs()
+            progress_queue.put(100)    # 合并完成，进度 100%
+            progress_queue.put('done')  # 发送完成信号
+            return True
+        except Exception as ex:
+            progress_queue.put(f"error: {ex}")  # 捕获异常，发送错误信息
+            return False
+        finally:
+            if task.video_id is not None:
+                self.metrics.merge_finished(task.video_id, used, time.monotonic() - started, status,
+                                            task.wait_seconds)
 
+    def _merge_with_ffmpeg(self, video_file, audio_file, output_file, progress_queue):
+        # 使用 FFmpeg 合并，根据 ffprobe 得到的时长计算进度，成功返回 True，由调用方发送完成信号
         total_duration = self.get_video_duration(video_file)
         if total_duration is None:
-            return
+            progress_queue.put("error: 无法获取视频时长")
+            return False
 
         command = [
             'ffmpeg',
@@ -108,62 +382,243 @@ class VideoProcessor:
             output_file
         ]
 
-        def run_ffmpeg():
+        # 启动 FFmpeg 进程，开始合并音视频
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        while True:
+            line = process.stdout.readline()
+            if line == '':
+                if process.poll() is not None:
+                    break
+            else:
+                if line.startswith('out_time_ms='):
+                    # 读取输出时间，计算进度
+                    out_time_ms = int(line.strip().split('=')[1])
+                    progress = out_time_ms / (total_duration * 1000000) * 100
+                    progress_queue.put(progress)  # 将进度信息放入队列
+        if process.returncode == 0:
+            return True
+        progress_queue.put(f"error: {process.stderr.read()}")  # 发送错误信息
+        return False
+
+    def download_streams(self, streams, headers, progress_queue, gui_app):
+        """并发下载多个 (urls, dest_path, stats) 流，urls 为主地址在前的镜像地址列表，stats 可以为 None
+按字节数加权汇总进度放入 progress_queue
+任一流失败或被暂停时通知其余流停止，全部成功返回 True，被暂停返回 False，出错时抛出异常"""
+        cancel_event = threading.Event()
+        progress = CombinedProgress(len(streams), progress_queue)
+
+        def fetch(index, urls, dest_path, stats):
             try:
-                # 启动 FFmpeg 进程，开始合并音视频
-                process = subprocess.Popen(
-                    command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                while True:
-                    line = process.stdout.readline()
-                    if line == '':
-                        if process.poll() is not None:
-                            break
-                    else:
-                        if line.startswith('out_time_ms='):
-                            # 读取输出时间，计算进度
-                            out_time_ms = int(line.strip().split('=')[1])
-                            progress = out_time_ms / (total_duration * 1000000) * 100
-                            progress_queue.put(progress)  # 将进度信息放入队列
-                if process.returncode == 0:
-                    progress_queue.put(100)    # 合并完成，进度 100%
-                    progress_queue.put('done')  # 发送完成信号
-                else:
-                    progress_queue.put(f"error: {process.stderr.read()}")  # 发送错误信息
-            except Exception as ex:
-                progress_queue.put(f"error: {ex}")  # 捕获异常，发送错误信息
+                ok = self.download_file(urls[0], dest_path, headers, gui_app,
+                                        progress_callback=progress.callback(index),
+                                        cancel_event=cancel_event, backup_urls=urls[1:], stats=stats)
+            except BaseException:
+                cancel_event.set()  # 一个流出错，其余流也停止
+                raise
+            if not ok:
+                cancel_event.set()
+            return ok
 
-        # 使用线程启动 FFmpeg 合并，避免阻塞主线程
-        threading.Thread(target=run_ffmpeg).start()
+        with ThreadPoolExecutor(max_workers=len(streams)) as pool:
+            futures = [pool.submit(fetch, index, *stream) for index, stream in enumerate(streams)]
+            results = [future.result() for future in futures]
+        return all(results)
 
-    def process_video(self, video_id, headers, progress_queue, gui_app):
-        try:
-            # 使用已登录的浏览器访问视频页面
-            self.browser.get(f'https://www.bilibili.com/video/{video_id}/')
+    @property
+    def browser(self):
+        # 已登录的浏览器实例，第一次访问时才启动
+        return self.browser_manager.get_browser()
+
+    def fetch_page_with_browser(self, video_id, page=None):
+        # 使用已登录的浏览器访问视频页面，只有一个浏览器，需要加锁
+        query = f'?p={page}' if page and page > 1 else ''
+        with self.browser_lock:
+            browser = self.browser
+            browser.get(f'https://www.bilibili.com/video/{video_id}/{query}')
             time.sleep(3)  # 等待页面加载
+            return browser.page_source
 
-            # 解析页面内容，获取视频标题
-            soup = BeautifulSoup(self.browser.page_source, 'html.parser')
+    def parse_video_page(self, page_source):
+        """从页面源码中解析出 (标题, 文件名, 播放信息)"""
+        # 只扫描一遍页面，提取标题 meta 和播放信息 JSON
+        page_data = extract_page_data(page_source)
+        if page_data['title'] is None or page_data['playinfo'] is None:
+            raise ValueError("页面中缺少视频标题或播放信息")
 
-            title = soup.find('meta', attrs={'name': 'title'})['content']
-            title = re.sub(r'[_\-–—]*哔哩哔哩.*$', '', title)  # 去除标题中的后缀
-            title = re.sub(r'\s+', ' ', title).strip()
-            filename = self.sanitize_filename(title)  # 清理文件名
+        title = re.sub(r'[_\-–—]*哔哩哔哩.*$', '', page_data['title'])  # 去除标题中的后缀
+        title = re.sub(r'\s+', ' ', title).strip()
+        filename = self.sanitize_filename(title)  # 清理文件名
+        return title, filename, page_data['playinfo']
 
-            # 提取视频的播放信息
-            video_info = json.loads(
-                re.search(r'window\.__playinfo__=({.*?})\s*</script>', self.browser.page_source).group(1))
+    def get_video_info(self, video_id, refresh=False, page=None):
+        """获取视频的 (标题, 文件名, 播放信息)，优先使用缓存，其次走 HTTP，失败时回退到浏览器
+page 为分P序号，默认第一P；refresh=True 时忽略缓存重新获取，用于缓存中的流链接已失效的情况"""
+        key = part_key(video_id, page)
+        if refresh:
+            self.metadata_cache.invalidate(key)
+        else:
+            cached = self.metadata_cache.get(key)
+            if cached is not None:
+                return cached
 
-            # 获取最高质量的视频和音频流的 URL
-            video_url = self.get_highest_quality_video(video_info)
-            audio_url = video_info['data']['dash']['audio'][0]['base_url']
+        info = None
+        if self.http_session is not None:
+            try:
+                info = self.parse_video_page(self.http_session.fetch_video_page(video_id, page))
+            except (requests.exceptions.RequestException, PlayinfoNotFound,
+                    TypeError, AttributeError, ValueError) as ex:
+                print(f"通过 HTTP 获取 {key} 的视频信息失败（{ex}），改用浏览器")
+        if info is None:
+            info = self.parse_video_page(self.fetch_page_with_browser(video_id, page))
+        self.metadata_cache.put(key, *info)
+        return info
 
-            # 下载视频文件，传递 gui_app 参数
-            if not self.download_file(video_url, os.path.join('download', f"{filename}.mp4"), headers, gui_app):
-                progress_queue.put("error: 下载已暂停")
-                return  # 下载被暂停，直接退出
+    @staticmethod
+    def is_link_expired(ex):
+        # CDN 签名链接过期或失效时返回 403
+        response = getattr(ex, 'response', None)
+        return response is not None and response.status_code == 403
+
+    def stream_video(self, video_urls, audio_urls, filename, headers, progress_queue, gui_app,
+                     video_id=None, record=None):
+        """边下载边合并到 output 目录，完成或暂停时返回 True/False 并放入相应的进度消息
+video_urls/audio_urls 为主地址在前的镜像地址列表；不支持命名管道或 FFmpeg 出错时返回 None，调用方改用先下载再合并"""
+        if not StreamMerger.is_supported():
+            print("当前系统不支持命名管道或未找到 FFmpeg，改用先下载再合并")
+            return None
+        progress = CombinedProgress(2, progress_queue)
+
+        def should_stop():
+            return gui_app.stop_download
+
+        def throttle(nbytes):
+            return self.bandwidth.consume(gui_app, nbytes, should_stop)
+
+        stats = (self.metrics.stream(video_id, 'video'), self.metrics.stream(video_id, 'audio')) \
+            if video_id is not None else (None, None)
+        output_file = os.path.join('output', self.output_filename(record, f"{filename}.mp4"))
+        started = time.monotonic()
+        try:
+            with self.bandwidth.track(gui_app):
+                streamed = self.stream_merger.merge(
+                    video_urls, audio_urls, output_file, headers,
+                    should_stop, (progress.callback(0), progress.callback(1)), throttle=throttle,
+                    stats=stats)
+        except StreamMergeError as ex:
+            print(f"边下载边合并失败（{ex}），改用先下载再合并")
+            self._finish_stats(stats, 'error')
+            return None
+        except BaseException:
+            self._finish_stats(stats, 'error')
+            raise
+        self._finish_stats(stats, 'done' if streamed else 'paused')
+        if video_id is not None and streamed:
+            # 边下载边合并时合并与下载同时进行，记录的是整个过程的耗时
+            self.metrics.merge_finished(video_id, 'ffmpeg-stream', time.monotonic() - started, 'done')
+        if streamed:
+            self.record_download(record, output_file)
+            progress_queue.put(100)
+            progress_queue.put('done')
+        else:
+            progress_queue.put("error: 下载已暂停")
+        return streamed
+
+    def output_filename(self, record, default):
+        """开始写出输出文件前确定最终的文件名（含扩展名）：由下载索引分配的文件名在下载期间可能因重名而加上 BV 号"""
+        if self.download_index is None or record is None:
+            return default
+        try:
+            name = self.download_index.fix_filename(record['bvid'], record['page'])
+        except sqlite3.Error as ex:
+            print(f"读取分配的文件名失败: {ex}")
+            return default
+        return f"{name}.mp4" if name else default
+
+    def record_download(self, record, output_file, sha256=None):
+        """把合并完成的输出文件登记到下载索引，没有给出哈希时读取文件计算；登记失败不影响下载结果"""
+        if self.download_index is None or record is None:
+            return
+        try:
+            self.download_index.record(path=output_file, sha256=sha256 or file_sha256(output_file), **record)
+        except (sqlite3.Error, OSError) as ex:
+            print(f"登记下载记录失败: {ex}")
+
+    def account_id(self):
+        """当前登录账号的 mid，未登录为空字符串；没有 HTTP 会话、无法从 Cookie 得知时为 None"""
+        return self.http_session.account_id() if self.http_session is not None else None
+
+    @staticmethod
+    def _finish_stats(stats, status):
+        for item in stats:
+            if item is not None:
+                item.finish(status)
+
+    def process_video(self, video_id, headers, progress_queue, gui_app, page=None, part_title=None,
+                      cid=None, parts=None):
+        # page 为分P序号，默认第一P；给出 part_title（多P视频）时文件名为“标题 P序号 分P标题”
+        # cid 和 parts（视频的分P总数）只用于查询和登记下载索引
+        key = part_key(video_id, page)
+        try:
+            account = self.account_id()
+            if self.download_index is not None:
+                # 索引中有以当前账号或按最高清晰度下载的完整输出文件时直接完成，不发任何网络请求
+                entry = self.download_index.find(video_id, cid, page, account=account)
+                if entry is not None:
+                    print(f"{key} 已下载到 {entry['path']}，跳过")
+                    progress_queue.put(100)
+                    progress_queue.put('done')
+                    return
+
+            refresh = False
+            while True:
+                title, filename, video_info = self.get_video_info(video_id, refresh=refresh, page=page)
+                if part_title:
+                    filename = self.sanitize_filename(f"{title} P{page or 1} {part_title}")
+                if self.download_index is not None:
+                    # 不同视频的标题清理后可能相同，由索引分配不重名的文件名，避免互相覆盖
+                    filename = self.download_index.claim_filename(filename, video_id, page)
+
+                # 获取最高质量的视频和音频流的主地址和备用镜像地址
+                video_stream = self.get_highest_quality_stream(video_info)
+                video_urls = stream_urls(video_stream)
+                audio_urls = stream_urls(video_info['data']['dash']['audio'][0])
+                record = {'bvid': video_id, 'cid': cid, 'page': page, 'parts': parts,
+                          'quality': video_stream.get('id'), 'codec': video_stream.get('codecs'),
+                          'title': title, 'top_quality': self.is_top_quality(video_info, video_stream),
+                          'account': account}
+                if self.download_index is not None:
+                    # 已按同样的清晰度和编码下载过时跳过；之前的清晰度较低（例如当时未登录）则重新下载
+                    entry = self.download_index.find(video_id, cid, page, record['quality'], record['codec'])
+                    if entry is not None:
+                        print(f"{key} 已按相同清晰度下载到 {entry['path']}，跳过")
+                        progress_queue.put(100)
+                        progress_queue.put('done')
+                        return
+
+                try:
+                    if self.merge_mode == 'stream':
+                        streamed = self.stream_video(video_urls, audio_urls, filename, headers,
+                                                     progress_queue, gui_app, key, record)
+                        if streamed is not None:
+                            return
+
+                    # 视频流和音频流来自不同的 CDN 地址，同时下载
+                    downloaded = self.download_streams([
+                        (video_urls, os.path.join('download', f"{filename}.mp4"),
+                         self.metrics.stream(key, 'video')),
+                        (audio_urls, os.path.join('download', f"{filename}.mp3"),
+                         self.metrics.stream(key, 'audio')),
+                    ], headers, progress_queue, gui_app)
+                    break
+                except requests.exceptions.HTTPError as ex:
+                    if refresh or not self.is_link_expired(ex):
+                        raise
+                    # 缓存中的链接已失效，重新获取播放信息后再试一次，已下载的部分会续传
+                    print(f"{key} 的流链接已失效（{ex}），重新获取播放信息")
+                    refresh = True
 
-            # 下载音频文件，传递 gui_app 参数
-            if not self.download_file(audio_url, os.path.join('download', f"{filename}.mp3"), headers, gui_app):
+            if not downloaded:
                 progress_queue.put("error: 下载已暂停")
                 return  # 下载被暂停，直接退出
 
@@ -173,7 +628,9 @@ class VideoProcessor:
                 os.path.join('download', f"{filename}.mp3"),
                 'output',
                 f"{filename}.mp4",
-                progress_queue
+                progress_queue,
+                video_id=key,
+                record=record
             )
 
         except Exception as ex: